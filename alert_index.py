@@ -0,0 +1,247 @@
+import time
+import logging
+import threading
+from config import ALERT_INDEX_RELOAD_INTERVAL
+
+# Set up logging
+logging.basicConfig(
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    level=logging.INFO
+)
+logger = logging.getLogger(__name__)
+
+NEG_INF = float('-inf')
+POS_INF = float('inf')
+
+class AlertEntry:
+    """The matching criteria of an active property alert"""
+    __slots__ = ('id', 'user_id', 'location', 'min_price', 'max_price', 'min_bedrooms', 'low', 'high')
+
+    def __init__(self, id, user_id, location=None, min_price=None, max_price=None, min_bedrooms=None):
+        self.id = id
+        self.user_id = user_id
+        self.location = location or None  # An empty location means all locations
+        self.min_price = min_price
+        self.max_price = max_price
+        self.min_bedrooms = min_bedrooms
+        # Price interval with missing bounds open-ended
+        self.low = min_price if min_price is not None else NEG_INF
+        self.high = max_price if max_price is not None else POS_INF
+
+    @classmethod
+    def from_alert(cls, alert):
+        """Create an entry from a PropertyAlert (or anything with the same attributes)"""
+        return cls(alert.id, alert.user_id, alert.location, alert.min_price, alert.max_price, alert.min_bedrooms)
+
+    def __repr__(self):
+        return f"<AlertEntry {self.id}: user_id={self.user_id}>"
+
+class _IntervalNode:
+    """Node of a centered interval tree over alert price bounds"""
+    __slots__ = ('center', 'by_low', 'by_high', 'left', 'right')
+
+    def __init__(self, center, by_low, by_high, left, right):
+        self.center = center
+        self.by_low = by_low
+        self.by_high = by_high
+        self.left = left
+        self.right = right
+
+def _build_interval_tree(entries):
+    """Build a centered interval tree; each node holds the intervals containing its center"""
+    if not entries:
+        return None
+
+    endpoints = sorted(
+        value for entry in entries for value in (entry.low, entry.high) if value not in (NEG_INF, POS_INF)
+    )
+    center = endpoints[len(endpoints) // 2] if endpoints else 0
+
+    left, right, here = [], [], []
+    for entry in entries:
+        if entry.high < center:
+            left.append(entry)
+        elif entry.low > center:
+            right.append(entry)
+        else:
+            here.append(entry)
+
+    by_low = sorted(here, key=lambda entry: entry.low)
+    by_high = sorted(here, key=lambda entry: entry.high, reverse=True)
+    return _IntervalNode(center, by_low, by_high, _build_interval_tree(left), _build_interval_tree(right))
+
+def _stab(node, price, results):
+    """Collect the entries whose price interval contains the price"""
+    while node is not None:
+        if price < node.center:
+            # Every interval here ends at or after the center, so only the start matters
+            for entry in node.by_low:
+                if entry.low > price:
+                    break
+                results.append(entry)
+            node = node.left
+        elif price > node.center:
+            # Every interval here starts at or before the center, so only the end matters
+            for entry in node.by_high:
+                if entry.high < price:
+                    break
+                results.append(entry)
+            node = node.right
+        else:
+            results.extend(node.by_low)
+            return
+
+class _PriceGroup:
+    """Alerts sharing a location and bedroom threshold, indexed by their price bounds"""
+    __slots__ = ('entries', 'tree', 'dirty')
+
+    def __init__(self):
+        self.entries = {}
+        self.tree = None
+        self.dirty = False
+
+    def match(self, price, results):
+        if price is None:
+            # Listings without a numeric price skip the price filters
+            results.extend(self.entries.values())
+            return
+        if self.dirty:
+            # Rebuilt lazily, so a burst of alert changes costs one rebuild
+            # Alerts with min_price above max_price can never match a numeric price
+            self.tree = _build_interval_tree([entry for entry in self.entries.values() if entry.low <= entry.high])
+            self.dirty = False
+        _stab(self.tree, price, results)
+
+class AlertIndex:
+    """
+    In-memory index of active property alerts for matching new listings
+
+    Alerts are bucketed by location (None holds the "all locations" alerts),
+    then by minimum bedrooms, and each bucket keeps an interval tree over the
+    price bounds. Matching a listing costs roughly the number of matching
+    alerts instead of the number of alerts.
+    """
+
+    def __init__(self):
+        # Structure: {location: {min_bedrooms: _PriceGroup}}
+        self._buckets = {}
+        # Structure: {alert_id: AlertEntry}
+        self._entries = {}
+        self._lock = threading.Lock()
+        self.loaded_at = None
+        # Version of the property_alerts data version row the index reflects, None if unknown
+        self.version = None
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, alert_id):
+        return alert_id in self._entries
+
+    def _group(self, entry, create=False):
+        groups = self._buckets.get(entry.location)
+        if groups is None:
+            if not create:
+                return None
+            groups = self._buckets[entry.location] = {}
+        group = groups.get(entry.min_bedrooms)
+        if group is None and create:
+            group = groups[entry.min_bedrooms] = _PriceGroup()
+        return group
+
+    def add(self, alert):
+        """Add or replace an active alert"""
+        entry = alert if isinstance(alert, AlertEntry) else AlertEntry.from_alert(alert)
+        with self._lock:
+            self._remove(entry.id)
+            group = self._group(entry, create=True)
+            group.entries[entry.id] = entry
+            group.dirty = True
+            self._entries[entry.id] = entry
+
+    def remove(self, alert_id):
+        """Remove an alert that was deactivated or deleted"""
+        with self._lock:
+            self._remove(alert_id)
+
+    def _remove(self, alert_id):
+        entry = self._entries.pop(alert_id, None)
+        if entry is None:
+            return
+        group = self._group(entry)
+        if group is not None:
+            group.entries.pop(alert_id, None)
+            group.dirty = True
+
+    def replace_all(self, alerts, version=None):
+        """Replace the indexed alerts with a fresh set, read at the given data version"""
+        with self._lock:
+            self._buckets = {}
+            self._entries = {}
+            for alert in alerts:
+                entry = alert if isinstance(alert, AlertEntry) else AlertEntry.from_alert(alert)
+                group = self._group(entry, create=True)
+                group.entries[entry.id] = entry
+                group.dirty = True
+                self._entries[entry.id] = entry
+            self.loaded_at = time.time()
+            self.version = version
+
+    def advance_version(self, version):
+        """
+        Take the data version bumped by a write this process already applied to the index
+
+        When another process wrote in between, the versions don't follow on and
+        the next ensure_alert_index_loaded() reloads the index instead.
+        """
+        with self._lock:
+            if self.version is not None and version == self.version + 1:
+                self.version = version
+
+    def match(self, location, price, bedrooms):
+        """
+        Find the alerts that match a listing
+
+        Args:
+            location (str): Location of the listing
+            price (int): Numeric price of the listing, or None if it has none
+            bedrooms (int): Number of bedrooms, or None if unknown
+
+        Returns:
+            list: Matching AlertEntry objects
+        """
+        results = []
+        with self._lock:
+            for bucket_location in (location, None) if location is not None else (None,):
+                groups = self._buckets.get(bucket_location)
+                if not groups:
+                    continue
+                for min_bedrooms, group in groups.items():
+                    if min_bedrooms is not None and (bedrooms is None or bedrooms < min_bedrooms):
+                        continue
+                    group.match(price, results)
+        return results
+
+# Process-wide index of active alerts
+alert_index = AlertIndex()
+
+def ensure_alert_index_loaded(load_alerts, current_version=None):
+    """
+    Load the alert index if it is empty, behind the database or due for a periodic reload
+
+    Every alert write bumps a version row in the same transaction, so comparing
+    it catches alerts created or deactivated by other processes before the next
+    listing is matched. The periodic reload is a backstop for changes made
+    outside the application.
+
+    Args:
+        load_alerts (function): Returns all active alerts from the database
+        current_version (int): Current property_alerts data version, or None if it couldn't be read
+    """
+    if (alert_index.loaded_at is not None
+            and (current_version is None or current_version == alert_index.version)
+            and time.time() - alert_index.loaded_at < ALERT_INDEX_RELOAD_INTERVAL):
+        return
+    alerts = load_alerts()
+    alert_index.replace_all(alerts, current_version)
+    logger.info(f"Loaded {len(alert_index)} active alerts into the alert index")
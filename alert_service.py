@@ -1,15 +1,47 @@
+import os
+import time
+import random
+import socket
 import logging
 import asyncio
-import time
 from datetime import datetime, timedelta
+from telegram import Bot
+from telegram.constants import MessageLimit
+from telegram.error import BadRequest, Forbidden, RetryAfter, TelegramError
 from app import app
-from api import fetch_properties
+from api import fetch_properties, fetch_property, invalidate_catalog_caches, note_catalog_version
+from config import (
+    TELEGRAM_TOKEN,
+    TELEGRAM_API_URL,
+    NOTIFICATION_WORKERS,
+    NOTIFICATION_BATCH_SIZE,
+    NOTIFICATION_CLAIM_TIMEOUT,
+    NOTIFICATION_MAX_ATTEMPTS,
+    NOTIFICATION_RETRY_BASE,
+    NOTIFICATION_RETRY_MAX,
+    NOTIFICATION_POLL_INTERVAL,
+    NOTIFICATION_SEND_INTERVAL,
+    RECONCILE_INTERVAL,
+    RECONCILE_MIN_INTERVAL,
+    RECONCILE_MAX_INTERVAL,
+    ALERT_DELIVERY_MODES,
+    DIGEST_DAILY_HOUR,
+    DIGEST_BATCH_CHATS,
+    DIGEST_MAX_ITEMS,
+    METRICS_PORT
+)
 from db_helpers import (
-    save_property_listing, 
-    get_users_for_notifications,
-    record_notification
+    CATALOG_VERSION,
+    bump_data_version,
+    sync_property_listings,
+    remove_property_listings,
+    get_notification_targets,
+    enqueue_notifications
 )
-from utils import format_property_message, get_property_image_url
+import async_db
+from utils import format_property_message, format_digest_line, get_property_image_url
+from scheduler import Job
+from metrics import ALERT_SYNC_SECONDS, ALERT_SYNC_LISTINGS, NOTIFICATIONS, MeteredHTTPXRequest, start_metrics_server
 
 # Set up logging
 logging.basicConfig(
@@ -18,106 +50,539 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-# Global variables for sync
-last_check_time = None
-check_interval = 30 * 60  # Check for new properties every 30 minutes
+# Delivery counters of the workers in this process; get_outbox_stats() covers all workers
+delivery_stats = {"claimed": 0, "delivered": 0, "retried": 0, "failed": 0, "total_lag": 0.0, "max_lag": 0.0}
 
-async def check_for_new_properties(bot):
-    """Check for new properties and send alerts to subscribed users"""
-    global last_check_time
-    
-    logger.info("Checking for new properties...")
-    current_time = time.time()
+# Until when Telegram's flood control holds back the workers in this process
+flood_control = {"until": datetime.min}
+
+def record_sync_metrics(trigger, started, changes):
+    """Record the duration of a sync and the listings it added, changed and removed"""
+    ALERT_SYNC_SECONDS.labels(trigger).observe(time.perf_counter() - started)
+    for change, count in changes.items():
+        if count:
+            ALERT_SYNC_LISTINGS.labels(change).inc(count)
+
+def reconcile_catalog():
+    """
+    Reconcile the stored listings with the full catalog and queue alerts for subscribed users
     
-    # Skip if we checked recently
-    if last_check_time and (current_time - last_check_time < check_interval):
-        remaining = int(check_interval - (current_time - last_check_time))
-        logger.info(f"Skipping property check, next check in {remaining} seconds")
-        return
+    Runs as a scheduled job; webhooks deliver most changes between runs.
     
-    # Update the last check time
-    last_check_time = current_time
+    Returns:
+        int: Number of listings added, changed or removed, which the scheduler
+            uses to adapt how often it reconciles
+    """
+    logger.info("Reconciling the property catalog...")
+    started = time.perf_counter()
     
-    # Fetch all properties from the API
-    properties = fetch_properties()
+    # Fetch all properties from the API, bypassing the cached catalog
+    properties = fetch_properties.refresh()
     if not properties:
-        logger.warning("Failed to fetch properties from API")
-        return
+        raise RuntimeError("Failed to fetch properties from API")
     
     logger.info(f"Fetched {len(properties)} properties from API")
     
-    # Process each property with the Flask app context
+    # Diff the whole catalog against the stored listings
     with app.app_context():
-        for property_data in properties:
-            # Save property to database (this will track if it's new)
-            property_listing = save_property_listing(property_data)
-            
-            if not property_listing:
-                logger.warning(f"Failed to save property: {property_data.get('id')}")
-                continue
-            
-            # Check if this is a new property (created within the last check interval)
-            time_threshold = datetime.utcnow() - timedelta(seconds=check_interval)
-            if property_listing.first_seen >= time_threshold:
-                logger.info(f"New property detected: {property_listing.title}")
-                
-                # Find users who should be notified based on alert preferences
-                users_to_notify = get_users_for_notifications(property_listing)
-                
-                if users_to_notify:
-                    logger.info(f"Sending alerts to {len(users_to_notify)} users")
-                    await send_property_alerts(bot, users_to_notify, property_listing, property_data)
-                else:
-                    logger.info("No users match alert criteria for this property")
+        synced = sync_property_listings(properties)
+    if synced is None:
+        raise RuntimeError("Failed to save properties")
+    
+    queue_property_alerts(properties, synced)
+    changes = {key: len(synced[key]) for key in ("added", "changed", "removed")}
+    record_sync_metrics("reconcile", started, changes)
+    return sum(changes.values())
+
+def announce_catalog_change():
+    """Invalidate the catalog caches here and, through the catalog data version, in bot processes with their own cache"""
+    invalidate_catalog_caches()
+    with app.app_context():
+        version = bump_data_version(CATALOG_VERSION)
+    note_catalog_version(version, local=True)
 
-async def send_property_alerts(bot, users, property_listing, property_data):
-    """Send alerts about a new property to subscribed users"""
-    # Format the property message
-    message = format_property_message(property_data)
-    message = f"🔔 *NEW PROPERTY ALERT* 🔔\n\n{message}"
+def sync_property(property_id, action):
+    """
+    Sync a single property pushed by a WordPress webhook and queue its alerts right away
     
-    # Get property image URL
-    image_url = get_property_image_url(property_data)
+    Args:
+        property_id (int): WordPress property ID
+        action (str): "publish", "update", "delete", "trash" or "unpublish"
     
-    # Send notification to each user
-    for user in users:
-        try:
-            # Record that we're sending this notification
-            with app.app_context():
-                record_notification(user.id, property_listing.id)
-            
-            # Send the property alert
-            if image_url:
-                await bot.send_photo(
-                    chat_id=user.telegram_id,
-                    photo=image_url,
-                    caption=message,
-                    parse_mode="Markdown"
-                )
+    Returns:
+        dict: Number of listings added, changed and removed, or None if the sync failed
+    """
+    started = time.perf_counter()
+    property_data = {}
+    if action not in ('delete', 'trash', 'unpublish'):
+        # Fetch the property rather than trusting the payload, so it has the API's shape
+        property_data = fetch_property(property_id)
+        if property_data is None:
+            return None
+    
+    if not property_data:
+        with app.app_context():
+            removed = remove_property_listings([property_id])
+        if removed is None:
+            return None
+        if removed:
+            announce_catalog_change()
+        changes = {"added": 0, "changed": 0, "removed": removed}
+        record_sync_metrics("webhook", started, changes)
+        return changes
+    
+    with app.app_context():
+        synced = sync_property_listings([property_data], complete=False)
+    if synced is None:
+        return None
+    if synced["added"] or synced["changed"]:
+        # Browsing shows the change now instead of after the cache expires
+        announce_catalog_change()
+    queue_property_alerts([property_data], synced)
+    changes = {key: len(synced[key]) for key in ("added", "changed", "removed")}
+    record_sync_metrics("webhook", started, changes)
+    return changes
+
+def queue_property_alerts(properties, synced):
+    """
+    Queue alerts for the new listings and price drops found by a sync
+    
+    Args:
+        properties (list): Property dictionaries from the API that were synced
+        synced (dict): Result of sync_property_listings
+    """
+    with app.app_context():
+        for listing in synced["added"]:
+            logger.info(f"New property detected: {listing.title}")
+        price_drops = {}
+        for listing, diff in synced["changed"]:
+            dropped_from = get_price_drop(diff)
+            if dropped_from is not None:
+                logger.info(f"Price drop detected: {listing.title}")
+                price_drops[listing.id] = (listing, dropped_from)
+        
+        if not synced["added"] and not price_drops:
+            return
+        
+        # Find every user to notify, with one query per kind of event
+        targets = get_notification_targets(synced["added"])
+        targets += get_notification_targets([listing for listing, _ in price_drops.values()], price_drops=True)
+        if not targets:
+            logger.info("No users match alert criteria for the new properties or price drops")
+            return
+    
+    property_data_by_wp_id = {property_data.get('id'): property_data for property_data in properties}
+    wp_ids = {listing.id: listing.wp_id for listing in synced["added"]}
+    wp_ids.update({listing_id: listing.wp_id for listing_id, (listing, _) in price_drops.items()})
+    
+    # Render each message once per property, event and delivery mode
+    rendered = {}
+    digest_windows = {mode: digest_window_end(mode) for mode in ALERT_DELIVERY_MODES if mode != 'instant'}
+    notifications = []
+    for target in targets:
+        instant = target.delivery_mode == 'instant'
+        key = (target.property_id, target.event, instant)
+        if key not in rendered:
+            property_data = property_data_by_wp_id[wp_ids[target.property_id]]
+            dropped_from = price_drops[target.property_id][1] if target.event != 'new' else None
+            if not instant:
+                # Digests list each property on one line, without a photo
+                rendered[key] = (format_digest_line(property_data, dropped_from), None)
             else:
-                await bot.send_message(
-                    chat_id=user.telegram_id,
-                    text=message,
-                    parse_mode="Markdown"
+                if dropped_from is None:
+                    header = "🔔 *NEW PROPERTY ALERT* 🔔"
+                else:
+                    header = f"📉 *PRICE DROP* 📉\nWas {dropped_from:,}"
+                rendered[key] = (
+                    f"{header}\n\n{format_property_message(property_data)}",
+                    get_property_image_url(property_data)
                 )
-            
-            logger.info(f"Sent property alert to user {user.telegram_id}")
-            
-            # Sleep briefly to avoid hitting rate limits
-            await asyncio.sleep(0.5)
-            
-        except Exception as e:
-            logger.error(f"Error sending property alert to user {user.telegram_id}: {e}")
+        message, image_url = rendered[key]
+        notification = {
+            "user_id": target.user_id,
+            "property_id": target.property_id,
+            "event": target.event,
+            "telegram_id": target.telegram_id,
+            "message": message,
+            "image_url": image_url[:255] if image_url else None,
+            "digest": None,
+            "next_attempt_at": datetime.utcnow()
+        }
+        if not instant:
+            # Held back until the user's digest window closes
+            notification["digest"] = target.delivery_mode
+            notification["next_attempt_at"] = digest_windows[target.delivery_mode]
+        notifications.append(notification)
+    
+    # The delivery workers pick them up from the outbox
+    with app.app_context():
+        enqueue_notifications(notifications)
+
+def listing_property_data(listing):
+    """Build the parts of an API property dictionary that format_digest_line uses from a stored listing"""
+    return {
+        "title": {"rendered": listing.title},
+        "link": listing.property_url or '#',
+        "acf": {"location": listing.location, "price": listing.price, "bedrooms": listing.bedrooms}
+    }
+
+async def queue_alert_backfill(alert, telegram_id, limit=DIGEST_MAX_ITEMS):
+    """
+    Queue the current listings that match a new alert, delivered together as one digest
+    
+    The lines are rendered from the stored listings, so no API request is made.
+    The notifications use the "new" event, so a listing is never sent twice
+    to the same user.
+    
+    Args:
+        alert (PropertyAlert): The alert that was just created
+        telegram_id (int): Telegram ID of the alert's user
+        limit (int): Maximum number of listings to send
+    
+    Returns:
+        int: Number of notifications queued
+    """
+    listings = await async_db.get_matching_properties_for_alert(alert, limit=limit, unnotified=True)
+    if not listings:
+        return 0
+    now = datetime.utcnow()
+    notifications = [
+        {
+            "user_id": alert.user_id,
+            "property_id": listing.id,
+            "event": 'new',
+            "telegram_id": telegram_id,
+            "message": format_digest_line(listing_property_data(listing)),
+            "image_url": None,
+            # Picked up right away by the digest delivery of the workers
+            "digest": 'backfill',
+            "next_attempt_at": now
+        }
+        for listing in listings
+    ]
+    return await async_db.enqueue_notifications(notifications)
+
+def digest_window_end(mode, now=None):
+    """
+    Get when the current window of a digest closes, in UTC
+    
+    Args:
+        mode (str): "hourly" or "daily"
+        now (datetime): Current UTC time, defaults to now
+    
+    Returns:
+        datetime: Start of the next hour, or the next DIGEST_DAILY_HOUR
+    """
+    now = now or datetime.utcnow()
+    if mode == 'hourly':
+        return now.replace(minute=0, second=0, microsecond=0) + timedelta(hours=1)
+    window_end = now.replace(hour=DIGEST_DAILY_HOUR, minute=0, second=0, microsecond=0)
+    if window_end <= now:
+        window_end += timedelta(days=1)
+    return window_end
+
+def get_price_drop(diff):
+    """
+    Get the previous price if a listing diff is a price drop
+    
+    Args:
+        diff (dict): Changed columns of a listing, {column: (old, new)}
+    
+    Returns:
+        int: The old numeric price, or None if the price didn't drop
+    """
+    old_price, new_price = diff.get('price_value', (None, None))
+    if old_price is None or new_price is None or new_price >= old_price:
+        return None
+    return old_price
+
+async def send_notification(bot, notification):
+    """Send a queued notification, as a photo with a caption if it has an image"""
+    if notification.image_url:
+        try:
+            await bot.send_photo(
+                chat_id=notification.telegram_id,
+                photo=notification.image_url,
+                caption=notification.message,
+                parse_mode="Markdown"
+            )
+            return
+        except BadRequest as e:
+            # A broken image or an over-long caption shouldn't cost the user the alert
+            logger.warning(f"Sending notification {notification.id} as text instead of a photo: {e}")
+    
+    await bot.send_message(
+        chat_id=notification.telegram_id,
+        text=notification.message,
+        parse_mode="Markdown"
+    )
+
+def retry_delay(attempts):
+    """Get the exponential backoff, with jitter, before the next attempt of a notification"""
+    delay = min(NOTIFICATION_RETRY_MAX, NOTIFICATION_RETRY_BASE * 2 ** (attempts - 1))
+    return delay * random.uniform(0.8, 1.2)
+
+async def attempt_delivery(send, attempts):
+    """
+    Make one delivery attempt and classify its failure
+    
+    Args:
+        send (coroutine): Sends the message(s) to Telegram
+        attempts (int): Attempts made so far, including this one
+    
+    Returns:
+        tuple: (error, retry_at) where error is None on success and retry_at is
+            None when the notification should be given up on
+    
+    Raises:
+        RetryAfter: Telegram's flood control, which holds back the rest of the batch too
+    """
+    try:
+        await send
+    except RetryAfter:
+        # A TelegramError too, but not one of this notification alone
+        raise
+    except Forbidden as e:
+        # The user blocked the bot; retrying can't succeed
+        return str(e), None
+    except BadRequest as e:
+        # The message itself was rejected, e.g. the chat no longer exists
+        return str(e), None
+    except TelegramError as e:
+        # Network errors and timeouts are worth retrying
+        if attempts < NOTIFICATION_MAX_ATTEMPTS:
+            return str(e), datetime.utcnow() + timedelta(seconds=retry_delay(attempts))
+        return str(e), None
+    return None, None
+
+async def record_delivery(notification_ids, worker_id, created_at):
+    """Mark notifications delivered and count them in the delivery metrics"""
+    delivered = await async_db.mark_notifications_delivered(notification_ids, worker_id)
+    if delivered:
+        lag = (datetime.utcnow() - created_at).total_seconds()
+        delivery_stats["delivered"] += delivered
+        delivery_stats["total_lag"] += lag * delivered
+        delivery_stats["max_lag"] = max(delivery_stats["max_lag"], lag)
+        NOTIFICATIONS.labels("delivered").inc(delivered)
+    return delivered
+
+async def record_failure(notification_ids, worker_id, attempts, error, retry_at):
+    """Release notifications after a failed attempt and count them in the delivery metrics"""
+    await async_db.mark_notifications_failed(notification_ids, worker_id, error, retry_at)
+    if retry_at is None:
+        delivery_stats["failed"] += len(notification_ids)
+        NOTIFICATIONS.labels("failed").inc(len(notification_ids))
+        logger.error(f"Giving up on notifications {notification_ids}: {error}")
+    else:
+        delivery_stats["retried"] += len(notification_ids)
+        NOTIFICATIONS.labels("retried").inc(len(notification_ids))
+        logger.warning(f"Notifications {notification_ids} failed (attempt {attempts}), retrying: {error}")
+
+async def defer_for_flood_control(notification_ids, worker_id, error):
+    """
+    Release the unsent rest of a batch until Telegram's flood control lifts
+    
+    Sleeping it off would keep the rows claimed, and another worker could
+    reclaim them once the claim times out; released, they are due again as
+    soon as Telegram accepts messages.
+    """
+    retry_after = error.retry_after if isinstance(error.retry_after, (int, float)) else error.retry_after.total_seconds()
+    retry_at = datetime.utcnow() + timedelta(seconds=retry_after)
+    flood_control["until"] = max(flood_control["until"], retry_at)
+    await async_db.mark_notifications_failed(notification_ids, worker_id, str(error), retry_at)
+    delivery_stats["retried"] += len(notification_ids)
+    NOTIFICATIONS.labels("retried").inc(len(notification_ids))
+    logger.warning(f"{worker_id} hit flood control, releasing {len(notification_ids)} notifications for {retry_after:.0f} s")
 
-async def start_property_alert_service(bot):
-    """Start the background task that checks for new properties and sends alerts"""
-    logger.info("Starting property alert service...")
+def log_delivery_batch(worker_id, kind, delivered, claimed, started):
+    """Log the throughput of a delivery batch and the average lag so far"""
+    elapsed = time.time() - started
+    lag = delivery_stats["total_lag"] / delivery_stats["delivered"] if delivery_stats["delivered"] else 0
+    logger.info(
+        f"{worker_id} delivered {delivered}/{claimed} {kind} in {elapsed:.1f} s "
+        f"({delivered / elapsed if elapsed else 0:.1f}/s, average lag {lag:.0f} s)"
+    )
+
+async def deliver_notifications(bot, worker_id):
+    """
+    Claim a batch of due instant notifications from the outbox and deliver them
+    
+    A notification is only marked as delivered after Telegram accepted it, so a
+    crash or an error leaves it in the outbox to be retried.
+    
+    Returns:
+        int: Number of notifications claimed
+    """
+    claimed = await async_db.claim_notifications(worker_id, NOTIFICATION_BATCH_SIZE, NOTIFICATION_CLAIM_TIMEOUT)
+    if not claimed:
+        return 0
+    
+    delivery_stats["claimed"] += len(claimed)
+    started = time.time()
+    delivered = 0
+    
+    for index, notification in enumerate(claimed):
+        try:
+            error, retry_at = await attempt_delivery(send_notification(bot, notification), notification.attempts)
+        except RetryAfter as e:
+            await defer_for_flood_control([unsent.id for unsent in claimed[index:]], worker_id, e)
+            break
+        if error is None:
+            delivered += await record_delivery([notification.id], worker_id, notification.created_at)
+            await asyncio.sleep(NOTIFICATION_SEND_INTERVAL)
+        else:
+            await record_failure([notification.id], worker_id, notification.attempts, error, retry_at)
+    
+    log_delivery_batch(worker_id, "notifications", delivered, len(claimed), started)
+    return len(claimed)
+
+def telegram_length(text):
+    """Length of a text as Telegram counts it, in UTF-16 code units"""
+    return len(text.encode('utf-16-le')) // 2
+
+def format_digest(notifications):
+    """
+    Combine the claimed digest lines of one chat into a single message
+    
+    A claim holds at most DIGEST_MAX_ITEMS lines of a digest, and the message
+    takes as many of them as fit in Telegram's message length. The header
+    counts every due line; the ones left out follow in the next message.
+    
+    Returns:
+        tuple: (message text, the notifications it includes)
+    """
+    mode = notifications[0].digest
+    total = max(notifications[0].pending, len(notifications))
+    if mode == 'backfill':
+        header = f"📋 *Current listings matching your new alert* - {total} properties"
+    else:
+        header = f"🗞 *Your {mode} property digest* - {total} matching updates"
+    
+    def footer(remaining):
+        return f"\n\n...and {remaining} more in the next message. Use /search to browse all listings."
+    
+    # Keep room for the longest footer; the first line is always included
+    budget = MessageLimit.MAX_TEXT_LENGTH - telegram_length(header) - telegram_length(footer(total))
+    included = []
+    for notification in notifications:
+        size = telegram_length(notification.message) + 2
+        if included and size > budget:
+            break
+        included.append(notification)
+        budget -= size
+    
+    message = f"{header}\n\n" + "\n".join(notification.message for notification in included)
+    if total > len(included):
+        message += footer(total - len(included))
+    return message, included
+
+async def send_digest(bot, telegram_id, text):
+    """Send a digest message, once more as plain text if Telegram rejects it"""
+    try:
+        await bot.send_message(chat_id=telegram_id, text=text, parse_mode="Markdown", disable_web_page_preview=True)
+    except BadRequest as e:
+        # Usually Markdown Telegram can't parse, e.g. in a line queued before titles were escaped;
+        # that shouldn't cost the chat the whole digest. Any other rejection fails again below.
+        logger.warning(f"Sending a digest to {telegram_id} without Markdown: {e}")
+        await bot.send_message(chat_id=telegram_id, text=text, disable_web_page_preview=True)
+
+async def deliver_digests(bot, worker_id):
+    """
+    Claim the digest notifications whose window closed and send one message per chat
+    
+    The due digest rows of up to DIGEST_BATCH_CHATS chats are claimed with one
+    query, at most DIGEST_MAX_ITEMS per message, and each message's rows are
+    marked delivered with one statement.
+    
+    Returns:
+        int: Number of notifications claimed
+    """
+    claimed = await async_db.claim_notifications(worker_id, DIGEST_BATCH_CHATS, NOTIFICATION_CLAIM_TIMEOUT, digest=True)
+    if not claimed:
+        return 0
+    
+    delivery_stats["claimed"] += len(claimed)
+    started = time.time()
+    delivered = 0
+    
+    # A chat gets one message per kind of digest, so a backfill isn't mixed into a daily digest
+    by_chat = {}
+    for notification in claimed:
+        by_chat.setdefault((notification.telegram_id, notification.digest), []).append(notification)
+    
+    messages = list(by_chat.items())
+    for index, ((telegram_id, _), notifications) in enumerate(messages):
+        text, included = format_digest(notifications)
+        if len(included) < len(notifications):
+            # Lines that didn't fit go back to the outbox for the next message
+            deferred = [notification.id for notification in notifications[len(included):]]
+            await async_db.mark_notifications_failed(deferred, worker_id, "Did not fit in the digest message", datetime.utcnow())
+        ids = [notification.id for notification in included]
+        attempts = max(notification.attempts for notification in included)
+        try:
+            error, retry_at = await attempt_delivery(send_digest(bot, telegram_id, text), attempts)
+        except RetryAfter as e:
+            # This message's lines and every later chat's wait for flood control to lift
+            unsent = ids + [notification.id for _, later in messages[index + 1:] for notification in later]
+            await defer_for_flood_control(unsent, worker_id, e)
+            break
+        if error is None:
+            oldest = min(notification.created_at for notification in notifications)
+            delivered += await record_delivery(ids, worker_id, oldest)
+            await asyncio.sleep(NOTIFICATION_SEND_INTERVAL)
+        else:
+            await record_failure(ids, worker_id, attempts, error, retry_at)
+    
+    log_delivery_batch(worker_id, f"digest notifications in {len(by_chat)} messages", delivered, len(claimed), started)
+    return len(claimed)
+
+async def start_notification_worker(bot, worker_number=0):
+    """Start a delivery worker; any number of them can run in any number of processes"""
+    worker_id = f"{socket.gethostname()}:{os.getpid()}:{worker_number}"
+    logger.info(f"Starting notification worker {worker_id}...")
     
     while True:
+        # Flood control applies to the whole bot, so claim nothing until it lifts
+        wait = (flood_control["until"] - datetime.utcnow()).total_seconds()
+        if wait > 0:
+            await asyncio.sleep(wait)
+        
         try:
-            await check_for_new_properties(bot)
+            claimed = await deliver_notifications(bot, worker_id)
+            claimed += await deliver_digests(bot, worker_id)
         except Exception as e:
-            logger.error(f"Error in property alert service: {e}")
+            logger.error(f"Error in notification worker {worker_id}: {e}")
+            claimed = 0
         
-        # Check for new properties on a schedule
-        await asyncio.sleep(60)  # Check every minute if it's time to run the full check
\ No newline at end of file
+        # Keep going while there is a backlog, otherwise poll for due notifications
+        if not claimed:
+            await asyncio.sleep(NOTIFICATION_POLL_INTERVAL)
+
+def schedule_alert_jobs(scheduler):
+    """Register the catalog reconciliation with the scheduler"""
+    scheduler.add(Job(
+        "reconcile_catalog",
+        reconcile_catalog,
+        interval=RECONCILE_INTERVAL,
+        min_interval=RECONCILE_MIN_INTERVAL,
+        max_interval=RECONCILE_MAX_INTERVAL
+    ))
+
+async def run_notification_workers():
+    """Run delivery workers without the bot, to add delivery capacity to the outbox"""
+    bot = Bot(TELEGRAM_TOKEN, base_url=TELEGRAM_API_URL, request=MeteredHTTPXRequest())
+    try:
+        async with bot:
+            await asyncio.gather(*(
+                start_notification_worker(bot, worker_number) for worker_number in range(NOTIFICATION_WORKERS)
+            ))
+    finally:
+        await async_db.dispose_engine()
+
+if __name__ == "__main__":
+    from migrations import migrate
+    with app.app_context():
+        migrate()
+    if METRICS_PORT:
+        start_metrics_server(METRICS_PORT)
+    asyncio.run(run_notification_workers())
@@ -1,49 +1,201 @@
 import requests
 import logging
 import time
-from functools import lru_cache
+import hashlib
+from functools import lru_cache, wraps
 from config import WP_API_URL, PARAMS, ERROR_MESSAGES, CACHE_TTL
+from cache_backend import get_cache_backend, CacheNamespace
+from utils import compact_properties
+from metrics import CACHE_LOOKUPS, WP_REQUEST_SECONDS, WP_REQUESTS, WP_RESPONSE_BYTES
+from tracing import span
 
 # Set up logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Dictionary to store cached data with expiration times
-_cache = {}
+# Cached API results with their fetch times, in the configured (possibly shared) backend
+_cache = CacheNamespace(get_cache_backend(), "catalog", CACHE_TTL)
 
-def timed_cache(seconds=CACHE_TTL):
+# Namespaces holding data derived from the catalog, invalidated when its content changes
+CATALOG_NAMESPACES = ("catalog", "display")
+
+# Last successfully fetched catalog, kept so readers can be served while a refresh is running
+_catalog_snapshot = {"properties": None, "fetched_at": 0}
+
+# Last catalog data version seen in the database, see note_catalog_version
+_catalog_version = {"seen": None}
+
+def _get(endpoint, url, **kwargs):
+    """
+    requests.get() that records the latency, status and size of the response, and traces it
+    
+    Args:
+        endpoint (str): Metrics label of the request: catalog, property or location
+        url (str): URL to fetch
+        **kwargs: Passed on to requests.get()
+    """
+    started = time.perf_counter()
+    status = "error"
+    try:
+        with span(f"wordpress.{endpoint}", url=url) as current:
+            response = requests.get(url, **kwargs)
+            status = response.status_code
+            current.set_attribute("status", status)
+            current.set_attribute("bytes", len(response.content))
+        WP_RESPONSE_BYTES.labels(endpoint).inc(len(response.content))
+        return response
+    finally:
+        WP_REQUEST_SECONDS.labels(endpoint).observe(time.perf_counter() - started)
+        WP_REQUESTS.labels(endpoint, status).inc()
+
+def _get_all_pages(endpoint, url, params):
+    """
+    Fetch every page of a WordPress collection
+    
+    WordPress returns at most per_page items per request and the number of pages
+    in the X-WP-TotalPages header. Without the header, pages are fetched until
+    one comes back short or WordPress answers that the page is out of range.
+    
+    Args:
+        endpoint (str): Metrics label of the requests
+        url (str): Collection URL
+        params (dict): Query parameters, including per_page
+    
+    Returns:
+        tuple: (list of all items, list of the response bodies)
+    """
+    items = []
+    bodies = []
+    page = 1
+    while True:
+        response = _get(endpoint, url, params={**params, "page": page})
+        if page > 1 and response.status_code == 400:
+            # rest_post_invalid_page_number: the previous page was the last one
+            break
+        response.raise_for_status()
+        batch = response.json()
+        items.extend(batch)
+        bodies.append(response.content)
+        total_pages = response.headers.get("X-WP-TotalPages")
+        if total_pages is not None:
+            if page >= int(total_pages):
+                break
+        elif len(batch) < params.get("per_page", 10):
+            break
+        page += 1
+    return items, bodies
+
+def timed_cache(seconds=CACHE_TTL, compact=None):
     """
     Create a cache decorator with time-based expiration
     
     Args:
         seconds (int): Time to live for cached results in seconds
+        compact (function): Optional function that slims a result down before
+            it is serialized into a cache shared with other processes
         
     Returns:
         function: Decorator for caching function results
     """
     def decorator(func):
+        def store(key, result):
+            stored = compact(result) if compact and _cache.backend.shared else result
+            _cache.set(key, (stored, time.time()), ttl=seconds)
+        
+        @wraps(func)
         def wrapper(*args, **kwargs):
-            key = str(args) + str(kwargs)
+            key = func.__name__ + str(args) + str(kwargs)
             
             # Check if we have a cached result and it's still valid
-            if key in _cache:
-                result, timestamp = _cache[key]
-                if time.time() - timestamp < seconds:
-                    logger.info(f"Cache hit for {func.__name__}: Using cached data")
-                    return result
+            with span("cache.catalog", function=func.__name__) as current:
+                cached = _cache.get(key)
+                hit = cached is not None and time.time() - cached[1] < seconds
+                current.set_attribute("hit", hit)
+            if hit:
+                logger.info(f"Cache hit for {func.__name__}: Using cached data")
+                CACHE_LOOKUPS.labels("catalog", "hit").inc()
+                return cached[0]
             
             # Get fresh result
             logger.info(f"Cache miss for {func.__name__}: Fetching fresh data")
+            CACHE_LOOKUPS.labels("catalog", "miss").inc()
             result = func(*args, **kwargs)
-            _cache[key] = (result, time.time())
+            store(key, result)
             return result
+        
+        def refresh(*args, **kwargs):
+            """Fetch a fresh result and replace the cached one, even if it hasn't expired"""
+            key = func.__name__ + str(args) + str(kwargs)
+            result = func(*args, **kwargs)
+            store(key, result)
+            return result
+        
+        wrapper.refresh = refresh
         return wrapper
     return decorator
 
-@timed_cache()
+def note_catalog_content(content):
+    """
+    Invalidate catalog-derived caches in every worker when the catalog content changes
+    
+    Args:
+        content (bytes): Bodies of the catalog pages just fetched from WordPress
+    """
+    # Hashing the body as received costs a few ms, instead of compacting and serializing every property again
+    digest = hashlib.sha1(content).hexdigest()
+    
+    backend = get_cache_backend()
+    if backend.get("catalog_digest") == digest:
+        return
+    
+    backend.set("catalog_digest", digest, 7 * 24 * 60 * 60)
+    invalidate_catalog_caches()
+    logger.info(f"Catalog content changed (digest {digest[:12]}), invalidated cached catalog data")
+
+def invalidate_catalog_caches():
+    """Invalidate the cached catalog and everything derived from it, in every worker"""
+    backend = get_cache_backend()
+    for namespace in CATALOG_NAMESPACES:
+        backend.bump_version(namespace)
+    # Inline queries serve the snapshot until it is older than CACHE_TTL, so make it due for a refresh
+    _catalog_snapshot["fetched_at"] = 0
+
+def note_catalog_version(version, local=False):
+    """
+    Drop the cached catalog when another process announced a catalog change
+    
+    Webhook syncs run under gunicorn and bump the catalog data version in the
+    database. Their invalidation only reaches the bot through a shared cache
+    backend; with "memory://" the bot learns about it here instead.
+    
+    Args:
+        version (int): Current catalog data version, or None if it couldn't be read
+        local (bool): Whether this process made the change and invalidated its caches already
+    
+    Returns:
+        bool: Whether the caches of this process were invalidated
+    """
+    if version is None:
+        return False
+    seen = _catalog_version["seen"]
+    _catalog_version["seen"] = version
+    if local or seen is None or seen == version:
+        return False
+    if get_cache_backend().shared:
+        # The webhook already invalidated the shared namespaces; only the snapshot is per process
+        _catalog_snapshot["fetched_at"] = 0
+    else:
+        invalidate_catalog_caches()
+    logger.info(f"Catalog changed in another process (version {version}), invalidated cached catalog data")
+    return True
+
+@timed_cache(compact=compact_properties)
 def fetch_properties():
     """
-    Fetch all properties from the WordPress API
+    Fetch all properties from the WordPress API, every page of them
+    
+    A sync treats the result as the complete catalog and marks listings missing
+    from it as removed, so a failed page fails the whole fetch.
     
     Returns:
         list: List of property dictionaries or None if there was an error
@@ -53,16 +205,69 @@ def fetch_properties():
         embed_url = f"{WP_API_URL}?_embed"
         logger.info(f"Fetching properties from {embed_url}")
         
-        response = requests.get(embed_url, params=PARAMS)
-        response.raise_for_status()  # Raise exception for 4XX/5XX responses
-        
-        properties = response.json()
-        logger.info(f"Successfully fetched {len(properties)} properties with embedded data")
+        properties, bodies = _get_all_pages("catalog", embed_url, PARAMS)
+        logger.info(f"Successfully fetched {len(properties)} properties with embedded data in {len(bodies)} pages")
+        _catalog_snapshot["properties"] = properties
+        _catalog_snapshot["fetched_at"] = time.time()
+        note_catalog_content(b"".join(bodies))
         return properties
-    except requests.exceptions.RequestException as e:
+    except (requests.exceptions.RequestException, ValueError) as e:
         logger.error(f"Error fetching properties: {e}")
         return None
 
+def fetch_property(property_id):
+    """
+    Fetch a single property from the WordPress API, bypassing the caches
+    
+    Args:
+        property_id (int): WordPress property ID
+    
+    Returns:
+        dict: The property, an empty dictionary if it isn't published (anymore),
+            or None if there was an error
+    """
+    try:
+        property_url = f"{WP_API_URL}/{int(property_id)}"
+        logger.info(f"Fetching property from {property_url}")
+        
+        response = _get("property", property_url, params={"_embed": True}, timeout=10)
+        # Drafts and private posts answer 401/403, deleted ones 404 or 410
+        if response.status_code in (401, 403, 404, 410):
+            return {}
+        response.raise_for_status()
+        return response.json()
+    except (requests.exceptions.RequestException, ValueError) as e:
+        logger.error(f"Error fetching property {property_id}: {e}")
+        return None
+
+def load_catalog_snapshot():
+    """
+    Get the catalog from the cache or the API and make it the current snapshot
+    
+    The body of fetch_properties doesn't run when another worker already put the
+    catalog in a shared cache, so the snapshot is updated here as well.
+    
+    Returns:
+        list: List of property dictionaries or None if there was an error
+    """
+    properties = fetch_properties()
+    if properties is not None and properties is not _catalog_snapshot["properties"]:
+        _catalog_snapshot["properties"] = properties
+        _catalog_snapshot["fetched_at"] = time.time()
+    return properties
+
+def get_catalog_snapshot():
+    """
+    Get the last successfully fetched catalog without making any API request
+    
+    Returns:
+        tuple: (list of property dictionaries or None, age of the catalog in seconds)
+    """
+    properties = _catalog_snapshot["properties"]
+    if properties is None:
+        return None, None
+    return properties, time.time() - _catalog_snapshot["fetched_at"]
+
 @timed_cache()
 def get_locations():
     """
@@ -104,7 +309,7 @@ def get_locations():
     logger.info(f"Extracted {len(locations)} unique locations: {locations}")
     return locations
 
-@timed_cache()
+@timed_cache(compact=compact_properties)
 def get_properties_by_location(location):
     """
     Filter properties by location using direct API filtering
@@ -136,10 +341,7 @@ def get_properties_by_location(location):
         filter_params = {"_embed": True, "per_page": 100}
         logger.info(f"Fetching properties by location from {filter_url}")
         
-        response = requests.get(filter_url, params=filter_params)
-        response.raise_for_status()
-        
-        properties = response.json()
+        properties, _ = _get_all_pages("location", filter_url, filter_params)
         logger.info(f"Found {len(properties)} properties in {location} with embedded data")
         
         return properties if properties else None
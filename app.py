@@ -1,7 +1,14 @@
 import os
 import logging
-from flask import Flask, render_template, jsonify, redirect, url_for, request
-from models import db, User, PropertyAlert, PropertyListing
+from flask import Flask, Response, render_template, jsonify, make_response, redirect, url_for, request
+from models import db
+from db_helpers import get_outbox_stats, get_job_states, get_dashboard_counts
+from sent_filter import sent_filter
+from dashboard_stats import dashboard_stats
+from config import STATS_CACHE_MAX_AGE
+from db_backend import engine_options, configure_engine
+from metrics import REGISTRY, CONTENT_TYPE, instrument_engine
+from tracing import tracer
 
 # Set up logging
 logging.basicConfig(
@@ -13,92 +20,62 @@ logger = logging.getLogger(__name__)
 # Create and configure the app
 app = Flask(__name__)
 app.secret_key = os.environ.get("SESSION_SECRET", "avierpropertybotalertsecret")
+# PostgreSQL, or a sqlite:/// URL for the embedded single-node mode
 app.config["SQLALCHEMY_DATABASE_URI"] = os.environ.get("DATABASE_URL")
-app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
-    "pool_recycle": 300,
-    "pool_pre_ping": True,
-}
+app.config["SQLALCHEMY_ENGINE_OPTIONS"] = engine_options(os.environ.get("DATABASE_URL", ""))
 app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
 
 # Initialize the app with the database extension
 db.init_app(app)
+with app.app_context():
+    configure_engine(db.engine)
+    instrument_engine(db.engine, "sync")
 
-# Create templates folder if it doesn't exist
-templates_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'templates')
-if not os.path.exists(templates_dir):
-    os.makedirs(templates_dir)
-
-# Create a basic index.html template
-index_html = """
-<!DOCTYPE html>
-<html lang="en">
-<head>
-    <meta charset="UTF-8">
-    <meta name="viewport" content="width=device-width, initial-scale=1.0">
-    <title>Avier Homes Property Bot</title>
-    <link href="https://cdn.replit.com/agent/bootstrap-agent-dark-theme.min.css" rel="stylesheet">
-</head>
-<body class="bg-dark text-light">
-    <div class="container py-5">
-        <div class="row justify-content-center">
-            <div class="col-md-8">
-                <div class="card bg-dark">
-                    <div class="card-body">
-                        <h1 class="card-title text-center mb-4">Avier Homes Property Bot</h1>
-                        <p class="lead text-center">
-                            Welcome to the Avier Homes Property Bot dashboard.
-                        </p>
-                        <div class="mt-4">
-                            <h2>Bot Status</h2>
-                            <p>The Telegram bot is currently running. Access it on Telegram by searching for <strong>@AvierHomesBot</strong>.</p>
-                            
-                            <h2 class="mt-4">Statistics</h2>
-                            <ul class="list-group list-group-flush bg-dark">
-                                <li class="list-group-item bg-dark">Users: <span class="badge bg-primary">{{ user_count }}</span></li>
-                                <li class="list-group-item bg-dark">Properties: <span class="badge bg-success">{{ property_count }}</span></li>
-                                <li class="list-group-item bg-dark">Alerts: <span class="badge bg-info">{{ alert_count }}</span></li>
-                            </ul>
-                        </div>
-                    </div>
-                </div>
-            </div>
-        </div>
-    </div>
-</body>
-</html>
-"""
-
-# Create the template file
-with open(os.path.join(templates_dir, 'index.html'), 'w') as f:
-    f.write(index_html)
+def cached_response(response, etag):
+    """Let clients reuse a response for STATS_CACHE_MAX_AGE and revalidate it by ETag"""
+    response.cache_control.public = True
+    response.cache_control.max_age = STATS_CACHE_MAX_AGE
+    response.set_etag(etag, weak=True)
+    return response.make_conditional(request)
 
 # Routes
 @app.route('/')
 def index():
-    """Homepage with bot statistics"""
-    # No need for app context here - we're already in a request
-    user_count = User.query.count()
-    property_count = PropertyListing.query.count()
-    alert_count = PropertyAlert.query.count()
-    
-    return render_template('index.html', 
-                          user_count=user_count,
-                          property_count=property_count,
-                          alert_count=alert_count)
+    """Homepage with bot statistics, served from the in-memory counters"""
+    dashboard_stats.reconcile(get_dashboard_counts)
+    figures, etag = dashboard_stats.snapshot()
+    return cached_response(make_response(render_template('index.html', stats=figures)), f"html-{etag}")
+
+@app.route('/stats')
+def stats():
+    """Dashboard statistics as JSON, served from the in-memory counters"""
+    dashboard_stats.reconcile(get_dashboard_counts)
+    figures, etag = dashboard_stats.snapshot()
+    return cached_response(jsonify(figures), etag)
 
 @app.route('/status')
 def status():
     """API status endpoint"""
     return jsonify({
         'status': 'online',
-        'service': 'Avier Homes Property Bot'
+        'service': 'Avier Homes Property Bot',
+        'notification_outbox': get_outbox_stats(),
+        'jobs': get_job_states(),
+        'sent_filter': sent_filter.info()
     })
 
-# Initialize database tables
-with app.app_context():
-    logger.info("Creating database tables...")
-    db.create_all()
-    logger.info("Database tables created successfully")
+@app.route('/metrics')
+def metrics():
+    """Prometheus metrics of this process"""
+    return Response(REGISTRY.render(), content_type=CONTENT_TYPE)
+
+@app.route('/traces')
+def traces():
+    """Slowest and most recent traces of this process, e.g. of webhook calls"""
+    return jsonify(tracer.export())
 
 if __name__ == "__main__":
+    from migrations import migrate
+    with app.app_context():
+        migrate()
     app.run(host="0.0.0.0", port=5000, debug=True)
\ No newline at end of file
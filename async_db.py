@@ -0,0 +1,474 @@
+import os
+import logging
+from datetime import datetime
+from sqlalchemy import DateTime, String, bindparam, case, delete, func, or_, select, update
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from models import User, PropertyAlert, PropertyListing, DataVersion
+from alert_index import alert_index
+from sent_filter import sent_filter
+from dashboard_stats import dashboard_stats
+from db_backend import insert, is_sqlite, configure_engine
+from metrics import instrument_engine
+from db_helpers import (
+    normalize_property_listing,
+    listing_payloads_statement,
+    listing_payload_rows,
+    count_matching_statement,
+    matching_properties_statement,
+    sent_notifications_statement,
+    enqueue_statement,
+    ALERTS_VERSION,
+    bump_version_statement,
+    claim_statement,
+    pending_digests_statement,
+    with_pending_counts,
+    delivered_statement,
+    failed_statement
+)
+from config import (
+    BOT_CONCURRENT_UPDATES,
+    NOTIFICATION_WORKERS,
+    ASYNC_DB_POOL_SIZE,
+    ASYNC_DB_MAX_OVERFLOW,
+    ASYNC_DB_POOL_TIMEOUT,
+    LISTING_RAW_PAYLOADS
+)
+
+# Set up logging
+logging.basicConfig(
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    level=logging.INFO
+)
+logger = logging.getLogger(__name__)
+
+# Async counterparts of the db_helpers operations used by the bot handlers and the
+# delivery workers. They run on asyncpg without a Flask app context, so a handler
+# waiting on the database doesn't block the event loop. The Flask dashboard and
+# the catalog sync (which runs in a thread) keep the sync path in db_helpers;
+# both paths build their statements with the same db_helpers functions.
+
+_engine = None
+_sessionmaker = None
+
+def async_database_url(url):
+    """Turn a DATABASE_URL into one for the asyncpg driver, or aiosqlite in the SQLite mode"""
+    if is_sqlite(url):
+        return make_url(url).set(drivername="sqlite+aiosqlite")
+    url = make_url(url.replace("postgres://", "postgresql://", 1))
+    query = dict(url.query)
+    # asyncpg takes "ssl" where libpq takes "sslmode"
+    if "sslmode" in query:
+        query["ssl"] = query.pop("sslmode")
+    return url.set(drivername="postgresql+asyncpg", query=query)
+
+def get_sessionmaker():
+    """Get the session factory, creating the engine and its pool on first use"""
+    global _engine, _sessionmaker
+    if _sessionmaker is None:
+        # One connection per concurrent handler and per delivery worker, so none of them waits on the pool
+        pool_size = ASYNC_DB_POOL_SIZE or BOT_CONCURRENT_UPDATES + NOTIFICATION_WORKERS + 1
+        _engine = create_async_engine(
+            async_database_url(os.environ["DATABASE_URL"]),
+            pool_size=pool_size,
+            max_overflow=ASYNC_DB_MAX_OVERFLOW,
+            pool_timeout=ASYNC_DB_POOL_TIMEOUT,
+            pool_recycle=300,
+            pool_pre_ping=True
+        )
+        configure_engine(_engine.sync_engine)
+        instrument_engine(_engine.sync_engine, "async")
+        _sessionmaker = async_sessionmaker(_engine, expire_on_commit=False)
+        logger.info(f"Created async database pool of {pool_size} connections (+{ASYNC_DB_MAX_OVERFLOW} overflow)")
+    return _sessionmaker
+
+def session():
+    """Open an async session; use as "async with session() as db_session" """
+    return get_sessionmaker()()
+
+async def dispose_engine():
+    """Close the pooled connections, e.g. on shutdown"""
+    global _engine, _sessionmaker
+    if _engine is not None:
+        await _engine.dispose()
+        _engine = _sessionmaker = None
+
+# Users are updated in batches of this many rows
+USER_ACTIVITY_BATCH_SIZE = 1000
+
+def _profile_values(first_name, last_name, username):
+    """SET values that update the profile fields Telegram sent, as in db_helpers"""
+    return {
+        "first_name": func.coalesce(func.nullif(first_name, ''), User.first_name),
+        "last_name": func.coalesce(func.nullif(last_name, ''), User.last_name),
+        "username": func.coalesce(func.nullif(username, ''), User.username)
+    }
+
+async def get_or_create_user(telegram_id, first_name=None, last_name=None, username=None):
+    """
+    Get an existing user or create a new one
+
+    An existing user is updated and returned by one UPDATE ... RETURNING; only a
+    new user takes the upsert, whose ON CONFLICT clause SQLAlchemy compiles anew
+    on every call.
+    """
+    now = datetime.utcnow()
+    profile = _profile_values(first_name, last_name, username)
+    try:
+        async with session() as db_session:
+            user = (await db_session.scalars(
+                update(User).where(User.telegram_id == telegram_id)
+                .values(last_interaction=now, **profile)
+                .returning(User)
+            )).first()
+            if user is None:
+                statement = insert(User).values(
+                    telegram_id=telegram_id,
+                    first_name=first_name,
+                    last_name=last_name,
+                    username=username,
+                    created_at=now,
+                    is_active=True,
+                    last_interaction=now
+                )
+                # Another handler may have created the user since the UPDATE
+                statement = statement.on_conflict_do_update(
+                    index_elements=[User.telegram_id],
+                    set_={"last_interaction": now, **profile}
+                ).returning(User)
+                user = (await db_session.scalars(select(User).from_statement(statement))).one()
+                if user.created_at == now:
+                    dashboard_stats.user_added()
+                logger.info(f"Created new user: {user}")
+            await db_session.commit()
+            return user
+    except SQLAlchemyError as e:
+        logger.error(f"Database error while getting/creating user: {e}")
+        return None
+
+async def upsert_user(telegram_id, first_name=None, last_name=None, username=None):
+    """
+    Create a user or update an existing one with a single upsert
+
+    Returns:
+        int: ID of the user, or None on a database error
+    """
+    now = datetime.utcnow()
+    statement = insert(User).values(
+        telegram_id=telegram_id,
+        first_name=first_name,
+        last_name=last_name,
+        username=username,
+        created_at=now,
+        is_active=True,
+        last_interaction=now
+    )
+    statement = statement.on_conflict_do_update(
+        index_elements=[User.telegram_id],
+        set_={"last_interaction": now, **_profile_values(first_name, last_name, username)}
+    ).returning(User.id, User.created_at)
+    try:
+        async with session() as db_session:
+            user_id, created_at = (await db_session.execute(statement)).one()
+            await db_session.commit()
+        # created_at isn't updated on conflict, so it only equals now for a new user
+        if created_at == now:
+            dashboard_stats.user_added()
+        return user_id
+    except SQLAlchemyError as e:
+        logger.error(f"Database error while upserting user: {e}")
+        return None
+
+async def update_user_activity(rows):
+    """
+    Write the last interaction and profile changes of many users, one executemany UPDATE per batch
+
+    Args:
+        rows (list): (user_id, last_interaction, first_name, last_name, username) tuples;
+            a None profile field is left unchanged
+
+    Returns:
+        int: Number of users written, or None on a database error
+    """
+    users = User.__table__
+    statement = update(users).where(users.c.id == bindparam("user_id")).values(
+        # Another process may have written a later interaction
+        last_interaction=case(
+            (users.c.last_interaction > bindparam("interaction", type_=DateTime), users.c.last_interaction),
+            else_=bindparam("interaction", type_=DateTime)
+        ),
+        first_name=func.coalesce(bindparam("new_first_name", type_=String), users.c.first_name),
+        last_name=func.coalesce(bindparam("new_last_name", type_=String), users.c.last_name),
+        username=func.coalesce(bindparam("new_username", type_=String), users.c.username)
+    )
+    fields = ("user_id", "interaction", "new_first_name", "new_last_name", "new_username")
+    try:
+        async with session() as db_session:
+            for start in range(0, len(rows), USER_ACTIVITY_BATCH_SIZE):
+                await db_session.execute(
+                    statement, [dict(zip(fields, row)) for row in rows[start:start + USER_ACTIVITY_BATCH_SIZE]]
+                )
+            await db_session.commit()
+        # executemany reports no reliable row count, and every row is an existing user
+        return len(rows)
+    except SQLAlchemyError as e:
+        logger.error(f"Database error while updating user activity: {e}")
+        return None
+
+async def create_property_alert(user_id, location=None, min_price=None, max_price=None, min_bedrooms=None,
+                                notify_price_drops=False, delivery_mode='instant'):
+    """Create a property alert subscription for a user"""
+    try:
+        async with session() as db_session:
+            alert = PropertyAlert(
+                user_id=user_id,
+                location=location,
+                min_price=min_price,
+                max_price=max_price,
+                min_bedrooms=min_bedrooms,
+                notify_price_drops=notify_price_drops,
+                delivery_mode=delivery_mode
+            )
+            db_session.add(alert)
+            version = (await db_session.execute(bump_version_statement(ALERTS_VERSION))).scalar()
+            await db_session.commit()
+        alert_index.add(alert)
+        alert_index.advance_version(version)
+        dashboard_stats.alert_added(location)
+        logger.info(f"Created property alert: {alert}")
+        return alert
+    except SQLAlchemyError as e:
+        logger.error(f"Database error while creating property alert: {e}")
+        return None
+
+async def get_user_alerts(user_id):
+    """Get all active property alerts for a user"""
+    try:
+        async with session() as db_session:
+            return (await db_session.scalars(
+                select(PropertyAlert)
+                .where(PropertyAlert.user_id == user_id, PropertyAlert.is_active.is_(True))
+                .order_by(PropertyAlert.id)
+            )).all()
+    except SQLAlchemyError as e:
+        logger.error(f"Database error while getting user alerts: {e}")
+        return []
+
+async def get_user_alert(alert_id, user_id):
+    """Get an active property alert by ID, ensuring it belongs to the specified user"""
+    try:
+        async with session() as db_session:
+            return (await db_session.scalars(
+                select(PropertyAlert).where(
+                    PropertyAlert.id == alert_id, PropertyAlert.user_id == user_id, PropertyAlert.is_active.is_(True)
+                )
+            )).first()
+    except SQLAlchemyError as e:
+        logger.error(f"Database error while getting property alert: {e}")
+        return None
+
+async def delete_property_alert(alert_id, user_id):
+    """Delete a property alert by ID, ensuring it belongs to the specified user"""
+    try:
+        async with session() as db_session:
+            deleted = (await db_session.execute(
+                delete(PropertyAlert)
+                .where(PropertyAlert.id == alert_id, PropertyAlert.user_id == user_id)
+                .returning(PropertyAlert.location, PropertyAlert.is_active)
+            )).first()
+            if deleted:
+                version = (await db_session.execute(bump_version_statement(ALERTS_VERSION))).scalar()
+            await db_session.commit()
+        if deleted:
+            alert_index.remove(alert_id)
+            alert_index.advance_version(version)
+            if deleted.is_active:
+                dashboard_stats.alert_removed(deleted.location)
+            logger.info(f"Deleted property alert {alert_id} of user {user_id}")
+        return deleted is not None
+    except SQLAlchemyError as e:
+        logger.error(f"Database error while deleting property alert: {e}")
+        return False
+
+async def deactivate_property_alert(alert_id, user_id):
+    """Deactivate a property alert by ID, ensuring it belongs to the specified user"""
+    try:
+        async with session() as db_session:
+            deactivated = (await db_session.execute(
+                update(PropertyAlert)
+                .where(PropertyAlert.id == alert_id, PropertyAlert.user_id == user_id)
+                .values(is_active=False)
+                .returning(PropertyAlert.location)
+            )).first()
+            if deactivated:
+                version = (await db_session.execute(bump_version_statement(ALERTS_VERSION))).scalar()
+            await db_session.commit()
+        if deactivated:
+            alert_index.remove(alert_id)
+            alert_index.advance_version(version)
+            # The bot only offers active alerts; deactivating one twice is corrected by the next reconcile
+            dashboard_stats.alert_removed(deactivated.location)
+            logger.info(f"Deactivated property alert {alert_id} of user {user_id}")
+        return deactivated is not None
+    except SQLAlchemyError as e:
+        logger.error(f"Database error while deactivating property alert: {e}")
+        return False
+
+async def get_data_version(name):
+    """Current version of a data version counter (0 before the first write), or None on a database error"""
+    try:
+        async with session() as db_session:
+            version = await db_session.scalar(select(DataVersion.version).where(DataVersion.name == name))
+            return version or 0
+    except SQLAlchemyError as e:
+        logger.error(f"Database error while reading data version {name}: {e}")
+        return None
+
+async def count_matching_properties(location=None, min_price=None, max_price=None, min_bedrooms=None):
+    """
+    Count the current listings that match alert criteria, for a preview while the alert is created
+
+    Returns:
+        int: Number of matching listings, or None on a database error
+    """
+    try:
+        async with session() as db_session:
+            return (await db_session.execute(
+                count_matching_statement(location, min_price, max_price, min_bedrooms)
+            )).scalar()
+    except SQLAlchemyError as e:
+        logger.error(f"Database error while counting matching properties: {e}")
+        return None
+
+async def get_matching_properties_for_alert(alert, limit=None, unnotified=False):
+    """Get the current properties that match the criteria in a PropertyAlert, newest first"""
+    try:
+        async with session() as db_session:
+            return (await db_session.scalars(matching_properties_statement(alert, limit, unnotified))).all()
+    except SQLAlchemyError as e:
+        logger.error(f"Database error while getting matching properties: {e}")
+        return []
+
+async def save_property_listing(property_data):
+    """
+    Save a property from the API with a single upsert
+
+    An existing listing is only rewritten when its content changed or it was removed.
+
+    Returns:
+        int: ID of the listing, or None on an error
+    """
+    values = normalize_property_listing(property_data)
+    if not values:
+        logger.error("Property data missing ID")
+        return None
+    now = datetime.utcnow()
+    statement = insert(PropertyListing).values(**values, first_seen=now, last_updated=now)
+    statement = statement.on_conflict_do_update(
+        index_elements=[PropertyListing.wp_id],
+        set_={**{column: statement.excluded[column] for column in values if column != "wp_id"},
+              "last_updated": now, "removed_at": None},
+        where=or_(
+            PropertyListing.content_hash.is_distinct_from(statement.excluded.content_hash),
+            PropertyListing.removed_at.isnot(None)
+        )
+    ).returning(PropertyListing.id)
+    try:
+        async with session() as db_session:
+            listing_id = (await db_session.execute(statement)).scalar()
+            if listing_id is None:
+                # Unchanged, so the upsert wrote nothing
+                listing_id = (await db_session.execute(
+                    select(PropertyListing.id).where(PropertyListing.wp_id == values["wp_id"])
+                )).scalar()
+            elif LISTING_RAW_PAYLOADS:
+                await db_session.execute(
+                    listing_payloads_statement(), listing_payload_rows({values["content_hash"]: property_data})
+                )
+            await db_session.commit()
+            return listing_id
+    except SQLAlchemyError as e:
+        logger.error(f"Database error while saving property: {e}")
+        return None
+
+async def record_notifications(notifications):
+    """Record a batch of (user_id, property_id, event) notifications in one statement, skipping ones already sent"""
+    if not notifications:
+        return 0
+    try:
+        async with session() as db_session:
+            result = await db_session.execute(sent_notifications_statement(notifications))
+            await db_session.commit()
+        for user_id, property_id, event in notifications:
+            sent_filter.add(user_id, property_id, event)
+        return result.rowcount
+    except SQLAlchemyError as e:
+        logger.error(f"Database error while recording notifications: {e}")
+        return 0
+
+async def record_notification(user_id, property_id, event='new'):
+    """Record that a notification was sent to avoid duplicate alerts"""
+    return await record_notifications([(user_id, property_id, event)])
+
+async def enqueue_notifications(notifications):
+    """Queue notifications in the outbox for the delivery workers, in one statement"""
+    if not notifications:
+        return 0
+    try:
+        async with session() as db_session:
+            result = await db_session.execute(enqueue_statement(notifications))
+            await db_session.commit()
+        logger.info(f"Queued {result.rowcount} notifications")
+        return result.rowcount
+    except SQLAlchemyError as e:
+        logger.error(f"Database error while queueing notifications: {e}")
+        return 0
+
+async def claim_notifications(worker_id, limit, claim_timeout, digest=False):
+    """Claim a batch of due notifications for a delivery worker; see db_helpers.claim_notifications"""
+    try:
+        statement, order = claim_statement(worker_id, limit, claim_timeout, digest)
+        async with session() as db_session:
+            claimed = sorted((await db_session.execute(statement)).all(), key=order)
+            await db_session.commit()
+            if digest and claimed:
+                claimed = with_pending_counts(claimed, (await db_session.execute(pending_digests_statement(claimed))).all())
+        return claimed
+    except SQLAlchemyError as e:
+        logger.error(f"Database error while claiming notifications: {e}")
+        return []
+
+async def mark_notifications_delivered(notification_ids, worker_id):
+    """
+    Mark notifications as delivered once Telegram accepted them, and record them as sent
+
+    Returns:
+        int: Number marked; notifications whose claim was lost to another worker are skipped
+    """
+    if not notification_ids:
+        return 0
+    try:
+        now = datetime.utcnow()
+        async with session() as db_session:
+            delivered = (await db_session.execute(delivered_statement(notification_ids, worker_id, now))).all()
+            if delivered:
+                await db_session.execute(sent_notifications_statement(
+                    [(row.user_id, row.property_id, row.event) for row in delivered], now
+                ))
+            await db_session.commit()
+        for row in delivered:
+            sent_filter.add(row.user_id, row.property_id, row.event)
+        return len(delivered)
+    except SQLAlchemyError as e:
+        logger.error(f"Database error while marking notifications delivered: {e}")
+        return 0
+
+async def mark_notifications_failed(notification_ids, worker_id, error, retry_at=None):
+    """Release notifications after a failed attempt, for a retry at retry_at or for good"""
+    try:
+        async with session() as db_session:
+            await db_session.execute(failed_statement(notification_ids, worker_id, error, retry_at))
+            await db_session.commit()
+    except SQLAlchemyError as e:
+        logger.error(f"Database error while releasing notifications {notification_ids}: {e}")
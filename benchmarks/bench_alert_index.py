@@ -0,0 +1,73 @@
+"""
+Compare matching new listings against alerts with a linear scan and with the alert index
+
+Usage: python -m benchmarks.bench_alert_index [--alerts 100000] [--listings 1000]
+"""
+import re
+import time
+import argparse
+from alert_index import AlertIndex
+from benchmarks.synthetic import make_alerts, make_properties
+
+def listing_fields(property_data):
+    """Get the matching fields of a listing the way db_helpers stores them"""
+    acf = property_data["acf"]
+    price = acf["price"]
+    bedrooms = int(re.search(r'\d+', acf["bedrooms"]).group())
+    return acf["location"], int(price) if price.isdigit() else None, bedrooms
+
+def linear_match(alerts, location, price, bedrooms):
+    """The per-alert checks get_users_for_notifications used to run for every listing"""
+    matches = []
+    for alert in alerts:
+        if alert.location and location != alert.location:
+            continue
+        if price is not None:
+            if alert.min_price is not None and price < alert.min_price:
+                continue
+            if alert.max_price is not None and price > alert.max_price:
+                continue
+        if alert.min_bedrooms is not None and (bedrooms is None or bedrooms < alert.min_bedrooms):
+            continue
+        matches.append(alert)
+    return matches
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--alerts", type=int, default=100_000)
+    parser.add_argument("--listings", type=int, default=1_000)
+    args = parser.parse_args()
+
+    alerts = make_alerts(args.alerts)
+    listings = [listing_fields(property_data) for property_data in make_properties(args.listings)]
+
+    started = time.perf_counter()
+    index = AlertIndex()
+    index.replace_all(alerts)
+    # Build every price tree up front so the first match isn't charged for it
+    index.match(None, 0, 100)
+    for location in {alert.location for alert in alerts}:
+        index.match(location, 0, 100)
+    build_time = time.perf_counter() - started
+
+    started = time.perf_counter()
+    linear_results = [linear_match(alerts, *listing) for listing in listings]
+    linear_time = time.perf_counter() - started
+
+    started = time.perf_counter()
+    index_results = [index.match(*listing) for listing in listings]
+    index_time = time.perf_counter() - started
+
+    for expected, actual in zip(linear_results, index_results):
+        assert {alert.id for alert in expected} == {entry.id for entry in actual}, "Index and scan disagree"
+
+    total_matches = sum(len(result) for result in index_results)
+    print(f"Alerts: {args.alerts:,}  Listings: {args.listings:,}  Matches: {total_matches:,} "
+          f"({total_matches / len(listings):.0f} per listing)")
+    print(f"Index build:  {build_time * 1000:10.1f} ms")
+    print(f"Linear scan:  {linear_time / len(listings) * 1000:10.3f} ms per listing")
+    print(f"Alert index:  {index_time / len(listings) * 1000:10.3f} ms per listing "
+          f"({linear_time / index_time:.1f}x faster)")
+
+if __name__ == "__main__":
+    main()
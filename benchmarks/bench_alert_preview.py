@@ -0,0 +1,71 @@
+"""
+Measure the alert preview count query against the previous CAST(price AS INTEGER) filter
+
+Usage: python -m benchmarks.bench_alert_preview --database-url postgresql://... [--listings 50000]
+
+The benchmark truncates property_listings (and dependent tables) in the target database.
+"""
+import time
+import argparse
+from benchmarks.common import use_database, truncate_tables, percentile
+from benchmarks.synthetic import make_alerts, make_properties
+
+def time_queries(run, alerts):
+    """Run a count query for every alert and return the latencies in milliseconds"""
+    latencies = []
+    for alert in alerts:
+        started = time.perf_counter()
+        run(alert)
+        latencies.append((time.perf_counter() - started) * 1000)
+    return latencies
+
+def report(label, latencies):
+    print(
+        f"{label:<34} p50 {percentile(latencies, 0.5):7.2f} ms  p95 {percentile(latencies, 0.95):7.2f} ms  "
+        f"max {max(latencies):7.2f} ms"
+    )
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--database-url", required=True)
+    parser.add_argument("--listings", type=int, default=50_000)
+    parser.add_argument("--alerts", type=int, default=500, help="Number of alert criteria to preview")
+    args = parser.parse_args()
+
+    app = use_database(args.database_url)
+    from models import db, PropertyListing
+    from db_helpers import sync_property_listings, count_matching_properties
+
+    def cast_count(alert):
+        # The filter get_matching_properties_for_alert used before, which can't use an index
+        query = db.session.query(db.func.count(PropertyListing.id))
+        if alert.location:
+            query = query.filter(PropertyListing.location == alert.location)
+        price = db.case((PropertyListing.price.op('~')('^[0-9]{1,9}$'), PropertyListing.price), else_=None)
+        if alert.min_price is not None:
+            query = query.filter(db.cast(price, db.Integer) >= alert.min_price)
+        if alert.max_price is not None:
+            query = query.filter(db.cast(price, db.Integer) <= alert.max_price)
+        if alert.min_bedrooms is not None:
+            query = query.filter(PropertyListing.bedrooms >= alert.min_bedrooms)
+        return query.scalar()
+
+    def indexed_count(alert):
+        return count_matching_properties(alert.location, alert.min_price, alert.max_price, alert.min_bedrooms)
+
+    alerts = make_alerts(args.alerts)
+    with app.app_context():
+        truncate_tables(db, "property_listings")
+        sync_property_listings(make_properties(args.listings))
+        # Set the visibility map as autovacuum would, so index-only scans skip the heap
+        db.session.remove()
+        with db.engine.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+            connection.execute(db.text("VACUUM ANALYZE property_listings"))
+
+        print(f"{args.alerts} alert previews over {args.listings:,} listings")
+        for label, run in (("CAST(price AS INTEGER) filter", cast_count), ("count_matching_properties", indexed_count)):
+            time_queries(run, alerts[:20])  # Warm the buffer cache
+            report(label, time_queries(run, alerts))
+
+if __name__ == "__main__":
+    main()
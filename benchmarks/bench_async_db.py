@@ -0,0 +1,119 @@
+"""
+Measure bot handler latency on the sync db_helpers path against async_db under concurrent updates
+
+Usage: python -m benchmarks.bench_async_db --database-url postgresql://... [--rate 60] [--concurrency 1 8]
+
+Updates arrive at a steady rate and each runs the queries of an /alerts round
+trip: the user upsert, the user's alerts and an alert preview count. Latency
+is measured from the arrival of the update, so it includes the time spent
+waiting for the event loop or a handler slot. The sync path runs the queries
+in the event loop as the handlers did before, which blocks every other update
+while a query waits on the database; the event loop lag column shows how late
+a 10 ms timer fires meanwhile, which is what a reply to any other update waits.
+The benchmark truncates the application tables in the target database.
+"""
+import os
+import time
+import random
+import asyncio
+import argparse
+from benchmarks.common import use_database, truncate_tables, percentile
+from benchmarks.synthetic import make_alerts, make_properties
+
+def report(label, latencies, elapsed, lags):
+    print(
+        f"{label:<22} p50 {percentile(latencies, 0.5):7.2f} ms  p95 {percentile(latencies, 0.95):7.2f} ms  "
+        f"{len(latencies) / elapsed:7.0f} handlers/s  loop lag max {max(lags, default=0):6.1f} ms"
+    )
+
+async def probe_loop_lag(lags, stop):
+    """Record how late a 10 ms timer fires while the handlers run"""
+    while not stop.is_set():
+        started = time.perf_counter()
+        await asyncio.sleep(0.01)
+        lags.append((time.perf_counter() - started - 0.01) * 1000)
+
+async def run_handlers(handler, count, concurrency, rate):
+    """Start count handlers at rate per second, at most concurrency at a time; return latencies, elapsed time and loop lags"""
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies, lags = [], []
+    stop = asyncio.Event()
+
+    async def run(number, arrival):
+        async with semaphore:
+            await handler(number)
+        latencies.append((time.perf_counter() - arrival) * 1000)
+
+    probe = asyncio.create_task(probe_loop_lag(lags, stop))
+    started = time.perf_counter()
+    tasks = []
+    for number in range(count):
+        arrival = started + number / rate
+        await asyncio.sleep(max(0, arrival - time.perf_counter()))
+        tasks.append(asyncio.create_task(run(number, arrival)))
+    await asyncio.gather(*tasks)
+    elapsed = time.perf_counter() - started
+    stop.set()
+    await probe
+    return latencies, elapsed, lags
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--database-url", required=True)
+    parser.add_argument("--listings", type=int, default=20_000)
+    parser.add_argument("--users", type=int, default=2_000)
+    parser.add_argument("--handlers", type=int, default=500, help="Updates handled per measurement")
+    parser.add_argument("--rate", type=float, default=60, help="Updates arriving per second")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8],
+                        help="Updates handled at the same time, as BOT_CONCURRENT_UPDATES")
+    args = parser.parse_args()
+
+    # Size the async pool for the highest concurrency, as BOT_CONCURRENT_UPDATES does in the bot
+    os.environ.setdefault("ASYNC_DB_POOL_SIZE", str(max(args.concurrency)))
+    app = use_database(args.database_url)
+    from models import db
+    import db_helpers
+    import async_db
+
+    with app.app_context():
+        truncate_tables(db, "notification_outbox", "alert_notifications", "property_alerts", "property_listings", "users")
+        db_helpers.sync_property_listings(make_properties(args.listings))
+        db.session.remove()
+        with db.engine.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+            connection.execute(db.text("VACUUM ANALYZE property_listings"))
+
+    alerts = make_alerts(200)
+    rng = random.Random(1)
+    telegram_ids = [1_000_000 + rng.randrange(args.users) for _ in range(args.handlers)]
+
+    async def sync_handler(number):
+        # The previous handlers: sync queries in an app context, inside the event loop
+        alert = alerts[number % len(alerts)]
+        with app.app_context():
+            user = db_helpers.get_or_create_user(telegram_ids[number], first_name="Bench")
+            db_helpers.get_user_alerts(user.id)
+            db_helpers.count_matching_properties(alert.location, alert.min_price, alert.max_price, alert.min_bedrooms)
+            db.session.remove()
+
+    async def async_handler(number):
+        alert = alerts[number % len(alerts)]
+        user = await async_db.get_or_create_user(telegram_ids[number], first_name="Bench")
+        await async_db.get_user_alerts(user.id)
+        await async_db.count_matching_properties(alert.location, alert.min_price, alert.max_price, alert.min_bedrooms)
+
+    async def measure():
+        # Warm both paths: connections, the buffer cache and the user rows
+        warm = min(args.handlers, 100)
+        await run_handlers(sync_handler, warm, 1, args.rate)
+        await run_handlers(async_handler, warm, max(args.concurrency), args.rate)
+        print(f"{args.handlers} /alerts round trips at {args.rate:g}/s over {args.listings:,} listings, {args.users:,} users")
+        for concurrency in args.concurrency:
+            print(f"\nconcurrency {concurrency}")
+            for label, handler in (("db_helpers in the loop", sync_handler), ("async_db", async_handler)):
+                report(label, *await run_handlers(handler, args.handlers, concurrency, args.rate))
+        await async_db.dispose_engine()
+
+    asyncio.run(measure())
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,175 @@
+"""
+Compare per-operation latency of the db_helpers and async_db operations on PostgreSQL and the embedded SQLite mode
+
+Usage: python -m benchmarks.bench_backends --postgres-url postgresql://... --sqlite-path /tmp/bench.db [--listings 20000]
+
+Each backend runs in its own process, as DATABASE_URL is bound when app.py is
+imported, over the same synthetic users, alerts and listings. Every operation
+is what one bot command, webhook or worker step runs, timed from the caller
+including the commit. The benchmark truncates the application tables in both
+databases.
+"""
+import sys
+import copy
+import json
+import time
+import asyncio
+import argparse
+import subprocess
+from benchmarks.common import use_database, truncate_tables, analyze_tables, percentile
+from benchmarks.synthetic import make_alerts, make_properties
+
+def summarize(latencies):
+    return {"p50": percentile(latencies, 0.5), "p95": percentile(latencies, 0.95)}
+
+def time_operation(operation, repeat, warmup=5):
+    """Run operation(number) repeat times after a warmup; return its p50 and p95 latency in ms"""
+    for number in range(warmup):
+        operation(number)
+    latencies = []
+    for number in range(warmup, warmup + repeat):
+        started = time.perf_counter()
+        operation(number)
+        latencies.append((time.perf_counter() - started) * 1000)
+    return summarize(latencies)
+
+async def time_async_operation(operation, repeat, warmup=5):
+    """time_operation() for a coroutine function"""
+    for number in range(warmup):
+        await operation(number)
+    latencies = []
+    for number in range(warmup, warmup + repeat):
+        started = time.perf_counter()
+        await operation(number)
+        latencies.append((time.perf_counter() - started) * 1000)
+    return summarize(latencies)
+
+def run_worker(args):
+    """Seed one backend, time every operation and print the results as JSON"""
+    app = use_database(args.database_url)
+    from sqlalchemy import insert
+    from models import db, User, PropertyAlert, PropertyListing
+    import db_helpers
+    import async_db
+
+    catalog = make_properties(args.listings)
+    alerts = make_alerts(args.alerts)
+    users = max(alert.user_id for alert in alerts)
+    results = {}
+
+    with app.app_context():
+        truncate_tables(db, "notification_outbox", "alert_notifications", "property_alerts", "property_listings", "users", "job_states")
+        db.session.execute(insert(User), [
+            {"telegram_id": 1_000_000 + user_id, "first_name": "Bench", "is_active": True} for user_id in range(1, users + 1)
+        ])
+        db.session.execute(insert(PropertyAlert), [
+            {"user_id": alert.user_id, "location": alert.location, "min_price": alert.min_price,
+             "max_price": alert.max_price, "min_bedrooms": alert.min_bedrooms, "is_active": True}
+            for alert in alerts
+        ])
+        db.session.commit()
+        db_helpers.sync_property_listings(catalog)
+        analyze_tables(db, "users", "property_alerts", "property_listings")
+        listings = db.session.query(PropertyListing).order_by(PropertyListing.id).all()
+        db.session.expunge_all()
+
+        def webhook(number):
+            # One listing pushed by the WordPress webhook with a new price
+            changed = copy.deepcopy(catalog[number % len(catalog)])
+            changed["acf"]["price"] = str(10_000_000 + number * 1_000)
+            db_helpers.sync_property_listings([changed], complete=False)
+
+        def enqueue(number):
+            # A batch of 10 notifications of one new listing
+            db_helpers.enqueue_notifications([
+                {"user_id": (number * 10 + offset) % users + 1, "property_id": listings[number % len(listings)].id,
+                 "event": 'new', "telegram_id": 1_000_000 + (number * 10 + offset) % users + 1,
+                 "message": "Bench notification", "image_url": None}
+                for offset in range(10)
+            ])
+
+        def deliver(number):
+            claimed = db_helpers.claim_notifications("bench", 10, 60)
+            db_helpers.mark_notifications_delivered([row.id for row in claimed], "bench")
+
+        def alert_for(number):
+            return alerts[number % len(alerts)]
+
+        operations = [
+            ("get_or_create_user", lambda n: db_helpers.get_or_create_user(1_000_000 + n % users + 1, first_name="Bench")),
+            ("get_user_alerts", lambda n: db_helpers.get_user_alerts(n % users + 1)),
+            ("create_property_alert", lambda n: db_helpers.create_property_alert(n % users + 1, location="Karen", min_bedrooms=3)),
+            ("count_matching_properties", lambda n: db_helpers.count_matching_properties(
+                alert_for(n).location, alert_for(n).min_price, alert_for(n).max_price, alert_for(n).min_bedrooms)),
+            ("get_matching_properties (20)", lambda n: db_helpers.get_matching_properties_for_alert(alert_for(n), limit=20)),
+            ("sync_property_listings (webhook)", webhook),
+            ("get_notification_targets (10)", lambda n: db_helpers.get_notification_targets(
+                listings[n * 10 % len(listings):n * 10 % len(listings) + 10])),
+            ("enqueue_notifications (10)", enqueue),
+            ("claim + mark delivered (10)", deliver),
+            ("get_outbox_stats", lambda n: db_helpers.get_outbox_stats()),
+        ]
+        for label, operation in operations:
+            results[label] = time_operation(operation, args.repeat)
+            db.session.remove()
+        # The unchanged full catalog, as the periodic sync sees it most of the time
+        results["sync_property_listings (catalog)"] = time_operation(
+            lambda n: db_helpers.sync_property_listings(catalog), args.catalog_repeat, warmup=1
+        )
+
+    async def measure_async():
+        results["async upsert_user"] = await time_async_operation(
+            lambda n: async_db.upsert_user(1_000_000 + n % users + 1, first_name="Bench"), args.repeat
+        )
+        results["async get_user_alerts"] = await time_async_operation(
+            lambda n: async_db.get_user_alerts(n % users + 1), args.repeat
+        )
+        await async_db.dispose_engine()
+
+    asyncio.run(measure_async())
+    print(json.dumps(results))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--postgres-url")
+    parser.add_argument("--sqlite-path", help="SQLite database file, created if missing")
+    parser.add_argument("--listings", type=int, default=20_000)
+    parser.add_argument("--alerts", type=int, default=3_000)
+    parser.add_argument("--repeat", type=int, default=300, help="Timed runs of each operation")
+    parser.add_argument("--catalog-repeat", type=int, default=5, help="Timed runs of the full catalog sync")
+    parser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--database-url", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        run_worker(args)
+        return
+    if not args.postgres_url or not args.sqlite_path:
+        parser.error("--postgres-url and --sqlite-path are required")
+
+    backends = {"PostgreSQL": args.postgres_url, "SQLite": f"sqlite:///{args.sqlite_path}"}
+    results = {}
+    for name, url in backends.items():
+        command = [
+            sys.executable, "-m", "benchmarks.bench_backends", "--worker", "--database-url", url,
+            "--listings", str(args.listings), "--alerts", str(args.alerts),
+            "--repeat", str(args.repeat), "--catalog-repeat", str(args.catalog_repeat)
+        ]
+        # The worker logs every write to stderr; only show it when the run fails
+        worker = subprocess.run(command, capture_output=True, text=True)
+        if worker.returncode:
+            sys.exit(f"{name} run failed:\n{worker.stderr}")
+        results[name] = json.loads(worker.stdout.strip().splitlines()[-1])
+
+    postgres, sqlite = results["PostgreSQL"], results["SQLite"]
+    print(f"{args.listings:,} listings, {args.alerts:,} alerts, {args.repeat} runs per operation; latency in ms")
+    print(f"{'operation':<34} {'PostgreSQL p50':>14} {'p95':>8} {'SQLite p50':>11} {'p95':>8} {'SQLite/PG':>10}")
+    for label in postgres:
+        pg, lite = postgres[label], sqlite[label]
+        print(
+            f"{label:<34} {pg['p50']:14.2f} {pg['p95']:8.2f} {lite['p50']:11.2f} {lite['p95']:8.2f} "
+            f"{lite['p50'] / pg['p50']:9.2f}x"
+        )
+
+if __name__ == "__main__":
+    main()
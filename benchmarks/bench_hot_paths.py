@@ -0,0 +1,303 @@
+"""
+Time the hot functions of the bot and the alert pipeline at several data scales and save the results as JSON
+
+Usage: python -m benchmarks.bench_hot_paths [--database-url postgresql://...] [--scales 100 1000 10000]
+           [--location-scales 20 200 2000] [--alert-scales 1000 10000 50000] [--output results.json] [--compare baseline.json]
+
+Every benchmark runs on seeded synthetic data, so two runs of the same commit
+see the same inputs:
+
+- format_property_message and get_property_image_url, cycling through a catalog
+- get_locations extracting the locations of the whole catalog (the WordPress
+  fetch is replaced by the synthetic catalog, so only the extraction is timed)
+- match_typed_location and find_mentioned_location, the location matching of
+  handle_text_location and handle_message, over catalogs with many locations,
+  for texts that match and texts that don't (the worst case)
+- timed_cache on a hit, on a miss and against the undecorated call, with a
+  catalog-sized result (set CACHE_BACKEND_URL to time the shared SQLite cache)
+- save_property_listing of an unchanged, a changed and a new listing into a
+  table of each catalog size
+- get_users_for_notifications for one listing with each number of active alerts
+
+In-memory functions are timed in rounds of many calls and report the average
+of the fastest round, as the machine's other work only adds time; database
+operations report the median and p95 of single calls. Log records are still
+formatted, as in production, but written to /dev/null.
+
+Results are keyed "function[scale]" and saved sorted, one value per line, so
+two result files diff line by line; --compare prints the change against a
+saved run. Without --database-url the database benchmarks use a temporary
+SQLite file; a given database has its application tables truncated.
+"""
+import os
+import sys
+import copy
+import json
+import time
+import random
+import logging
+import argparse
+import tempfile
+import itertools
+import statistics
+from datetime import datetime
+from benchmarks.common import use_database, truncate_tables, git_revision, percentile
+from benchmarks.synthetic import LOCATIONS, make_alerts, make_properties
+
+# Each in-memory measurement is the fastest of this many rounds
+ROUNDS = 5
+# Seconds a round of an in-memory benchmark should take, to size its number of calls
+ROUND_TIME = 0.1
+# Timed calls per database operation
+DATABASE_CALLS = 200
+# Listings the notification benchmark matches alerts against
+NOTIFICATION_LISTINGS = 1_000
+
+# Typed locations and messages that name a known location, and ones that don't
+TYPED_TEXTS = ["karen", "Lavington", "kile", "spring", "westlands please", "runda estate"]
+UNKNOWN_TEXTS = ["mombasa", "something by the sea", "nakuru town"]
+MESSAGES = ["show me properties in karen", "any house in kilimani?", "looking for a home near gigiri"]
+UNMATCHED_MESSAGES = ["show me properties with a pool", "I want to buy a house", "what can you do"]
+
+def per_call(function):
+    """
+    Time an in-memory function in rounds of many calls
+
+    Returns:
+        dict: Microseconds per call in the fastest round ("us") and the median round, and the calls per round
+    """
+    function()
+    started = time.perf_counter()
+    calls = 0
+    while time.perf_counter() - started < ROUND_TIME / 10:
+        function()
+        calls += 1
+    iterations = max(1, calls * 10)
+    rounds = []
+    for _ in range(ROUNDS):
+        started = time.perf_counter()
+        for _ in range(iterations):
+            function()
+        rounds.append((time.perf_counter() - started) / iterations * 1e6)
+    return {"us": round(min(rounds), 3), "median_round_us": round(statistics.median(rounds), 3), "calls_per_round": iterations}
+
+def per_operation(operation, calls=DATABASE_CALLS, warmup=5):
+    """
+    Time operation(number) one call at a time after a warmup
+
+    Returns:
+        dict: Median ("us") and p95 microseconds of a call, and the number of calls
+    """
+    for number in range(warmup):
+        operation(number)
+    latencies = []
+    for number in range(warmup, warmup + calls):
+        started = time.perf_counter()
+        operation(number)
+        latencies.append((time.perf_counter() - started) * 1e6)
+    return {"us": round(percentile(latencies, 0.5), 1), "p95_us": round(percentile(latencies, 0.95), 1), "calls": calls}
+
+def make_locations(count, seed=1):
+    """The Nairobi neighbourhoods followed by numbered estates in them, count names in a seeded order"""
+    names = [LOCATIONS[number % len(LOCATIONS)] + (f" Estate {number // len(LOCATIONS)}" if number >= len(LOCATIONS) else "")
+             for number in range(count)]
+    random.Random(seed).shuffle(names)
+    return names
+
+def cycle(values):
+    """A function returning the next of values on every call, round robin"""
+    return itertools.cycle(values).__next__
+
+def bench_formatting(results, catalog, scales):
+    from utils import format_property_message, get_property_image_url
+
+    for scale in scales:
+        next_property = cycle(catalog[:scale])
+        results[f"format_property_message[{scale}]"] = per_call(lambda: format_property_message(next_property()))
+        results[f"get_property_image_url[{scale}]"] = per_call(lambda: get_property_image_url(next_property()))
+
+def bench_get_locations(results, catalog, scales):
+    import api
+
+    fetch_properties = api.fetch_properties
+    try:
+        for scale in scales:
+            properties = catalog[:scale]
+            api.fetch_properties = lambda: properties
+            # The undecorated function, so every call extracts instead of hitting the cache
+            results[f"get_locations[{scale}]"] = per_call(api.get_locations.__wrapped__)
+    finally:
+        api.fetch_properties = fetch_properties
+
+def bench_location_matching(results, scales):
+    from bot import match_typed_location, find_mentioned_location
+
+    for scale in scales:
+        locations = make_locations(scale)
+        next_text = cycle(TYPED_TEXTS)
+        next_unknown = cycle(UNKNOWN_TEXTS)
+        next_message = cycle(MESSAGES)
+        next_unmatched = cycle(UNMATCHED_MESSAGES)
+        results[f"match_typed_location[{scale}]"] = per_call(lambda: match_typed_location(next_text(), locations))
+        results[f"match_typed_location (no match)[{scale}]"] = per_call(lambda: match_typed_location(next_unknown(), locations))
+        results[f"find_mentioned_location[{scale}]"] = per_call(lambda: find_mentioned_location(next_message(), locations))
+        results[f"find_mentioned_location (no match)[{scale}]"] = per_call(lambda: find_mentioned_location(next_unmatched(), locations))
+
+def bench_timed_cache(results, catalog, scales):
+    from api import timed_cache
+    from utils import compact_properties
+
+    for scale in scales:
+        properties = compact_properties(catalog[:scale])
+
+        def lookup(key):
+            return properties
+
+        # Function names are part of the cache key, so every scale gets keys of its own
+        lookup.__name__ = f"bench_lookup_{scale}"
+        cached = timed_cache(compact=compact_properties)(lookup)
+        keys = itertools.count()
+        results[f"timed_cache (undecorated)[{scale}]"] = per_call(lambda: lookup(1))
+        results[f"timed_cache (hit)[{scale}]"] = per_call(lambda: cached(1))
+        results[f"timed_cache (miss)[{scale}]"] = per_call(lambda: cached(next(keys)))
+
+def bench_save_property_listing(results, db, catalog, scales):
+    import db_helpers
+
+    for scale in scales:
+        truncate_tables(db, "property_listings")
+        db_helpers.sync_property_listings(catalog[:scale])
+        rng = random.Random(scale)
+
+        def unchanged(number):
+            db_helpers.save_property_listing(catalog[rng.randrange(scale)])
+
+        def changed(number):
+            # A new price, so the content hash differs and the row is written
+            property_data = copy.deepcopy(catalog[rng.randrange(scale)])
+            property_data["acf"]["price"] = str(10_000_000 + number * 1_000)
+            db_helpers.save_property_listing(property_data)
+
+        new_properties = make_properties(DATABASE_CALLS + 5, seed=scale, start_id=10_000_000)
+
+        def new(number):
+            db_helpers.save_property_listing(new_properties[number])
+
+        results[f"save_property_listing (unchanged)[{scale}]"] = per_operation(unchanged)
+        results[f"save_property_listing (changed)[{scale}]"] = per_operation(changed)
+        results[f"save_property_listing (new)[{scale}]"] = per_operation(new)
+        db.session.remove()
+
+def bench_notifications(results, db, catalog, scales):
+    from sqlalchemy import insert
+    from models import User, PropertyAlert, PropertyListing
+    from alert_index import alert_index
+    import db_helpers
+
+    truncate_tables(db, "property_listings")
+    db_helpers.sync_property_listings(catalog[:NOTIFICATION_LISTINGS])
+    listings = db.session.query(PropertyListing).order_by(PropertyListing.id).all()
+    db.session.expunge_all()
+    next_listing = cycle(listings)
+
+    for scale in scales:
+        truncate_tables(db, "notification_outbox", "alert_notifications", "property_alerts", "users")
+        alerts = make_alerts(scale)
+        users = max(alert.user_id for alert in alerts)
+        db.session.execute(insert(User), [
+            {"telegram_id": 1_000_000 + user_id, "first_name": "Bench", "is_active": True} for user_id in range(1, users + 1)
+        ])
+        db.session.execute(insert(PropertyAlert), [
+            {"user_id": alert.user_id, "location": alert.location, "min_price": alert.min_price,
+             "max_price": alert.max_price, "min_bedrooms": alert.min_bedrooms, "is_active": True}
+            for alert in alerts
+        ])
+        db.session.commit()
+        # The index still holds the alerts of the previous scale
+        alert_index.replace_all(db_helpers.get_active_alerts())
+        results[f"get_users_for_notifications[{scale}]"] = per_operation(
+            lambda number: db_helpers.get_users_for_notifications(next_listing())
+        )
+        db.session.remove()
+
+def compare(results, baseline, baseline_path):
+    """Print the change of every result against a saved run"""
+    print(f"\nCompared with {baseline_path} ({baseline['run'].get('revision') or 'unknown revision'}):")
+    print(f"{'benchmark':<52} {'before':>12} {'after':>12} {'change':>8}")
+    for name, result in results.items():
+        before = baseline["results"].get(name)
+        if before is None:
+            print(f"{name:<52} {'-':>12} {result['us']:10.2f} µs {'new':>8}")
+            continue
+        print(f"{name:<52} {before['us']:10.2f} µs {result['us']:10.2f} µs {result['us'] / before['us'] - 1:+8.1%}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--database-url", help="Scratch database; a temporary SQLite file by default")
+    parser.add_argument("--scales", type=int, nargs="+", default=[100, 1_000, 10_000], help="Catalog sizes")
+    parser.add_argument("--location-scales", type=int, nargs="+", default=[20, 200, 2_000], help="Distinct locations to match against")
+    parser.add_argument("--alert-scales", type=int, nargs="+", default=[1_000, 10_000, 50_000], help="Active alerts")
+    parser.add_argument("--output", help="Write the results as JSON to this file")
+    parser.add_argument("--compare", help="Results file of an earlier run to compare with")
+    args = parser.parse_args()
+
+    # Read the earlier run first, so a wrong path fails before the benchmarks run
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+
+    database_url = args.database_url or f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'bench_hot_paths.db')}"
+    app = use_database(database_url)
+    from models import db
+
+    # Keep formatting every log record, as production does, without printing thousands of them
+    devnull = open(os.devnull, 'w')
+    for handler in logging.getLogger().handlers:
+        if isinstance(handler, logging.StreamHandler):
+            handler.setStream(devnull)
+
+    catalog = make_properties(max(args.scales + [NOTIFICATION_LISTINGS]))
+    results = {}
+    benchmarks = [
+        ("formatting", lambda: bench_formatting(results, catalog, args.scales)),
+        ("get_locations", lambda: bench_get_locations(results, catalog, args.scales)),
+        ("location matching", lambda: bench_location_matching(results, args.location_scales)),
+        ("timed_cache", lambda: bench_timed_cache(results, catalog, args.scales)),
+        ("save_property_listing", lambda: bench_save_property_listing(results, db, catalog, args.scales)),
+        ("get_users_for_notifications", lambda: bench_notifications(results, db, catalog, args.alert_scales)),
+    ]
+    with app.app_context():
+        database = db.engine.dialect.name
+        truncate_tables(db, "notification_outbox", "alert_notifications", "property_alerts", "property_listings", "users")
+        for label, benchmark in benchmarks:
+            started = time.perf_counter()
+            benchmark()
+            print(f"{label}: {time.perf_counter() - started:.1f} s", file=sys.stderr)
+
+    print(f"{'benchmark':<52} {'per call':>12}")
+    for name, result in results.items():
+        print(f"{name:<52} {result['us']:10.2f} µs")
+
+    if args.output:
+        report = {
+            "run": {
+                "revision": git_revision(),
+                "finished_at": datetime.utcnow().isoformat(),
+                "python": sys.version.split()[0],
+                "database": database,
+                "scales": args.scales,
+                "location_scales": args.location_scales,
+                "alert_scales": args.alert_scales
+            },
+            "results": results
+        }
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+            f.write("\n")
+        print(f"\nWrote {args.output}")
+    if baseline is not None:
+        compare(results, baseline, args.compare)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+"""
+Measure listing table size and sync write time with full payloads in details, compact details and compact details plus raw payloads
+
+Usage: python -m benchmarks.bench_listing_storage --database-url postgresql://... [--listings 20000] [--changed 2000]
+
+Each storage policy runs in its own process, as LISTING_DETAILS and
+LISTING_RAW_PAYLOADS are read when config.py is imported. A run syncs the
+catalog into empty tables, then a catalog in which --changed listings got a
+new price. Sizes include indexes and TOAST. The benchmark truncates the
+application tables in the target database.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import subprocess
+from benchmarks.common import use_database, truncate_tables
+from benchmarks.synthetic import make_properties
+
+# Structure: {label: (LISTING_DETAILS, LISTING_RAW_PAYLOADS)}
+POLICIES = {
+    "full payload in details": ("full", ""),
+    "compact details": ("compact", ""),
+    "compact + raw payloads": ("compact", "1"),
+}
+
+def table_size(db, table):
+    """Bytes used by a table with its indexes (and TOAST on PostgreSQL)"""
+    if db.engine.dialect.name == "sqlite":
+        return db.session.scalar(
+            db.text(
+                "SELECT COALESCE(SUM(pgsize), 0) FROM dbstat WHERE name IN "
+                "(SELECT name FROM sqlite_master WHERE tbl_name = :table)"
+            ),
+            {"table": table}
+        )
+    return db.session.scalar(db.text("SELECT pg_total_relation_size(:table)"), {"table": table})
+
+def run_worker(args):
+    """Sync the catalog under the configured policy and print the results as JSON"""
+    app = use_database(args.database_url)
+    from models import db
+    import db_helpers
+
+    catalog = make_properties(args.listings)
+    changed = make_properties(args.listings)
+    for property_data in changed[:args.changed]:
+        acf = property_data["acf"]
+        acf["price"] = str(int(acf["price"]) - 1_000_000) if acf["price"].isdigit() else "4000000"
+
+    with app.app_context():
+        truncate_tables(db, "property_listings", "listing_payloads")
+        started = time.perf_counter()
+        db_helpers.sync_property_listings(catalog)
+        initial = time.perf_counter() - started
+        sizes = {table: table_size(db, table) for table in ("property_listings", "listing_payloads")}
+        details = db.session.scalar(db.text(
+            "SELECT AVG(LENGTH(CAST(details AS TEXT))) FROM property_listings"
+        ))
+        started = time.perf_counter()
+        db_helpers.sync_property_listings(changed)
+        update = time.perf_counter() - started
+        started = time.perf_counter()
+        fetched = sum(db_helpers.get_listing_payload(wp_id) is not None for wp_id in range(1, 101))
+        fetch = (time.perf_counter() - started) / 100
+        db.session.remove()
+
+    print(json.dumps({
+        "initial": initial, "update": update, "sizes": sizes, "details": float(details or 0),
+        "fetch": fetch if fetched else None
+    }))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--database-url", required=True)
+    parser.add_argument("--listings", type=int, default=20_000)
+    parser.add_argument("--changed", type=int, default=2_000, help="Listings with a new price in the second sync")
+    parser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        run_worker(args)
+        return
+
+    print(f"{args.listings:,} listings, then {args.changed:,} changed")
+    print(f"{'policy':<26} {'initial sync':>12} {'change sync':>12} {'listings':>10} {'payloads':>10} {'details/row':>12} {'payload fetch':>14}")
+    for label, (details, raw_payloads) in POLICIES.items():
+        command = [
+            sys.executable, "-m", "benchmarks.bench_listing_storage", "--worker", "--database-url", args.database_url,
+            "--listings", str(args.listings), "--changed", str(args.changed)
+        ]
+        env = dict(os.environ, LISTING_DETAILS=details, LISTING_RAW_PAYLOADS=raw_payloads)
+        # The worker logs every sync to stderr; only show it when the run fails
+        worker = subprocess.run(command, capture_output=True, text=True, env=env)
+        if worker.returncode:
+            sys.exit(f"{label} run failed:\n{worker.stderr}")
+        result = json.loads(worker.stdout.strip().splitlines()[-1])
+        fetch = f"{result['fetch'] * 1000:11.2f} ms" if result["fetch"] is not None else f"{'-':>14}"
+        print(
+            f"{label:<26} {result['initial']:10.2f} s {result['update']:10.2f} s "
+            f"{result['sizes']['property_listings'] / 1024 / 1024:7.1f} MB {result['sizes']['listing_payloads'] / 1024 / 1024:7.1f} MB "
+            f"{result['details']:8.0f} B {fetch}"
+        )
+
+if __name__ == "__main__":
+    main()
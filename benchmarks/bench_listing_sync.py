@@ -0,0 +1,63 @@
+"""
+Measure sync time and WAL volume of saving a property catalog, per-row vs. bulk upsert
+
+Usage: python -m benchmarks.bench_listing_sync --database-url postgresql://... [--listings 10000]
+
+The benchmark truncates property_listings (and dependent tables) in the target database.
+"""
+import time
+import random
+import argparse
+from benchmarks.common import use_database, truncate_tables
+from benchmarks.synthetic import make_properties
+
+def wal_position(db):
+    """Get the current WAL insert position of the Postgres server"""
+    return db.session.execute(db.text("SELECT pg_current_wal_insert_lsn()")).scalar()
+
+def wal_bytes_since(db, position):
+    """Get the number of WAL bytes written since a position"""
+    return db.session.execute(
+        db.text("SELECT pg_wal_lsn_diff(pg_current_wal_insert_lsn(), :position)"), {"position": position}
+    ).scalar()
+
+def measure(db, label, sync):
+    """Run one sync and report its duration and WAL volume"""
+    position = wal_position(db)
+    started = time.perf_counter()
+    sync()
+    elapsed = time.perf_counter() - started
+    wal = wal_bytes_since(db, position)
+    print(f"{label:<40} {elapsed:8.2f} s  {wal / 1024 / 1024:8.1f} MiB WAL")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--database-url", required=True)
+    parser.add_argument("--listings", type=int, default=10_000)
+    parser.add_argument("--changed", type=float, default=0.01, help="Share of listings changed between syncs")
+    args = parser.parse_args()
+
+    app = use_database(args.database_url)
+    from models import db
+    from db_helpers import save_property_listing, sync_property_listings
+
+    catalog = make_properties(args.listings)
+    changed_catalog = [dict(property_data, acf=dict(property_data["acf"])) for property_data in catalog]
+    for property_data in random.Random(2).sample(changed_catalog, int(len(changed_catalog) * args.changed)):
+        property_data["acf"]["price"] = str(int(property_data["acf"]["price"]) - 500_000) \
+            if property_data["acf"]["price"].isdigit() else "50000000"
+
+    def per_row(properties):
+        for property_data in properties:
+            save_property_listing(property_data)
+
+    with app.app_context():
+        print(f"Catalog of {args.listings:,} listings, {args.changed:.0%} changed in the last sync")
+        for label, sync in (("Per-row save_property_listing", per_row), ("Diffed sync_property_listings", sync_property_listings)):
+            truncate_tables(db, "property_listings")
+            measure(db, f"{label}: initial load", lambda: sync(catalog))
+            measure(db, f"{label}: unchanged catalog", lambda: sync(catalog))
+            measure(db, f"{label}: changed catalog", lambda: sync(changed_catalog))
+
+if __name__ == "__main__":
+    main()
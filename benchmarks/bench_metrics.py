@@ -0,0 +1,147 @@
+"""
+Measure the recording overhead of the Prometheus metrics and tracing against the work they measure
+
+Usage: python -m benchmarks.bench_metrics [--iterations 200000] [--queries 20000]
+
+Times the recording primitives on their own, a span outside and inside a
+sampled trace, a bot handler with and without the timing wrapper, a primary key lookup through a SQLAlchemy engine with and
+without instrument_engine(), and rendering /metrics with every bot handler,
+Telegram method and query kind recorded. Queries run against an in-memory
+SQLite database, the cheapest statement the app runs, so the overhead shown is
+an upper bound on its share.
+"""
+import time
+import asyncio
+import argparse
+from sqlalchemy import create_engine, event, text
+from tracing import Tracer, span
+from metrics import (
+    Counter, Histogram, Registry, timed_handler, instrument_engine, REGISTRY,
+    DB_QUERY_SECONDS, TELEGRAM_REQUEST_SECONDS, TELEGRAM_REQUESTS
+)
+
+# Each measurement is the fastest of this many rounds, as the machine's other work only adds time
+ROUNDS = 3
+
+def per_call(function, iterations):
+    """Nanoseconds per call of function(), after a warmup"""
+    for _ in range(min(iterations, 1000)):
+        function()
+    best = float('inf')
+    for _ in range(ROUNDS):
+        started = time.perf_counter()
+        for _ in range(iterations):
+            function()
+        best = min(best, time.perf_counter() - started)
+    return best / iterations * 1e9
+
+async def per_await(coroutine_function, iterations):
+    """per_call() for a coroutine function"""
+    for _ in range(min(iterations, 1000)):
+        await coroutine_function(None, None)
+    best = float('inf')
+    for _ in range(ROUNDS):
+        started = time.perf_counter()
+        for _ in range(iterations):
+            await coroutine_function(None, None)
+        best = min(best, time.perf_counter() - started)
+    return best / iterations * 1e9
+
+def query_cost(listeners, queries):
+    """
+    Nanoseconds per primary key lookup on a fresh in-memory SQLite engine
+
+    Args:
+        listeners (str): None, "empty" for no-op cursor event listeners (SQLAlchemy's own
+            dispatch cost), or "metrics" for instrument_engine()
+        queries (int): Timed lookups
+    """
+    engine = create_engine("sqlite://")
+    if listeners == "empty":
+        event.listen(engine, "before_cursor_execute", lambda *args: None)
+        event.listen(engine, "after_cursor_execute", lambda *args: None)
+    elif listeners == "metrics":
+        instrument_engine(engine, "bench")
+    with engine.connect() as connection:
+        connection.execute(text("CREATE TABLE users (id INTEGER PRIMARY KEY, telegram_id INTEGER)"))
+        connection.execute(text("INSERT INTO users (id, telegram_id) VALUES (:id, :id)"), [{"id": n} for n in range(1, 1001)])
+        statement = text("SELECT telegram_id FROM users WHERE id = :id")
+        numbers = iter(range(10 ** 9))
+        return per_call(lambda: connection.execute(statement, {"id": next(numbers) % 1000 + 1}).scalar(), queries)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--iterations", type=int, default=200_000, help="Calls per recording primitive")
+    parser.add_argument("--queries", type=int, default=20_000, help="Lookups per engine")
+    args = parser.parse_args()
+
+    # A registry of its own, so the primitives are timed without the app's metrics
+    registry = Registry()
+    counter = Counter("bench_total", "Benchmark counter", ["kind"], registry=registry)
+    histogram = Histogram("bench_seconds", "Benchmark histogram", ["kind"], registry=registry)
+    child = histogram.labels("kept")
+
+    print(f"{'operation':<44} {'per call':>10}")
+    rows = [
+        ("Counter.labels(...).inc()", per_call(lambda: counter.labels("a").inc(), args.iterations)),
+        ("Histogram.labels(...).observe()", per_call(lambda: histogram.labels("a").observe(0.004), args.iterations)),
+        ("observe() on a kept child", per_call(lambda: child.observe(0.004), args.iterations)),
+    ]
+
+    def empty_span():
+        with span("bench", kind="a"):
+            pass
+
+    rows.append(("span outside a trace", per_call(empty_span, args.iterations)))
+    # A trace of 100 spans, so the cost per span includes its share of opening and keeping the trace
+    sampled = Tracer(sample_rate=1.0)
+
+    def traced_spans():
+        with sampled.trace("bench"):
+            for _ in range(100):
+                empty_span()
+
+    rows.append(("span in a sampled trace", per_call(traced_spans, max(1, args.iterations // 1000)) / 100))
+
+    async def handler(update, context):
+        return None
+
+    async def measure_handlers():
+        plain = await per_await(handler, args.iterations)
+        wrapped = await per_await(timed_handler(handler), args.iterations)
+        return plain, wrapped
+
+    plain, wrapped = asyncio.run(measure_handlers())
+    rows += [("empty bot handler", plain), ("empty bot handler, timed", wrapped)]
+
+    plain_query = query_cost(None, args.queries)
+    listened_query = query_cost("empty", args.queries)
+    timed_query = query_cost("metrics", args.queries)
+    rows += [
+        ("SQLite primary key lookup", plain_query),
+        ("SQLite primary key lookup, no-op listeners", listened_query),
+        ("SQLite primary key lookup, instrumented", timed_query)
+    ]
+    for label, cost in rows:
+        print(f"{label:<44} {cost / 1000:7.2f} µs")
+    print(f"handler timing adds {(wrapped - plain) / 1000:.2f} µs per update")
+    print(
+        f"query timing adds {(timed_query - plain_query) / 1000:.2f} µs per statement ({timed_query / plain_query - 1:.1%} "
+        f"of the cheapest lookup); no-op listeners alone add {(listened_query - plain_query) / 1000:.2f} µs"
+    )
+
+    # Scrape cost with the cardinality of a busy bot process
+    import bot
+    bot.create_bot()
+    for method in ("sendMessage", "sendPhoto", "editMessageMedia", "answerCallbackQuery", "answerInlineQuery"):
+        TELEGRAM_REQUEST_SECONDS.labels(method).observe(0.1)
+        TELEGRAM_REQUESTS.labels(method, 200).inc()
+    for kind in ("SELECT", "INSERT", "UPDATE", "DELETE", "OTHER"):
+        for engine in ("sync", "async"):
+            DB_QUERY_SECONDS.labels(engine, kind).observe(0.001)
+    started = time.perf_counter()
+    body = REGISTRY.render()
+    print(f"rendering /metrics: {(time.perf_counter() - started) * 1000:.2f} ms for {len(body.splitlines()):,} lines, {len(body) / 1024:.0f} KiB")
+
+if __name__ == "__main__":
+    main()
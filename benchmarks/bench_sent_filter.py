@@ -0,0 +1,65 @@
+"""
+Measure memory, build time and false positives of the sent notification filter against a Python set
+
+Usage: python -m benchmarks.bench_sent_filter [--notifications 1000000] [--lookups 100000]
+"""
+import time
+import random
+import argparse
+import tracemalloc
+from sent_filter import SentNotificationFilter
+
+def make_notifications(count, seed=1):
+    """Create synthetic (id, user_id, property_id, event) rows of sent notifications"""
+    rng = random.Random(seed)
+    rows = []
+    for row_id in range(1, count + 1):
+        event = 'new' if rng.random() < 0.9 else f"price_drop:{rng.randrange(5, 200) * 1_000_000}"
+        rows.append((row_id, rng.randrange(1, 50_000), rng.randrange(1, 20_000), event))
+    return rows
+
+def measure(build):
+    """Build a structure and return it with its build time and the memory it allocated"""
+    started = time.perf_counter()
+    structure = build()
+    elapsed = time.perf_counter() - started
+    # Traced separately, tracemalloc slows the build down several times
+    del structure
+    tracemalloc.start()
+    structure = build()
+    memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return structure, memory, elapsed
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--notifications", type=int, default=1_000_000)
+    parser.add_argument("--lookups", type=int, default=100_000, help="Lookups of notifications that were never sent")
+    args = parser.parse_args()
+
+    rows = make_notifications(args.notifications)
+
+    def build_filter():
+        sent = SentNotificationFilter(capacity=args.notifications)
+        sent.add_rows(rows)
+        return sent
+
+    sent, filter_memory, filter_time = measure(build_filter)
+    sent_set, set_memory, set_time = measure(lambda: {(user_id, property_id, event) for _, user_id, property_id, event in rows})
+    print(f"{args.notifications:,} sent notifications")
+    print(f"{'Bloom filter':<20} {filter_memory / 1024 / 1024:8.1f} MiB  built in {filter_time:6.2f} s")
+    print(f"{'Set of tuples':<20} {set_memory / 1024 / 1024:8.1f} MiB  built in {set_time:6.2f} s")
+
+    # Lookups of unsent notifications (user IDs beyond the synthetic range), which would all skip the database
+    started = time.perf_counter()
+    positives = sum(sent.might_contain(100_000 + n, n % 20_000, 'new') for n in range(args.lookups))
+    elapsed = time.perf_counter() - started
+    print(
+        f"{args.lookups:,} unsent lookups: {positives / args.lookups:.2%} false positives "
+        f"(database checks), {elapsed / args.lookups * 1e6:.1f} µs per lookup"
+    )
+    missed = sum(not sent.might_contain(user_id, property_id, event) for _, user_id, property_id, event in rows[:args.lookups])
+    print(f"Sent notifications reported as unsent: {missed}")
+
+if __name__ == "__main__":
+    main()
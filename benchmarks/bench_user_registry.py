@@ -0,0 +1,79 @@
+"""
+Measure database statements and latency of per-message user tracking, upsert per message vs. the user registry
+
+Usage: python -m benchmarks.bench_user_registry --database-url postgresql://... [--messages 20000] [--users 1000]
+
+Every message resolves its sender to a database ID and records the
+interaction. The benchmark truncates the application tables in the target
+database.
+"""
+import time
+import random
+import asyncio
+import argparse
+from benchmarks.common import use_database, truncate_tables, percentile
+
+def report(label, latencies, statements, messages):
+    print(
+        f"{label:<26} p50 {percentile(latencies, 0.5) * 1000:7.1f} µs  p99 {percentile(latencies, 0.99) * 1000:8.1f} µs  "
+        f"{statements:6} statements ({statements / messages:.3f} per message)"
+    )
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--database-url", required=True)
+    parser.add_argument("--messages", type=int, default=20_000)
+    parser.add_argument("--users", type=int, default=1_000)
+    parser.add_argument("--flush-every", type=int, default=5_000, help="Messages between registry flushes")
+    args = parser.parse_args()
+
+    app = use_database(args.database_url)
+    from sqlalchemy import event
+    from models import db
+    import async_db
+    from user_registry import UserRegistry
+
+    with app.app_context():
+        truncate_tables(db, "notification_outbox", "alert_notifications", "property_alerts", "users")
+
+    rng = random.Random(1)
+    # A few users send most of the messages
+    senders = [1_000_000 + int(rng.paretovariate(1.2)) % args.users for _ in range(args.messages)]
+    statements = []
+
+    def count(connection, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    async def run(label, track):
+        statements.clear()
+        latencies = []
+        for number, telegram_id in enumerate(senders):
+            started = time.perf_counter()
+            await track(number, telegram_id)
+            latencies.append((time.perf_counter() - started) * 1000)
+        report(label, latencies, len(statements), len(senders))
+
+    async def measure():
+        engine = async_db.get_sessionmaker().kw["bind"].sync_engine
+        event.listen(engine, "before_cursor_execute", count)
+        print(f"{args.messages:,} messages from {len(set(senders)):,} users")
+
+        async def get_or_create(number, telegram_id):
+            await async_db.get_or_create_user(telegram_id, first_name="Bench")
+
+        registry = UserRegistry()
+
+        async def tracked(number, telegram_id):
+            await registry.get_user_id(telegram_id, first_name="Bench")
+            if number % args.flush_every == args.flush_every - 1:
+                await registry.flush()
+
+        await run("get_or_create_user", get_or_create)
+        await run("user registry", tracked)
+        event.remove(engine, "before_cursor_execute", count)
+        await async_db.dispose_engine()
+
+    asyncio.run(measure())
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+"""
+Fail when a reconciliation against a catalog of several pages marks listings as removed
+
+Usage: python -m benchmarks.check_catalog_sync [--database-url postgresql://...] [--properties 250]
+
+Serves a synthetic catalog of more than one WordPress page (100 properties) from
+tools/wp_standin.py and reconciles it twice. The first run must store every
+property and the second must find nothing to add, change or remove: a fetch
+that stopped at the first page would mark the rest of the catalog as removed
+and bring it back on the next run. Exits with status 1 if either run is off.
+Without --database-url the check uses a temporary SQLite file; a given
+database has its application tables truncated.
+"""
+import os
+import sys
+import argparse
+import tempfile
+from benchmarks.common import use_database, truncate_tables
+from benchmarks.load_test import free_port, start_server
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--database-url", help="Defaults to a temporary SQLite file")
+    parser.add_argument("--properties", type=int, default=250, help="Size of the stand-in catalog, more than one page")
+    args = parser.parse_args()
+
+    database_url = args.database_url or f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'check.db')}"
+    wp_port = free_port()
+    server = start_server("tools.wp_standin", wp_port, "--properties", str(args.properties))
+    try:
+        # Read by config.py, so set before the application is imported
+        os.environ["WP_API_URL"] = f"http://127.0.0.1:{wp_port}/wp-json/wp/v2/property"
+        app = use_database(database_url)
+        from models import db, PropertyListing
+        from alert_service import reconcile_catalog
+        with app.app_context():
+            truncate_tables(db, "notification_outbox", "alert_notifications", "property_alerts", "property_listings", "users")
+
+        first = reconcile_catalog()
+        second = reconcile_catalog()
+        with app.app_context():
+            current = PropertyListing.query.filter(PropertyListing.removed_at.is_(None)).count()
+    finally:
+        server.terminate()
+        server.wait()
+
+    print(f"first reconcile: {first} changes, second: {second} changes, current listings: {current}")
+    failures = []
+    if first != args.properties or current != args.properties:
+        failures.append(f"expected {args.properties} current listings after the first reconcile")
+    if second:
+        failures.append("the second reconcile of an unchanged catalog found changes")
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    sys.exit(1 if failures else 0)
+
+if __name__ == "__main__":
+    main()
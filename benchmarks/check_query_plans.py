@@ -0,0 +1,170 @@
+"""
+Fail when a hot query in db_helpers falls back to a sequential scan on a seeded dataset
+
+Usage: python -m benchmarks.check_query_plans --database-url postgresql://... [--listings 20000]
+
+Every hot query is captured by calling the real db_helpers function, then
+EXPLAINed, so a change to a query shape is checked as well as a missing index.
+Exits with status 1 if any plan scans one of the large tables sequentially.
+The check truncates the application tables in the target database.
+"""
+import sys
+import json
+import time
+import argparse
+from datetime import datetime, timedelta
+from benchmarks.common import use_database, truncate_tables
+from benchmarks.synthetic import LOCATIONS, make_properties
+
+# Tables that grow with usage; small tables like job_states may be scanned
+LARGE_TABLES = {"users", "property_alerts", "property_listings", "alert_notifications", "notification_outbox"}
+
+def seed(db, listings, users, alerts, notifications, outbox):
+    """Fill the tables with synthetic rows and refresh the planner statistics"""
+    from db_helpers import sync_property_listings
+
+    truncate_tables(db, "notification_outbox", "alert_notifications", "property_alerts", "property_listings", "users")
+    sync_property_listings(make_properties(listings))
+    locations = "ARRAY[" + ", ".join(f"'{location}'" for location in LOCATIONS) + "]"
+    statements = [
+        # Listings first seen over the last year, 5% of them removed
+        "UPDATE property_listings SET first_seen = now() - random() * interval '365 days', "
+        "removed_at = CASE WHEN random() < 0.05 THEN now() END",
+        f"INSERT INTO users (telegram_id, first_name, created_at, is_active, last_interaction) "
+        f"SELECT 1000000 + n, 'User ' || n, now(), random() < 0.95, now() FROM generate_series(1, {users}) n",
+        f"INSERT INTO property_alerts (user_id, location, min_price, max_price, min_bedrooms, notify_price_drops, "
+        f"delivery_mode, created_at, is_active) "
+        f"SELECT 1 + floor(random() * {users}), "
+        f"CASE WHEN random() < 0.7 THEN ({locations})[1 + floor(random() * {len(LOCATIONS)})] END, "
+        f"CASE WHEN random() < 0.6 THEN floor(random() * 100) * 1000000 END, "
+        f"CASE WHEN random() < 0.5 THEN 100000000 + floor(random() * 100) * 1000000 END, "
+        f"CASE WHEN random() < 0.5 THEN 1 + floor(random() * 6) END, random() < 0.3, 'instant', now(), "
+        f"random() < 0.8 FROM generate_series(1, {alerts}) n",
+        f"INSERT INTO alert_notifications (user_id, property_id, event, sent_at) "
+        f"SELECT 1 + floor(random() * {users}), 1 + floor(random() * {listings}), 'new', "
+        f"now() - random() * interval '365 days' FROM generate_series(1, {notifications}) n "
+        f"ON CONFLICT DO NOTHING",
+        f"INSERT INTO notification_outbox (user_id, property_id, event, telegram_id, message, status, attempts, "
+        f"next_attempt_at, created_at, delivered_at) "
+        f"SELECT 1 + floor(random() * {users}), 1 + floor(random() * {listings}), 'outbox:' || n, 1, 'Message', "
+        f"CASE WHEN n % 50 = 0 THEN 'pending' WHEN n % 201 = 0 THEN 'failed' ELSE 'delivered' END, 1, "
+        f"now() - random() * interval '30 days', now() - random() * interval '30 days', "
+        f"CASE WHEN n % 50 <> 0 AND n % 201 <> 0 THEN now() - random() * interval '30 days' END "
+        f"FROM generate_series(1, {outbox}) n",
+    ]
+    with db.engine.begin() as connection:
+        for statement in statements:
+            connection.execute(db.text(statement))
+    # Set the visibility map and statistics as autovacuum would
+    with db.engine.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+        for table in sorted(LARGE_TABLES):
+            connection.execute(db.text(f"VACUUM ANALYZE {table}"))
+
+def capture(db, run):
+    """Run a function and return the SQL statements and parameters it sent"""
+    from sqlalchemy import event
+
+    statements = []
+
+    def record(connection, cursor, statement, parameters, context, executemany):
+        if not executemany and statement.lstrip().upper().startswith(("SELECT", "UPDATE", "WITH", "DELETE")):
+            statements.append((statement, parameters))
+
+    event.listen(db.engine, "before_cursor_execute", record)
+    try:
+        run()
+    finally:
+        event.remove(db.engine, "before_cursor_execute", record)
+    return statements
+
+def plan_nodes(plan):
+    """Yield every node of a JSON query plan"""
+    yield plan
+    for child in plan.get("Plans", []):
+        yield from plan_nodes(child)
+
+def explain(db, statement, parameters):
+    """Get the JSON plan of a captured statement"""
+    with db.engine.connect() as connection:
+        result = connection.exec_driver_sql(f"EXPLAIN (FORMAT JSON) {statement}", parameters or {})
+        plan = result.scalar()
+    return (json.loads(plan) if isinstance(plan, str) else plan)[0]["Plan"]
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--database-url", required=True)
+    parser.add_argument("--listings", type=int, default=20_000)
+    parser.add_argument("--users", type=int, default=20_000)
+    parser.add_argument("--alerts", type=int, default=30_000)
+    parser.add_argument("--notifications", type=int, default=200_000)
+    parser.add_argument("--outbox", type=int, default=100_000)
+    args = parser.parse_args()
+
+    app = use_database(args.database_url)
+    from models import db, User, PropertyAlert, PropertyListing
+    from db_helpers import (
+        get_or_create_user, get_user_alerts, get_user_alert, count_matching_properties,
+        get_matching_properties_for_alert, get_new_properties_since, sync_property_listings,
+        get_notification_targets, load_sent_filter, claim_notifications, get_outbox_stats,
+        get_active_alerts, _sent_notification_rows
+    )
+    from alert_index import ensure_alert_index_loaded
+
+    with app.app_context():
+        started = time.perf_counter()
+        seed(db, args.listings, args.users, args.alerts, args.notifications, args.outbox)
+        print(f"Seeded {args.listings:,} listings, {args.users:,} users, {args.alerts:,} alerts, "
+              f"{args.notifications:,} sent notifications and {args.outbox:,} outbox rows "
+              f"in {time.perf_counter() - started:.0f} s\n")
+
+        # The in-memory structures load with full scans by design, so load them before capturing
+        ensure_alert_index_loaded(get_active_alerts)
+        load_sent_filter()
+
+        user = User.query.order_by(User.id).first()
+        alert = PropertyAlert.query.filter(PropertyAlert.location.isnot(None)).order_by(PropertyAlert.id).first()
+        listings = PropertyListing.query.filter(PropertyListing.removed_at.is_(None)).order_by(PropertyListing.id).limit(3).all()
+        catalog = make_properties(5)
+
+        # Structure: [(label, function, large tables it may scan sequentially)]
+        hot_queries = [
+            ("get_or_create_user", lambda: get_or_create_user(telegram_id=user.telegram_id)),
+            ("get_user_alerts", lambda: get_user_alerts(alert.user_id)),
+            ("get_user_alert", lambda: get_user_alert(alert.id, alert.user_id)),
+            ("count_matching_properties", lambda: count_matching_properties("Karen", 20_000_000, 80_000_000, 3)),
+            ("get_matching_properties_for_alert",
+             lambda: get_matching_properties_for_alert(alert, limit=20, unnotified=True)),
+            ("get_new_properties_since", lambda: get_new_properties_since(datetime.utcnow() - timedelta(hours=6))),
+            ("sync_property_listings (webhook)", lambda: sync_property_listings(catalog, complete=False)),
+            # A listing can match a large share of the alerts the index returns, and a hash join
+            # over them and their users beats thousands of index probes
+            ("get_notification_targets", lambda: get_notification_targets(listings), {"property_alerts", "users"}),
+            ("get_outbox_stats", lambda: get_outbox_stats()),
+            ("claim_notifications", lambda: claim_notifications("check", 50, 300)),
+            ("sent filter refresh", lambda: list(_sent_notification_rows(args.notifications - 100))),
+        ]
+
+        failures = 0
+        for label, run, *allowed in hot_queries:
+            allowed = allowed[0] if allowed else set()
+            statements = capture(db, run)
+            db.session.rollback()
+            for statement, parameters in statements:
+                nodes = list(plan_nodes(explain(db, statement, parameters)))
+                seq_scans = sorted({
+                    node["Relation Name"] for node in nodes
+                    if node["Node Type"] == "Seq Scan" and node.get("Relation Name") in LARGE_TABLES - allowed
+                })
+                indexes = sorted({node["Index Name"] for node in nodes if "Index Name" in node})
+                if seq_scans:
+                    failures += 1
+                    print(f"FAIL  {label}: sequential scan on {', '.join(seq_scans)}")
+                    print("      " + " ".join(statement.split())[:300])
+                else:
+                    print(f"ok    {label}: {', '.join(indexes) or 'no table access'}")
+
+        print(f"\n{failures} hot queries fall back to a sequential scan" if failures else "\nNo sequential scans")
+    sys.exit(1 if failures else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+import os
+import sys
+import math
+import subprocess
+
+def use_database(database_url):
+    """
+    Point the application at a benchmark database and return the Flask app
+
+    Must be called before anything imports app.py, which binds DATABASE_URL at import.
+    Benchmarks write to and truncate tables, so never point this at production.
+    """
+    if "app" in sys.modules:
+        raise RuntimeError("use_database() must be called before app.py is imported")
+    os.environ["DATABASE_URL"] = database_url
+    from app import app
+    from migrations import migrate
+    with app.app_context():
+        migrate()
+    return app
+
+def percentile(values, share):
+    """
+    Nearest-rank percentile of values, e.g. share=0.95 for the p95; None without values
+
+    The smallest value with at least share of the values at or below it, so it
+    is always one of the measured values. Every benchmark reports percentiles
+    with it, so their results compare.
+    """
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(share * len(ordered)) - 1)]
+
+def truncate_tables(db, *tables):
+    """Empty the given tables, and the tables referencing them, before a benchmark run"""
+    # End the session's transaction first, its locks would block the TRUNCATE
+    db.session.remove()
+    with db.engine.begin() as connection:
+        if connection.dialect.name != "sqlite":
+            connection.execute(db.text(f"TRUNCATE {', '.join(tables)} RESTART IDENTITY CASCADE"))
+            return
+        # SQLite has no TRUNCATE: delete the rows, referencing tables first as CASCADE would.
+        # IDs restart at 1 since the tables don't use AUTOINCREMENT.
+        names = set(tables)
+        for table in db.metadata.sorted_tables:
+            if any(key.column.table.name in names for key in table.foreign_keys):
+                names.add(table.name)
+        for table in reversed(db.metadata.sorted_tables):
+            if table.name in names:
+                connection.execute(table.delete())
+
+def analyze_tables(db, *tables):
+    """Set the visibility map and planner statistics as autovacuum would (ANALYZE on SQLite)"""
+    db.session.remove()
+    with db.engine.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+        for table in tables:
+            connection.execute(db.text(f"{'ANALYZE' if connection.dialect.name == 'sqlite' else 'VACUUM ANALYZE'} {table}"))
+
+def git_revision():
+    """Short hash of the checked out commit, to label saved results, or None outside a git checkout"""
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
@@ -0,0 +1,459 @@
+"""
+Replay synthetic Telegram updates from thousands of chats through the bot's real Application handlers
+
+Usage: python -m benchmarks.load_test --database-url postgresql://... [--chats 1000] [--active 100]
+           [--think-time 0.2] [--telegram-latency-ms 50] [--concurrent-updates 8] [--output results.json]
+
+Starts tools/wp_standin.py and tools/fake_bot_api.py in their own processes,
+points the bot at them, syncs the stand-in catalog and builds the application
+with create_bot(). Updates go into its update queue as polling would deliver
+them, so BOT_CONCURRENT_UPDATES, the conversation states and every handler
+run as in production. Each simulated chat runs one scenario, chosen by weight:
+browsing from /start, /search with Next Property taps, free-text greetings and
+location queries, or the full alert creation flow. A chat waits for the bot to
+finish an update, then thinks for a random time before the next one. It taps
+only the buttons the bot showed it, read back from the fake Bot API. At most
+--active chats are in a scenario at a time.
+
+Latency runs from the moment an update is queued until its last handler
+finishes. The report gives throughput, latency percentiles per step and per
+handler, handler errors and updates no handler answered. --output saves it as
+JSON, to compare releases. The scheduler and delivery workers don't run.
+The benchmark truncates the application tables in the target database.
+"""
+import os
+import sys
+import json
+import time
+import socket
+import random
+import asyncio
+import argparse
+import tempfile
+import subprocess
+from collections import Counter, defaultdict
+from datetime import datetime
+import httpx
+from benchmarks.common import use_database, truncate_tables, git_revision, percentile
+from benchmarks.synthetic import LOCATIONS
+
+# Structure: {scenario: weight}
+SCENARIOS = {"browse": 0.3, "search": 0.2, "free_text": 0.3, "create_alert": 0.2}
+
+GREETINGS = ["hello", "hi there", "good morning"]
+LOCATION_QUERIES = [
+    "Show me properties in {location}",
+    "I'm looking for a house in {location}",
+    "find properties in {location}",
+]
+
+# Seconds a chat waits for one update before counting it as lost
+UPDATE_TIMEOUT = 60
+
+def percentiles(latencies):
+    """p50, p95 and p99 of latencies in seconds, in milliseconds"""
+    if not latencies:
+        return {"p50": None, "p95": None, "p99": None}
+    return {name: percentile(latencies, share) * 1000 for name, share in (("p50", 0.5), ("p95", 0.95), ("p99", 0.99))}
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def start_server(module, port, *arguments):
+    """Start a stand-in server in its own process and wait until it answers"""
+    server = subprocess.Popen(
+        [sys.executable, "-m", module, "--port", str(port), *arguments],
+        stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True
+    )
+    for _ in range(100):
+        if server.poll() is not None:
+            sys.exit(f"{module} exited:\n{server.stderr.read()}")
+        try:
+            httpx.get(f"http://127.0.0.1:{port}/standin/stats" if module == "tools.fake_bot_api"
+                      else f"http://127.0.0.1:{port}/wp-json/wp/v2/property/1", timeout=1)
+            return server
+        except httpx.HTTPError:
+            time.sleep(0.1)
+    server.kill()
+    sys.exit(f"{module} did not start on port {port}")
+
+class Results:
+    """Measurements of a load test run"""
+
+    def __init__(self):
+        # Structure: {step: [seconds]}
+        self.steps = defaultdict(list)
+        self.step_errors = Counter()
+        self.step_unhandled = Counter()
+        # Structure: {handler: [seconds]}
+        self.handlers = defaultdict(list)
+        self.handler_errors = Counter()
+        self.errors = Counter()
+        self.lost_updates = 0
+        self.missing_buttons = Counter()
+        # Handlers that ran per update in flight. Structure: {update_id: [handler names]}
+        self.ran = {}
+
+    def report(self, elapsed, telegram_calls):
+        updates = sum(len(latencies) for latencies in self.steps.values())
+        all_latencies = [latency for latencies in self.steps.values() for latency in latencies]
+        return {
+            "updates": updates,
+            "elapsed": elapsed,
+            "throughput": updates / elapsed if elapsed else 0,
+            "latency": percentiles(all_latencies),
+            "errors": sum(self.step_errors.values()),
+            "unhandled": sum(self.step_unhandled.values()),
+            "lost_updates": self.lost_updates,
+            "steps": {
+                step: {"count": len(latencies), **percentiles(latencies),
+                       "errors": self.step_errors[step], "unhandled": self.step_unhandled[step]}
+                for step, latencies in sorted(self.steps.items())
+            },
+            "handlers": {
+                name: {"calls": len(latencies), **percentiles(latencies), "errors": self.handler_errors[name],
+                       "error_rate": self.handler_errors[name] / len(latencies)}
+                for name, latencies in sorted(self.handlers.items())
+            },
+            "error_types": dict(self.errors),
+            "missing_buttons": dict(self.missing_buttons),
+            "telegram_calls": telegram_calls,
+            "telegram_calls_per_update": sum(telegram_calls.values()) / updates if updates else 0
+        }
+
+class SimulatedChat:
+    """A private chat whose user sends messages and taps the buttons the bot showed"""
+
+    def __init__(self, driver, chat_id, rng):
+        self.driver = driver
+        self.chat_id = chat_id
+        self.rng = rng
+        self.user = {"id": chat_id, "is_bot": False, "first_name": f"Load{chat_id}", "language_code": "en"}
+        self.message_ids = 0
+
+    async def send(self, text, step=None):
+        """Send a text message or command and wait for the bot to finish with it"""
+        self.message_ids += 1
+        message = {
+            "message_id": self.message_ids,
+            "date": int(time.time()),
+            "chat": {"id": self.chat_id, "type": "private"},
+            "from": self.user,
+            "text": text
+        }
+        if text.startswith("/"):
+            message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+        await self.driver.submit({"message": message}, step or (text if text.startswith("/") else "text"))
+        await self.think()
+
+    async def tap(self, data, step=None):
+        """
+        Tap the button with this callback data on the newest bot message showing it
+
+        Returns:
+            bool: False if the bot showed no such button
+        """
+        return await self._tap(lambda button: button == data, step or f"tap {data}")
+
+    async def tap_any(self, prefix, step=None):
+        """Tap one of the buttons whose callback data starts with prefix, chosen at random"""
+        return await self._tap(lambda button: button.startswith(prefix), step or f"tap {prefix.rstrip(':')}", choose=True)
+
+    async def _tap(self, matches, step, choose=False):
+        for message in reversed(await self.driver.bot_messages(self.chat_id)):
+            rows = (message.get("reply_markup") or {}).get("inline_keyboard", [])
+            buttons = [button["callback_data"] for row in rows for button in row
+                       if matches(button.get("callback_data", ""))]
+            if buttons:
+                data = self.rng.choice(buttons) if choose else buttons[0]
+                await self.driver.submit({"callback_query": {
+                    "id": str(self.driver.next_update_id()),
+                    "from": self.user,
+                    "chat_instance": str(self.chat_id),
+                    "data": data,
+                    "message": message
+                }}, step)
+                await self.think()
+                return True
+        self.driver.results.missing_buttons[step] += 1
+        return False
+
+    async def think(self):
+        if self.driver.think_time:
+            await asyncio.sleep(self.rng.expovariate(1 / self.driver.think_time))
+
+async def browse(chat):
+    """/start, the Properties button, then a few Next Property taps"""
+    await chat.send("/start")
+    if await chat.tap("show_properties"):
+        for _ in range(chat.rng.randint(2, 5)):
+            if not await chat.tap("property:next"):
+                break
+
+async def search(chat):
+    """/search, Next Property taps, and sometimes Back to Search"""
+    await chat.send("/search")
+    for _ in range(chat.rng.randint(1, 4)):
+        if not await chat.tap("property:next"):
+            break
+    if chat.rng.random() < 0.3:
+        await chat.tap("property:back")
+
+async def free_text(chat):
+    """A greeting, then a natural language query for a location, then Next Property taps"""
+    await chat.send(chat.rng.choice(GREETINGS), step="text greeting")
+    location = chat.rng.choice(LOCATIONS)
+    await chat.send(chat.rng.choice(LOCATION_QUERIES).format(location=location), step="text location query")
+    for _ in range(chat.rng.randint(0, 3)):
+        if not await chat.tap("property:next"):
+            break
+
+async def create_alert(chat):
+    """/alerts through a new alert: location, prices, bedrooms, price drops and delivery mode"""
+    await chat.send("/alerts")
+    if not await chat.tap("alert:create") or not await chat.tap_any("alert_location:"):
+        return
+    min_price = chat.rng.choice([0, 5, 10, 20]) * 1_000_000
+    await chat.send(str(min_price) if min_price else "skip", step="text alert min price")
+    await chat.send(str(min_price + chat.rng.choice([10, 30, 60]) * 1_000_000), step="text alert max price")
+    await chat.send(str(chat.rng.randint(1, 5)), step="text alert bedrooms")
+    if await chat.tap_any("alert_price_drops:"):
+        await chat.tap_any("alert_delivery:")
+
+SCENARIO_FUNCTIONS = {"browse": browse, "search": search, "free_text": free_text, "create_alert": create_alert}
+
+class LoadDriver:
+    """Feeds simulated updates into an Application and records how it handles them"""
+
+    def __init__(self, application, fake_api_url, think_time):
+        self.application = application
+        self.fake_api_url = fake_api_url
+        self.think_time = think_time
+        self.results = Results()
+        self._update_ids = 0
+        # Structure: {update_id: future set when the update's last handler group finished}
+        self._pending = {}
+        self._client = httpx.AsyncClient(base_url=fake_api_url, timeout=10)
+
+    def next_update_id(self):
+        self._update_ids += 1
+        return self._update_ids
+
+    async def bot_messages(self, chat_id):
+        response = await self._client.get(f"/standin/chats/{chat_id}")
+        return response.json()
+
+    async def telegram_calls(self):
+        return (await self._client.get("/standin/stats")).json()
+
+    async def close(self):
+        await self._client.aclose()
+
+    def install(self):
+        """Wrap the handlers to time them and add the hooks that observe each update"""
+        from telegram import Update
+        from telegram.ext import TypeHandler
+        from metrics import instrument_handlers
+
+        results = self.results
+
+        def record(callback):
+            name = callback.__name__
+
+            async def recorded(update, context):
+                started = time.perf_counter()
+                try:
+                    return await callback(update, context)
+                except Exception:
+                    results.handler_errors[name] += 1
+                    raise
+                finally:
+                    results.handlers[name].append(time.perf_counter() - started)
+                    ran = results.ran.get(getattr(update, "update_id", None))
+                    if ran is not None:
+                        ran.append(name)
+
+            recorded.__name__ = name
+            return recorded
+
+        async def finished(update, context):
+            future = self._pending.pop(update.update_id, None)
+            if future is not None and not future.done():
+                future.set_result(None)
+
+        async def on_error(update, context):
+            results.errors[type(context.error).__name__] += 1
+            ran = results.ran.get(getattr(update, "update_id", None))
+            if ran is not None:
+                ran.append("error")
+
+        instrument_handlers(self.application, wrap=record)
+        # Runs after every handler group of an update, even when a handler raised
+        self.application.add_handler(TypeHandler(Update, finished), group=1_000)
+        self.application.add_error_handler(on_error)
+
+    async def submit(self, payload, step):
+        """Queue an update and wait until the application finished handling it"""
+        from telegram import Update
+
+        update_id = self.next_update_id()
+        update = Update.de_json({"update_id": update_id, **payload}, self.application.bot)
+        future = asyncio.get_running_loop().create_future()
+        self._pending[update_id] = future
+        self.results.ran[update_id] = ran = []
+        started = time.perf_counter()
+        await self.application.update_queue.put(update)
+        try:
+            await asyncio.wait_for(future, UPDATE_TIMEOUT)
+        except asyncio.TimeoutError:
+            self.results.lost_updates += 1
+            self._pending.pop(update_id, None)
+            return
+        finally:
+            self.results.ran.pop(update_id, None)
+        self.results.steps[step].append(time.perf_counter() - started)
+        if "error" in ran:
+            self.results.step_errors[step] += 1
+        elif not [name for name in ran if name != "track_user_activity"]:
+            self.results.step_unhandled[step] += 1
+
+async def run_load(driver, args):
+    """Run every simulated chat, at most --active at a time"""
+    active = asyncio.Semaphore(args.active)
+    names, weights = zip(*SCENARIOS.items())
+    scenario_counts = Counter()
+
+    async def run_chat(number):
+        rng = random.Random(args.seed * 1_000_003 + number)
+        name = rng.choices(names, weights)[0]
+        scenario_counts[name] += 1
+        async with active:
+            await SCENARIO_FUNCTIONS[name](SimulatedChat(driver, 10_000_000 + number, rng))
+
+    started = time.perf_counter()
+    await asyncio.gather(*(run_chat(number) for number in range(args.chats)))
+    return time.perf_counter() - started, scenario_counts
+
+async def run(args):
+    import bot
+    from alert_service import reconcile_catalog
+    from async_db import dispose_engine
+    from user_registry import start_activity_flusher, stop_activity_flusher
+
+    # Listings for the alert previews, synced from the stand-in as the reconciliation job would
+    reconcile_catalog()
+
+    application = bot.create_bot()
+    driver = LoadDriver(application, f"http://127.0.0.1:{args.fake_api_port}", args.think_time)
+    driver.install()
+    await application.initialize()
+    await application.start()
+    # As main.py does after starting the bot
+    await bot.preload_popular_locations(application)
+    start_activity_flusher()
+    try:
+        elapsed, scenario_counts = await run_load(driver, args)
+        telegram_calls = await driver.telegram_calls()
+    finally:
+        await bot.stop_cache_warmer()
+        await application.stop()
+        await application.shutdown()
+        await stop_activity_flusher()
+        await dispose_engine()
+        await driver.close()
+    report = driver.results.report(elapsed, telegram_calls)
+    report["scenarios"] = dict(scenario_counts)
+    return report
+
+def format_ms(value, spec=".0f"):
+    """A latency percentile for the report; "n/a" when nothing was timed"""
+    return "n/a" if value is None else format(value, spec)
+
+def print_report(report, args):
+    print(
+        f"{args.chats:,} chats, {args.active} active, think time {args.think_time} s, "
+        f"Telegram latency {args.telegram_latency_ms:.0f} ms, {args.concurrent_updates} concurrent updates"
+    )
+    latency = report["latency"]
+    print(
+        f"{report['updates']:,} updates in {report['elapsed']:.1f} s: {report['throughput']:.1f} updates/s, "
+        f"p50 {format_ms(latency['p50'])} ms, p95 {format_ms(latency['p95'])} ms, p99 {format_ms(latency['p99'])} ms"
+    )
+    print(
+        f"errors {report['errors']} ({report['errors'] / max(report['updates'], 1):.1%}), "
+        f"unhandled {report['unhandled']}, lost {report['lost_updates']}, "
+        f"{report['telegram_calls_per_update']:.2f} Telegram calls per update"
+    )
+    print()
+    print(f"{'step':<30} {'count':>7} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'errors':>7} {'unhandled':>9}")
+    for step, row in report["steps"].items():
+        print(
+            f"{step:<30} {row['count']:7} {format_ms(row['p50'], '.1f'):>8} {format_ms(row['p95'], '.1f'):>8} "
+            f"{format_ms(row['p99'], '.1f'):>8} {row['errors']:7} {row['unhandled']:9}"
+        )
+    print()
+    print(f"{'handler':<30} {'calls':>7} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'errors':>7}")
+    for name, row in report["handlers"].items():
+        print(
+            f"{name:<30} {row['calls']:7} {format_ms(row['p50'], '.1f'):>8} {format_ms(row['p95'], '.1f'):>8} "
+            f"{format_ms(row['p99'], '.1f'):>8} {row['error_rate']:6.1%}"
+        )
+    if report["error_types"]:
+        print(f"\nerrors by type: {report['error_types']}")
+    if report["missing_buttons"]:
+        print(f"taps skipped because the bot showed no such button: {report['missing_buttons']}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--database-url", required=True)
+    parser.add_argument("--chats", type=int, default=1_000, help="Simulated chats, each running one scenario")
+    parser.add_argument("--active", type=int, default=100, help="Chats in a scenario at the same time")
+    parser.add_argument("--think-time", type=float, default=0.2, help="Average seconds a user waits between two steps")
+    parser.add_argument("--telegram-latency-ms", type=float, default=50, help="Average round trip of the fake Bot API")
+    parser.add_argument("--properties", type=int, default=200, help="Size of the stand-in catalog")
+    parser.add_argument("--concurrent-updates", type=int, default=8, help="BOT_CONCURRENT_UPDATES of the bot under test")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="Write the report as JSON to this file")
+    args = parser.parse_args()
+
+    wp_port, args.fake_api_port = free_port(), free_port()
+    servers = [
+        start_server("tools.wp_standin", wp_port, "--properties", str(args.properties)),
+        start_server("tools.fake_bot_api", args.fake_api_port, "--latency-ms", str(args.telegram_latency_ms)),
+    ]
+    try:
+        # Read by config.py, so set before the application is imported
+        os.environ.update(
+            WP_API_URL=f"http://127.0.0.1:{wp_port}/wp-json/wp/v2/property",
+            TELEGRAM_API_URL=f"http://127.0.0.1:{args.fake_api_port}/bot",
+            TELEGRAM_TOKEN=os.environ.get("TELEGRAM_TOKEN") or "123456:load-test",
+            BOT_CONCURRENT_UPDATES=str(args.concurrent_updates),
+            POPULARITY_FILE=os.path.join(tempfile.mkdtemp(), "popularity.json"),
+            TRACE_SAMPLE_RATE=os.environ.get("TRACE_SAMPLE_RATE", "0")
+        )
+        app = use_database(args.database_url)
+        from models import db
+        with app.app_context():
+            truncate_tables(db, "notification_outbox", "alert_notifications", "property_alerts", "property_listings", "users")
+
+        report = asyncio.run(run(args))
+    finally:
+        for server in servers:
+            server.terminate()
+            server.wait()
+
+    print_report(report, args)
+    if args.output:
+        report["run"] = {
+            "revision": git_revision(),
+            "finished_at": datetime.utcnow().isoformat(),
+            **{key: value for key, value in vars(args).items() if key not in ("database_url", "output", "fake_api_port")}
+        }
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"\nWrote {args.output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+import random
+from types import SimpleNamespace
+
+# Nairobi neighbourhoods used for synthetic listings and alerts
+LOCATIONS = [
+    "Lavington", "Kilimani", "Karen", "Westlands", "Runda", "Kileleshwa", "Muthaiga",
+    "Lower Kabete", "Spring Valley", "Gigiri", "Loresho", "Riverside", "Parklands",
+    "Kitisuru", "Nyari", "Langata", "Syokimau", "Ruiru", "Thika Road", "Ngong Road"
+]
+
+def make_alerts(count, seed=1):
+    """
+    Create synthetic property alerts
+
+    Args:
+        count (int): Number of alerts
+        seed (int): Random seed, so runs are comparable
+
+    Returns:
+        list: Objects with the attributes of a PropertyAlert
+    """
+    rng = random.Random(seed)
+    alerts = []
+    for alert_id in range(1, count + 1):
+        min_price = rng.randrange(5, 150) * 1_000_000 if rng.random() < 0.6 else None
+        max_price = None
+        if rng.random() < 0.5:
+            max_price = (min_price or 5_000_000) + rng.randrange(5, 100) * 1_000_000
+        alerts.append(SimpleNamespace(
+            id=alert_id,
+            user_id=rng.randrange(1, max(2, count // 3)),
+            location=rng.choice(LOCATIONS) if rng.random() < 0.7 else None,
+            min_price=min_price,
+            max_price=max_price,
+            min_bedrooms=rng.randrange(1, 7) if rng.random() < 0.5 else None,
+            is_active=True
+        ))
+    return alerts
+
+def make_property(property_id, rng):
+    """Create one synthetic property shaped like a WordPress API response with _embed"""
+    location = rng.choice(LOCATIONS)
+    bedrooms = rng.randrange(1, 8)
+    price = str(rng.randrange(5, 200) * 1_000_000) if rng.random() < 0.9 else "Price on request"
+    image = f"https://avierhomes.co.ke/wp-content/uploads/2025/03/property-{property_id}.jpg"
+    return {
+        "id": property_id,
+        "date": "2025-03-01T10:00:00",
+        "modified": "2025-03-02T12:00:00",
+        "slug": f"property-{property_id}",
+        "status": "publish",
+        "link": f"https://avierhomes.co.ke/property/property-{property_id}/",
+        "title": {"rendered": f"{bedrooms} Bedroom Home in {location} #{property_id}"},
+        "content": {"rendered": "<p>" + "Spacious family home with a garden. " * 20 + "</p>"},
+        "acf": {
+            "location": location,
+            "price": price,
+            "bedrooms": f"{bedrooms} Bedrooms ALL ensuite + DSQ",
+            "bathrooms": str(bedrooms + rng.randrange(0, 2)),
+            "area": f"{rng.randrange(1, 5)} acre",
+        },
+        "_links": {"self": [{"href": f"https://avierhomes.co.ke/wp-json/wp/v2/property/{property_id}"}]},
+        "_embedded": {
+            "author": [{"id": 1, "name": "Avier Homes", "link": "https://avierhomes.co.ke/author/admin/",
+                        "avatar_urls": {size: f"https://secure.gravatar.com/avatar/x?s={size}" for size in ("24", "48", "96")}}],
+            "wp:featuredmedia": [{
+                "id": property_id * 10,
+                "source_url": image,
+                "media_details": {
+                    "width": 1600,
+                    "height": 1067,
+                    "sizes": {
+                        size: {"source_url": image.replace(".jpg", f"-{size}.jpg"), "width": 300, "height": 200}
+                        for size in ("thumbnail", "medium", "medium_large", "large", "1536x1536")
+                    }
+                }
+            }]
+        }
+    }
+
+def make_properties(count, seed=1, start_id=1):
+    """
+    Create synthetic properties shaped like WordPress API responses
+
+    Args:
+        count (int): Number of properties
+        seed (int): Random seed, so runs are comparable
+        start_id (int): WordPress ID of the first property
+
+    Returns:
+        list: Property dictionaries
+    """
+    rng = random.Random(seed)
+    return [make_property(property_id, rng) for property_id in range(start_id, start_id + count)]
@@ -1,20 +1,47 @@
+import html
 import logging
 import re
 import time
 import asyncio
-from telegram.ext import Application, CommandHandler, CallbackQueryHandler, ConversationHandler, ContextTypes, MessageHandler, filters
-from telegram import Update, InlineKeyboardMarkup, InlineKeyboardButton, ReplyKeyboardMarkup, ReplyKeyboardRemove
+from telegram.ext import Application, CommandHandler, CallbackQueryHandler, ConversationHandler, ContextTypes, InlineQueryHandler, MessageHandler, TypeHandler, filters
+from telegram import (
+    Update, InlineKeyboardMarkup, InlineKeyboardButton, InputMediaPhoto, ReplyKeyboardMarkup, ReplyKeyboardRemove,
+    InlineQueryResultArticle, InlineQueryResultPhoto, InputTextMessageContent
+)
+from telegram.constants import MessageLimit
+from telegram.error import BadRequest
 
-from config import TELEGRAM_TOKEN, BOT_MESSAGES, ERROR_MESSAGES, CACHE_TTL
-from api import get_locations, get_properties_by_location
-from utils import format_property_message, get_property_image_url
-from app import app
-from db_helpers import (
-    get_or_create_user,
+from config import (
+    TELEGRAM_TOKEN, TELEGRAM_API_URL, BOT_MESSAGES, ERROR_MESSAGES, CACHE_TTL,
+    INLINE_PAGE_SIZE, INLINE_CACHE_TIME, INLINE_FETCH_TIMEOUT,
+    POPULAR_LOCATIONS_TOP_K, CACHE_WARM_INTERVAL, CACHE_REFRESH_MARGIN, CATALOG_VERSION_CHECK_INTERVAL, DIGEST_MAX_ITEMS,
+    BOT_CONCURRENT_UPDATES
+)
+from api import get_locations, get_properties_by_location, fetch_properties, get_catalog_snapshot, load_catalog_snapshot, note_catalog_version
+from inline_search import search_catalog, query_location
+from popularity import record_location_lookup, top_locations, load_popularity, save_popularity
+from utils import format_property_message, get_property_image_url, compact_properties
+from cache_backend import get_cache_backend, CacheNamespace
+from prefetch import (
+    get_property_caption,
+    get_property_photo,
+    remember_photo_file_id,
+    schedule_prefetch,
+    cancel_prefetch
+)
+from async_db import (
     create_property_alert,
     get_user_alerts,
-    delete_property_alert
+    get_user_alert,
+    delete_property_alert,
+    count_matching_properties,
+    get_data_version
 )
+from db_helpers import CATALOG_VERSION
+from alert_service import queue_alert_backfill
+from user_registry import user_registry
+from metrics import CACHE_LOOKUPS, MeteredHTTPXRequest, instrument_handlers
+from tracing import TracedApplication, span
 
 # Enable logging
 logging.basicConfig(
@@ -28,11 +55,170 @@ SELECTING_LOCATION, SELECTING_BUDGET, SELECTING_BEDROOMS, VIEWING_PROPERTIES, CH
 
 # Alert conversation states
 (ALERT_MAIN, ALERT_CREATING, ALERT_LOCATION, ALERT_MIN_PRICE, 
-ALERT_MAX_PRICE, ALERT_MIN_BEDROOMS, ALERT_LIST, ALERT_DELETE_CONFIRM) = range(5, 13)
+ALERT_MAX_PRICE, ALERT_MIN_BEDROOMS, ALERT_LIST, ALERT_DELETE_CONFIRM, ALERT_PRICE_DROPS,
+ALERT_DELIVERY_MODE) = range(5, 15)
 
-# Property display cache to improve performance
+# Property display cache to improve performance, shared between workers if the backend is
 # Structure: {location: {last_updated: timestamp, properties: [...]}}
-property_display_cache = {}
+property_display_cache = CacheNamespace(get_cache_backend(), "display", CACHE_TTL)
+
+def store_location_properties(location, properties, last_updated=None):
+    """Store the properties of a location in the display cache."""
+    if property_display_cache.backend.shared:
+        # Only the compact form is serialized into a shared cache
+        properties = compact_properties(properties)
+    property_display_cache.set(location, {
+        "last_updated": last_updated or time.time(),
+        "properties": properties
+    })
+
+# Hit ratio of location lookups served from property_display_cache
+location_cache_stats = {"hits": 0, "misses": 0}
+
+def get_location_properties(location, user_id=None, source="button"):
+    """Get properties for a location from the display cache, fetching them on a miss."""
+    record_location_lookup(location, user_id)
+    
+    current_time = time.time()
+    with span("cache.display", location=location) as current:
+        cached = property_display_cache.get(location)
+        hit = cached is not None and current_time - cached["last_updated"] < CACHE_TTL
+        current.set_attribute("hit", hit)
+    if hit:
+        location_cache_stats["hits"] += 1
+        CACHE_LOOKUPS.labels("display", "hit").inc()
+        logger.info(f"Using cached properties for {location} ({source})")
+        return cached["properties"]
+    
+    location_cache_stats["misses"] += 1
+    CACHE_LOOKUPS.labels("display", "miss").inc()
+    logger.info(f"Fetching fresh properties for {location} ({source})")
+    properties = get_properties_by_location(location)
+    
+    # Cache the results
+    if properties:
+        store_location_properties(location, properties, current_time)
+    
+    return properties
+
+# Property navigation measurements: Telegram round trips and perceived latency per tap
+navigation_stats = {"taps": 0, "telegram_calls": 0, "total_latency": 0.0}
+
+def record_navigation_tap(telegram_calls, started):
+    """Record the Telegram round trips and perceived latency of one navigation tap."""
+    elapsed = time.perf_counter() - started
+    navigation_stats["taps"] += 1
+    navigation_stats["telegram_calls"] += telegram_calls
+    navigation_stats["total_latency"] += elapsed
+    
+    taps = navigation_stats["taps"]
+    logger.info(
+        f"Property navigation tap: {telegram_calls} Telegram calls in {elapsed * 1000:.0f} ms "
+        f"(average {navigation_stats['telegram_calls'] / taps:.2f} calls, "
+        f"{navigation_stats['total_latency'] / taps * 1000:.0f} ms over {taps} taps)"
+    )
+
+def fit_caption(caption, header=None):
+    """
+    Fit a property caption, with an optional header, in Telegram's photo caption limit
+    
+    The header is dropped first. A caption that is still too long is cut at the
+    last whole line that fits, so no Markdown entity is left open.
+    """
+    if header:
+        text = f"{header}\n\n{caption}"
+        if len(text) <= MessageLimit.CAPTION_LENGTH:
+            return text
+    if len(caption) <= MessageLimit.CAPTION_LENGTH:
+        return caption
+    return caption[:MessageLimit.CAPTION_LENGTH].rsplit("\n", 1)[0]
+
+async def display_property_card(query, property_data, reply_markup, header=None):
+    """
+    Show a property card on the message a callback query came from
+    
+    The message is updated in place with a single media/caption/keyboard edit.
+    A new message is sent (and the old one deleted) only when the message type
+    really changes between text and photo.
+    
+    Args:
+        query (CallbackQuery): Callback query whose message should show the property
+        property_data (dict): Property data dictionary
+        reply_markup (InlineKeyboardMarkup): Navigation buttons for the card
+        header (str): Optional text shown above the property details
+        
+    Returns:
+        int: Number of Telegram API calls made
+    """
+    caption = get_property_caption(property_data)
+    # Text messages take up to 4096 characters, photo captions only 1024
+    message_text = f"{header}\n\n{caption}" if header else caption
+    photo_caption = fit_caption(caption, header)
+    
+    # Use the file_id of an already uploaded image when the card was prefetched
+    image_url = get_property_image_url(property_data)
+    photo = get_property_photo(property_data)
+    message_is_photo = bool(query.message and query.message.photo)
+    calls = 0
+    
+    if bool(image_url) == message_is_photo:
+        calls += 1
+        try:
+            if image_url:
+                # Swap photo, caption and keyboard in one round trip
+                edited = await query.edit_message_media(
+                    media=InputMediaPhoto(media=photo, caption=photo_caption, parse_mode="Markdown"),
+                    reply_markup=reply_markup
+                )
+                remember_photo_file_id(image_url, edited)
+            else:
+                await query.edit_message_text(
+                    text=message_text,
+                    reply_markup=reply_markup,
+                    parse_mode="Markdown"
+                )
+            return calls
+        except BadRequest as e:
+            if "not modified" in str(e).lower():
+                return calls
+            # The message can't be edited (e.g. it is too old), so send a fresh one instead
+            logger.warning(f"Could not edit property card in place, sending a new message: {e}")
+    
+    # The message type changes between text and photo, which can't be done with an edit
+    if image_url:
+        try:
+            sent = await query.message.reply_photo(
+                photo=photo,
+                caption=photo_caption,
+                reply_markup=reply_markup,
+                parse_mode="Markdown"
+            )
+            remember_photo_file_id(image_url, sent)
+        except BadRequest as e:
+            # A broken image or a caption Telegram won't take shouldn't cost the user the card
+            logger.warning(f"Could not send property card as a photo, showing it as text: {e}")
+            if not message_is_photo:
+                await query.edit_message_text(
+                    text=message_text,
+                    reply_markup=reply_markup,
+                    parse_mode="Markdown"
+                )
+                return calls + 2
+            await query.message.reply_text(
+                text=message_text,
+                reply_markup=reply_markup,
+                parse_mode="Markdown"
+            )
+            calls += 1
+    else:
+        await query.message.reply_text(
+            text=message_text,
+            reply_markup=reply_markup,
+            parse_mode="Markdown"
+        )
+    await query.delete_message()
+    
+    return calls + 2
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Send a welcome message when the command /start is issued and show a Properties button."""
@@ -88,7 +274,7 @@ async def search(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     location = locations[0]
     
     # Get properties for selected location
-    location_properties = get_properties_by_location(location)
+    location_properties = get_location_properties(location, update.effective_user.id, source="search")
     
     # If no properties found in this location, use all properties
     if not location_properties:
@@ -111,6 +297,7 @@ async def search(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     # Store properties in context
     context.user_data["properties"] = location_properties
     context.user_data["current_index"] = 0
+    schedule_prefetch(context, location_properties, 0)
     context.user_data["location"] = actual_location
     
     # Display property count with actual location from property data
@@ -152,6 +339,35 @@ async def search(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     
     return VIEWING_PROPERTIES
     
+def match_typed_location(user_text, locations):
+    """Find the location a user typed: an exact match, then a partial match either way (case insensitive)"""
+    text = user_text.lower()
+    # Structure: [(location, lowercased location)], skipping locations that aren't strings
+    candidates = [(location, location.lower()) for location in locations if isinstance(location, str)]
+    for location, name in candidates:
+        if name == text:
+            return location
+    # If no exact match, try partial match
+    for location, name in candidates:
+        if text in name:
+            return location
+    # If still no match, try the other way (location in user text)
+    for location, name in candidates:
+        if name in text:
+            return location
+    return None
+
+def find_mentioned_location(message_text, locations):
+    """Find the first location mentioned in a lowercased message, or None"""
+    for location in locations:
+        # Skip if location is not a string
+        if not isinstance(location, str):
+            logger.warning(f"Skipping non-string location in message handler: {location}")
+            continue
+        if location.lower() in message_text:
+            return location
+    return None
+
 async def handle_text_location(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Handle text-based location selection during the search process."""
     user_text = update.message.text.strip()
@@ -163,27 +379,8 @@ async def handle_text_location(update: Update, context: ContextTypes.DEFAULT_TYP
         logger.warning("Could not get locations, defaulting to Lavington")
         matched_location = "Lavington"
     else:
-        # Check if the text matches any available location (case insensitive)
-        matched_location = None
-        for location in locations:
-            if isinstance(location, str) and location.lower() == user_text.lower():
-                matched_location = location
-                break
-        
-        # If no exact match, try partial match
-        if not matched_location:
-            for location in locations:
-                if isinstance(location, str) and user_text.lower() in location.lower():
-                    matched_location = location
-                    break
-                    
-        # If still no match, try the other way (location in user text)
-        if not matched_location:
-            for location in locations:
-                if isinstance(location, str) and location.lower() in user_text.lower():
-                    matched_location = location
-                    break
-                    
+        matched_location = match_typed_location(user_text, locations)
+
         # If still no match, default to the first location or Lavington
         if not matched_location:
             if "lavington" in user_text.lower():
@@ -200,23 +397,8 @@ async def handle_text_location(update: Update, context: ContextTypes.DEFAULT_TYP
     # Show loading message
     message = await update.message.reply_text(BOT_MESSAGES["loading"])
     
-    # Check if we have cached properties for this location
-    current_time = time.time()
-    if (matched_location in property_display_cache and 
-        current_time - property_display_cache[matched_location]["last_updated"] < CACHE_TTL):
-        logger.info(f"Using cached properties for {matched_location}")
-        properties = property_display_cache[matched_location]["properties"]
-    else:
-        # Get properties for selected location
-        logger.info(f"Fetching fresh properties for {matched_location}")
-        properties = get_properties_by_location(matched_location)
-        
-        # Cache the results
-        if properties:
-            property_display_cache[matched_location] = {
-                "last_updated": current_time,
-                "properties": properties
-            }
+    # Get properties for the location, using the display cache when possible
+    properties = get_location_properties(matched_location, update.effective_user.id, source="typed location")
     
     # If no properties found, show error message
     if not properties:
@@ -226,6 +408,7 @@ async def handle_text_location(update: Update, context: ContextTypes.DEFAULT_TYP
     # Store properties in context
     context.user_data["properties"] = properties
     context.user_data["current_index"] = 0
+    schedule_prefetch(context, properties, 0)
     
     # Display property count
     await message.edit_text(
@@ -277,23 +460,8 @@ async def location_selected(update: Update, context: ContextTypes.DEFAULT_TYPE)
     # Show loading message
     await query.edit_message_text(BOT_MESSAGES["loading"])
     
-    # Check if we have cached properties for this location and if they're still valid
-    current_time = time.time()
-    if (location in property_display_cache and 
-        current_time - property_display_cache[location]["last_updated"] < CACHE_TTL):
-        logger.info(f"Using cached properties for {location}")
-        properties = property_display_cache[location]["properties"]
-    else:
-        # Get properties for selected location
-        logger.info(f"Fetching fresh properties for {location}")
-        properties = get_properties_by_location(location)
-        
-        # Cache the results
-        if properties:
-            property_display_cache[location] = {
-                "last_updated": current_time,
-                "properties": properties
-            }
+    # Get properties for the location, using the display cache when possible
+    properties = get_location_properties(location, update.effective_user.id, source="location button")
     
     # If no properties found, show error message
     if not properties:
@@ -309,7 +477,7 @@ async def location_selected(update: Update, context: ContextTypes.DEFAULT_TYPE)
     
     return VIEWING_PROPERTIES
 
-async def show_property(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+async def show_property(update: Update, context: ContextTypes.DEFAULT_TYPE, tap_started=None) -> int:
     """Show a property with image and details."""
     query = update.callback_query
     
@@ -319,19 +487,17 @@ async def show_property(update: Update, context: ContextTypes.DEFAULT_TYPE) -> i
     
     # If no properties left, end conversation
     if not properties or current_index >= len(properties):
+        cancel_prefetch(context)
         if query:
-            await query.edit_message_text(BOT_MESSAGES["property_not_found"])
+            if query.message and query.message.photo:
+                await query.edit_message_caption(caption=BOT_MESSAGES["property_not_found"])
+            else:
+                await query.edit_message_text(BOT_MESSAGES["property_not_found"])
         return ConversationHandler.END
     
     # Get current property
     property_data = properties[current_index]
     
-    # Format property message
-    message = format_property_message(property_data)
-    
-    # Get property image URL
-    image_url = get_property_image_url(property_data)
-    
     # Create navigation buttons
     keyboard = []
     
@@ -346,7 +512,8 @@ async def show_property(update: Update, context: ContextTypes.DEFAULT_TYPE) -> i
     
     reply_markup = InlineKeyboardMarkup(keyboard)
     
-    # If this is the first property, show property count message
+    # If this is the first property, show the property count above it
+    header = None
     if current_index == 0 and query:
         # Get the actual location from the property data if available
         actual_location = "Unknown"
@@ -363,34 +530,24 @@ async def show_property(update: Update, context: ContextTypes.DEFAULT_TYPE) -> i
         # Update context with the actual location
         context.user_data["location"] = actual_location
         
-        await query.edit_message_text(
-            BOT_MESSAGES["property_count"].format(len(properties), actual_location)
-        )
+        header = BOT_MESSAGES["property_count"].format(len(properties), actual_location)
     
-    # Send property with image
+    # Show the property on the current message
     if query:
-        if image_url:
-            await query.message.reply_photo(
-                photo=image_url,
-                caption=message,
-                reply_markup=reply_markup,
-                parse_mode="Markdown"
-            )
-            # Delete the previous message (loading or property count)
-            await query.delete_message()
-        else:
-            # If no image, just send the text
-            await query.edit_message_text(
-                text=message,
-                reply_markup=reply_markup,
-                parse_mode="Markdown"
-            )
+        calls = await display_property_card(query, property_data, reply_markup, header=header)
+        if tap_started is not None:
+            # Include the callback answer in the round trips for this tap
+            record_navigation_tap(calls + 1, tap_started)
+    
+    # Warm the next properties while the user looks at this one
+    schedule_prefetch(context, properties, current_index)
     
     return VIEWING_PROPERTIES
 
 async def property_navigation(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Handle property navigation."""
     query = update.callback_query
+    tap_started = time.perf_counter()
     await query.answer()
     
     action = query.data.split(":")[1]
@@ -398,7 +555,7 @@ async def property_navigation(update: Update, context: ContextTypes.DEFAULT_TYPE
     if action == "next":
         # Move to next property
         context.user_data["current_index"] += 1
-        return await show_property(update, context)
+        return await show_property(update, context, tap_started=tap_started)
     
     elif action == "back":
         # Go back to location selection
@@ -414,6 +571,7 @@ async def property_navigation(update: Update, context: ContextTypes.DEFAULT_TYPE
 
 async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Cancel and end the conversation."""
+    cancel_prefetch(context)
     if update.message:
         await update.message.reply_text("Search cancelled. You can start a new search anytime by typing 'find properties' or using the /search command.")
     return ConversationHandler.END
@@ -453,7 +611,7 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         location = locations[0]
         
         # Get properties for selected location
-        location_properties = get_properties_by_location(location)
+        location_properties = get_location_properties(location, update.effective_user.id, source="greeting")
         
         # If no properties found in this location, use all properties
         if not location_properties:
@@ -476,6 +634,7 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         # Store properties in context
         context.user_data["properties"] = location_properties
         context.user_data["current_index"] = 0
+        schedule_prefetch(context, location_properties, 0)
         context.user_data["location"] = actual_location
         
         # Display property count with actual location
@@ -536,189 +695,154 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     property_keywords = ["property", "properties", "home", "house", "apartment", "real estate", "find", "search", "looking for", "want to buy", "show me", "interested in"]
     if any(keyword in message_text for keyword in property_keywords):
         # If also mentioning a location, go directly to that location
-        if locations:
-            for location in locations:
-                if location.lower() in message_text:
-                    # Set the location in context
-                    context.user_data["location"] = location
-                    # Show loading message
-                    message = await update.message.reply_text(BOT_MESSAGES["loading"])
-                    
-                    # Check cache first for this location
-                    current_time = time.time()
-                    if (location in property_display_cache and 
-                        current_time - property_display_cache[location]["last_updated"] < CACHE_TTL):
-                        logger.info(f"Using cached properties for {location} (natural language query)")
-                        properties = property_display_cache[location]["properties"]
-                    else:
-                        # Get properties for selected location
-                        logger.info(f"Fetching fresh properties for {location} (natural language query)")
-                        properties = get_properties_by_location(location)
-                        
-                        # Cache the results
-                        if properties:
-                            property_display_cache[location] = {
-                                "last_updated": current_time,
-                                "properties": properties
-                            }
-                    
-                    # If no properties found, show error message
-                    if not properties:
-                        await message.edit_text(f"I couldn't find any properties in {location} at the moment. Let me show you other available locations.")
-                        # Show location options by calling search
-                        return await search(update, context)
-                    
-                    # Extract the actual location from the first property
-                    actual_location = location
-                    if properties and len(properties) > 0:
-                        property_data = properties[0]
-                        if 'acf' in property_data and 'location' in property_data['acf']:
-                            prop_location = property_data['acf']['location']
-                            if isinstance(prop_location, str) and prop_location.strip():
-                                actual_location = prop_location
-                            elif prop_location is not None:
-                                try:
-                                    actual_location = str(prop_location)
-                                except:
-                                    pass
-                    
-                    # Store properties in context
-                    context.user_data["properties"] = properties
-                    context.user_data["current_index"] = 0
-                    context.user_data["location"] = actual_location
-                    
-                    # Display property count
-                    await message.edit_text(
-                        BOT_MESSAGES["property_count"].format(len(properties), actual_location)
-                    )
-                    
-                    # Prepare to show the first property
-                    property_data = properties[0]
-                    
-                    # Format property message
-                    message_text = format_property_message(property_data)
-                    
-                    # Get property image URL
-                    image_url = get_property_image_url(property_data)
-                    
-                    # Create navigation buttons
-                    keyboard = []
-                    if len(properties) > 1:
-                        keyboard.append([InlineKeyboardButton("Next Property ➡️", callback_data="property:next")])
-                    keyboard.append([InlineKeyboardButton("Back to Search 🔙", callback_data="property:back")])
-                    reply_markup = InlineKeyboardMarkup(keyboard)
-                    
-                    # Send property with image
-                    if image_url:
-                        await update.message.reply_photo(
-                            photo=image_url,
-                            caption=message_text,
-                            reply_markup=reply_markup,
-                            parse_mode="Markdown"
-                        )
-                    else:
-                        await update.message.reply_text(
-                            text=message_text,
-                            reply_markup=reply_markup,
-                            parse_mode="Markdown"
-                        )
-                    
-                    return VIEWING_PROPERTIES
+        location = find_mentioned_location(message_text, locations) if locations else None
+        if location:
+            # Set the location in context
+            context.user_data["location"] = location
+            # Show loading message
+            message = await update.message.reply_text(BOT_MESSAGES["loading"])
+            
+            # Get properties for the location, using the display cache when possible
+            properties = get_location_properties(location, update.effective_user.id, source="natural language query")
+            
+            # If no properties found, show error message
+            if not properties:
+                await message.edit_text(f"I couldn't find any properties in {location} at the moment. Let me show you other available locations.")
+                # Show location options by calling search
+                return await search(update, context)
+            
+            # Extract the actual location from the first property
+            actual_location = location
+            if properties and len(properties) > 0:
+                property_data = properties[0]
+                if 'acf' in property_data and 'location' in property_data['acf']:
+                    prop_location = property_data['acf']['location']
+                    if isinstance(prop_location, str) and prop_location.strip():
+                        actual_location = prop_location
+                    elif prop_location is not None:
+                        try:
+                            actual_location = str(prop_location)
+                        except:
+                            pass
+            
+            # Store properties in context
+            context.user_data["properties"] = properties
+            context.user_data["current_index"] = 0
+            schedule_prefetch(context, properties, 0)
+            context.user_data["location"] = actual_location
+            
+            # Display property count
+            await message.edit_text(
+                BOT_MESSAGES["property_count"].format(len(properties), actual_location)
+            )
+            
+            # Prepare to show the first property
+            property_data = properties[0]
+            
+            # Format property message
+            message_text = format_property_message(property_data)
+            
+            # Get property image URL
+            image_url = get_property_image_url(property_data)
+            
+            # Create navigation buttons
+            keyboard = []
+            if len(properties) > 1:
+                keyboard.append([InlineKeyboardButton("Next Property ➡️", callback_data="property:next")])
+            keyboard.append([InlineKeyboardButton("Back to Search 🔙", callback_data="property:back")])
+            reply_markup = InlineKeyboardMarkup(keyboard)
+            
+            # Send property with image
+            if image_url:
+                await update.message.reply_photo(
+                    photo=image_url,
+                    caption=message_text,
+                    reply_markup=reply_markup,
+                    parse_mode="Markdown"
+                )
+            else:
+                await update.message.reply_text(
+                    text=message_text,
+                    reply_markup=reply_markup,
+                    parse_mode="Markdown"
+                )
+            
+            return VIEWING_PROPERTIES
         
         # If no specific location mentioned, show all locations
         return await search(update, context)
     
     # Check if message directly mentions a location
-    if locations:
-        for location in locations:
-            # Skip if location is not a string
-            if not isinstance(location, str):
-                logger.warning(f"Skipping non-string location in message handler: {location}")
-                continue
-                
-            if location.lower() in message_text:
-                await update.message.reply_text(f"Let me find properties in {location} for you...")
-                context.user_data["location"] = location
-                
-                # Check cache first for this location
-                current_time = time.time()
-                if (location in property_display_cache and 
-                    current_time - property_display_cache[location]["last_updated"] < CACHE_TTL):
-                    logger.info(f"Using cached properties for {location} (direct mention)")
-                    properties = property_display_cache[location]["properties"]
-                else:
-                    # Get properties for selected location
-                    logger.info(f"Fetching fresh properties for {location} (direct mention)")
-                    properties = get_properties_by_location(location)
-                    
-                    # Cache the results
-                    if properties:
-                        property_display_cache[location] = {
-                            "last_updated": current_time,
-                            "properties": properties
-                        }
-                
-                # If no properties found, show error message and search options
-                if not properties:
-                    await update.message.reply_text(BOT_MESSAGES["no_results_suggestion"])
-                    return await search(update, context)
-                
-                # Extract the actual location from the first property
-                actual_location = location
-                if properties and len(properties) > 0:
-                    property_data = properties[0]
-                    if 'acf' in property_data and 'location' in property_data['acf']:
-                        prop_location = property_data['acf']['location']
-                        if isinstance(prop_location, str) and prop_location.strip():
-                            actual_location = prop_location
-                        elif prop_location is not None:
-                            try:
-                                actual_location = str(prop_location)
-                            except:
-                                pass
-                
-                # Store properties in context
-                context.user_data["properties"] = properties
-                context.user_data["current_index"] = 0
-                context.user_data["location"] = actual_location
-                
-                # Display property count with actual location
-                await update.message.reply_text(
-                    BOT_MESSAGES["property_count"].format(len(properties), actual_location)
-                )
-                
-                # Prepare to show the first property
-                property_data = properties[0]
-                
-                # Format property message
-                message_text = format_property_message(property_data)
-                
-                # Get property image URL
-                image_url = get_property_image_url(property_data)
-                
-                # Create navigation buttons
-                keyboard = []
-                if len(properties) > 1:
-                    keyboard.append([InlineKeyboardButton("Next Property ➡️", callback_data="property:next")])
-                keyboard.append([InlineKeyboardButton("Back to Search 🔙", callback_data="property:back")])
-                reply_markup = InlineKeyboardMarkup(keyboard)
-                
-                # Send property with image
-                if image_url:
-                    await update.message.reply_photo(
-                        photo=image_url,
-                        caption=message_text,
-                        reply_markup=reply_markup,
-                        parse_mode="Markdown"
-                    )
-                else:
-                    await update.message.reply_text(
-                        text=message_text,
-                        reply_markup=reply_markup,
-                        parse_mode="Markdown"
-                    )
-                
-                return VIEWING_PROPERTIES
+    location = find_mentioned_location(message_text, locations) if locations else None
+    if location:
+        await update.message.reply_text(f"Let me find properties in {location} for you...")
+        context.user_data["location"] = location
+        
+        # Get properties for the location, using the display cache when possible
+        properties = get_location_properties(location, update.effective_user.id, source="direct mention")
+        
+        # If no properties found, show error message and search options
+        if not properties:
+            await update.message.reply_text(BOT_MESSAGES["no_results_suggestion"])
+            return await search(update, context)
+        
+        # Extract the actual location from the first property
+        actual_location = location
+        if properties and len(properties) > 0:
+            property_data = properties[0]
+            if 'acf' in property_data and 'location' in property_data['acf']:
+                prop_location = property_data['acf']['location']
+                if isinstance(prop_location, str) and prop_location.strip():
+                    actual_location = prop_location
+                elif prop_location is not None:
+                    try:
+                        actual_location = str(prop_location)
+                    except:
+                        pass
+        
+        # Store properties in context
+        context.user_data["properties"] = properties
+        context.user_data["current_index"] = 0
+        schedule_prefetch(context, properties, 0)
+        context.user_data["location"] = actual_location
+        
+        # Display property count with actual location
+        await update.message.reply_text(
+            BOT_MESSAGES["property_count"].format(len(properties), actual_location)
+        )
+        
+        # Prepare to show the first property
+        property_data = properties[0]
+        
+        # Format property message
+        message_text = format_property_message(property_data)
+        
+        # Get property image URL
+        image_url = get_property_image_url(property_data)
+        
+        # Create navigation buttons
+        keyboard = []
+        if len(properties) > 1:
+            keyboard.append([InlineKeyboardButton("Next Property ➡️", callback_data="property:next")])
+        keyboard.append([InlineKeyboardButton("Back to Search 🔙", callback_data="property:back")])
+        reply_markup = InlineKeyboardMarkup(keyboard)
+        
+        # Send property with image
+        if image_url:
+            await update.message.reply_photo(
+                photo=image_url,
+                caption=message_text,
+                reply_markup=reply_markup,
+                parse_mode="Markdown"
+            )
+        else:
+            await update.message.reply_text(
+                text=message_text,
+                reply_markup=reply_markup,
+                parse_mode="Markdown"
+            )
+        
+        return VIEWING_PROPERTIES
     
     # Handle queries about specific property features
     if any(word in message_text for word in ["bedroom", "bathroom", "price", "cost", "how much"]):
@@ -731,62 +855,206 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     await update.message.reply_text(BOT_MESSAGES["not_understood"])
     return CHATTING
 
+# Background tasks that keep the most popular locations warm and follow catalog changes made by the webhook
+cache_warmer_task = None
+catalog_version_task = None
+
+def refresh_location(location):
+    """Fetch fresh properties for a location and store them in the display cache."""
+    properties = get_properties_by_location.refresh(location)
+    if properties:
+        store_location_properties(location, properties)
+        logger.info(f"Warmed {len(properties)} properties for {location}")
+    else:
+        logger.warning(f"No properties found for {location}")
+    return properties
+
+async def warm_popular_locations():
+    """Load the most popular locations that are missing or about to expire, concurrently."""
+    locations = top_locations(POPULAR_LOCATIONS_TOP_K)
+    
+    current_time = time.time()
+    due = []
+    for location in locations:
+        cached = property_display_cache.get(location)
+        if cached is None or current_time - cached["last_updated"] >= CACHE_TTL - CACHE_REFRESH_MARGIN:
+            due.append(location)
+    
+    if due:
+        logger.info(f"Warming popular locations: {due}")
+        results = await asyncio.gather(
+            *(asyncio.to_thread(refresh_location, location) for location in due),
+            return_exceptions=True
+        )
+        for location, result in zip(due, results):
+            if isinstance(result, Exception):
+                logger.error(f"Error warming properties for {location}: {result}")
+    
+    # Report how often location taps are served from the cache
+    lookups = location_cache_stats["hits"] + location_cache_stats["misses"]
+    if lookups:
+        logger.info(
+            f"Location cache hit ratio: {location_cache_stats['hits'] / lookups:.1%} "
+            f"({location_cache_stats['hits']} hits, {location_cache_stats['misses']} misses)"
+        )
+
+async def run_cache_warmer():
+    """Keep the most popular locations warm and persist popularity scores."""
+    while True:
+        await asyncio.sleep(CACHE_WARM_INTERVAL)
+        try:
+            await warm_popular_locations()
+            save_popularity()
+        except Exception as e:
+            logger.error(f"Error in cache warmer: {e}")
+
+async def run_catalog_version_watcher():
+    """Drop the cached catalog when a webhook sync in another process changed it."""
+    while True:
+        try:
+            note_catalog_version(await get_data_version(CATALOG_VERSION))
+        except Exception as e:
+            logger.error(f"Error checking the catalog version: {e}")
+        await asyncio.sleep(CATALOG_VERSION_CHECK_INTERVAL)
+
 async def preload_popular_locations(application):
-    """Preload properties for popular locations to improve initial response time."""
-    logger.info("Preloading property data for popular locations...")
+    """Preload properties for popular locations and start keeping them warm."""
+    global cache_warmer_task, catalog_version_task
     
-    # Get all locations
-    locations = get_locations()
-    if not locations:
-        logger.warning("No locations found to preload")
-        return
+    logger.info("Preloading property data for popular locations...")
+    load_popularity()
     
-    # Filter out non-string locations
-    valid_locations = []
-    for loc in locations:
-        if isinstance(loc, str):
-            valid_locations.append(loc)
-        else:
-            logger.warning(f"Skipping non-string location in preloading: {loc}")
+    if not top_locations(POPULAR_LOCATIONS_TOP_K):
+        # No lookups recorded yet, so seed the tracker with the first locations
+        locations = await asyncio.to_thread(get_locations) or []
+        for location in [loc for loc in locations if isinstance(loc, str)][:POPULAR_LOCATIONS_TOP_K]:
+            record_location_lookup(location)
     
-    # If we have more than 3 locations, preload the first 3 (assuming they're more popular)
-    # This is a simple heuristic - you could adjust based on actual user data
-    preload_locations = valid_locations[:min(3, len(valid_locations))]
+    await warm_popular_locations()
     
-    for location in preload_locations:
-        logger.info(f"Preloading properties for {location}")
-        properties = get_properties_by_location(location)
-        
-        if properties:
-            # Cache the results
-            property_display_cache[location] = {
-                "last_updated": time.time(),
-                "properties": properties
-            }
-            logger.info(f"Successfully preloaded {len(properties)} properties for {location}")
-        else:
-            logger.warning(f"No properties found for {location}")
+    if cache_warmer_task is None or cache_warmer_task.done():
+        cache_warmer_task = asyncio.create_task(run_cache_warmer())
+    if catalog_version_task is None or catalog_version_task.done():
+        catalog_version_task = asyncio.create_task(run_catalog_version_watcher())
     
     logger.info("Preloading complete")
 
+async def stop_cache_warmer(application=None):
+    """Stop the cache warmer and the catalog version watcher and persist popularity scores."""
+    global cache_warmer_task, catalog_version_task
+    
+    for task in (cache_warmer_task, catalog_version_task):
+        if task and not task.done():
+            task.cancel()
+    cache_warmer_task = None
+    catalog_version_task = None
+    save_popularity()
+
+# Inline query support
+# Set while a background catalog refresh for inline queries is running
+inline_refresh_task = None
+
+async def get_inline_catalog():
+    """Get the catalog for inline queries without waiting on a refresh of a stale catalog."""
+    global inline_refresh_task
+    
+    properties, age = get_catalog_snapshot()
+    
+    if properties is None:
+        # Nothing fetched yet, so we have to wait for the API (within Telegram's budget)
+        try:
+            return await asyncio.wait_for(asyncio.to_thread(load_catalog_snapshot), INLINE_FETCH_TIMEOUT)
+        except asyncio.TimeoutError:
+            logger.warning("Timed out fetching the catalog for an inline query")
+            return None
+    
+    if age >= CACHE_TTL and (inline_refresh_task is None or inline_refresh_task.done()):
+        # Serve the current catalog and refresh it in the background
+        inline_refresh_task = asyncio.create_task(asyncio.to_thread(load_catalog_snapshot))
+    
+    return properties
+
+def build_inline_result(property_data):
+    """Build the inline query result card for a property."""
+    message_text = get_property_caption(property_data)
+    image_url = get_property_image_url(property_data)
+    title = html.unescape((property_data.get('title') or {}).get('rendered', 'Unnamed Property'))
+    acf = property_data.get('acf') or {}
+    description = f"{acf.get('location', 'N/A')} • {acf.get('price', 'N/A')} • {acf.get('bedrooms', 'N/A')}"
+    
+    keyboard = None
+    if property_data.get('link'):
+        keyboard = InlineKeyboardMarkup([[InlineKeyboardButton("View more details", url=property_data['link'])]])
+    
+    if image_url:
+        return InlineQueryResultPhoto(
+            id=str(property_data.get('id')),
+            photo_url=image_url,
+            thumbnail_url=image_url,
+            title=title,
+            description=description,
+            caption=fit_caption(message_text),
+            parse_mode="Markdown",
+            reply_markup=keyboard
+        )
+    
+    return InlineQueryResultArticle(
+        id=str(property_data.get('id')),
+        title=title,
+        description=description,
+        input_message_content=InputTextMessageContent(message_text, parse_mode="Markdown"),
+        reply_markup=keyboard
+    )
+
+async def inline_query(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Answer inline queries like "@AvierHomesBot lavington 3br" from the in-memory catalog."""
+    query = update.inline_query
+    
+    try:
+        offset = int(query.offset) if query.offset else 0
+    except ValueError:
+        offset = 0
+    
+    properties = await get_inline_catalog()
+    matches = search_catalog(query.query, properties) if properties else []
+    
+    # Count the searched location towards its popularity (once per user per window)
+    location = query_location(query.query, properties) if properties else None
+    if location:
+        record_location_lookup(location, query.from_user.id)
+    
+    page = matches[offset:offset + INLINE_PAGE_SIZE]
+    next_offset = str(offset + INLINE_PAGE_SIZE) if offset + INLINE_PAGE_SIZE < len(matches) else ""
+    
+    await query.answer(
+        [build_inline_result(property_data) for property_data in page],
+        cache_time=INLINE_CACHE_TIME,
+        next_offset=next_offset
+    )
+
+async def track_user_activity(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Record the interaction of the user behind every update; written in bulk by the registry"""
+    user = update.effective_user
+    if user:
+        await user_registry.get_user_id(user.id, user.first_name, user.last_name, user.username)
+
 # Alert-related commands and handlers
 async def alerts_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Start the alerts management process"""
-    # Get or create the user in our database
-    with app.app_context():
-        user = get_or_create_user(
-            telegram_id=update.effective_user.id,
-            first_name=update.effective_user.first_name,
-            last_name=update.effective_user.last_name,
-            username=update.effective_user.username
-        )
-        
-        if not user:
-            await update.message.reply_text("There was an error accessing the database. Please try again later.")
-            return ConversationHandler.END
-        
-        # Store user id in context
-        context.user_data["db_user_id"] = user.id
+    # Get or create the user in our database; known users are resolved from memory
+    user_id = await user_registry.get_user_id(
+        update.effective_user.id,
+        update.effective_user.first_name,
+        update.effective_user.last_name,
+        update.effective_user.username
+    )
+    
+    if not user_id:
+        await update.message.reply_text("There was an error accessing the database. Please try again later.")
+        return ConversationHandler.END
+    
+    # Store user id in context
+    context.user_data["db_user_id"] = user_id
     
     # Show alert options
     keyboard = [
@@ -856,59 +1124,62 @@ async def alert_option_selected(update: Update, context: ContextTypes.DEFAULT_TY
     
     elif action == "list":
         # Show user's existing alerts
-        with app.app_context():
-            user_id = context.user_data.get("db_user_id")
-            if not user_id:
-                await query.edit_message_text("There was an error retrieving your user information. Please try again.")
-                return ConversationHandler.END
-            
-            alerts = get_user_alerts(user_id)
-            
-            if not alerts:
-                keyboard = [
-                    [InlineKeyboardButton("Create Alert", callback_data="alert:create")],
-                    [InlineKeyboardButton("Cancel", callback_data="alert:cancel")]
-                ]
-                reply_markup = InlineKeyboardMarkup(keyboard)
-                
-                await query.edit_message_text(
-                    BOT_MESSAGES["alert_list_empty"],
-                    reply_markup=reply_markup
-                )
-                return ALERT_MAIN
-            
-            # Create list of alerts with delete buttons
-            message = BOT_MESSAGES["alert_list_intro"] + "\n\n"
-            
-            keyboard = []
-            for i, alert in enumerate(alerts):
-                alert_description = []
-                if alert.location:
-                    alert_description.append(f"Location: {alert.location}")
-                else:
-                    alert_description.append("Location: All")
-                
-                if alert.min_price:
-                    alert_description.append(f"Min Price: {alert.min_price}")
-                if alert.max_price:
-                    alert_description.append(f"Max Price: {alert.max_price}")
-                if alert.min_bedrooms:
-                    alert_description.append(f"Min Bedrooms: {alert.min_bedrooms}")
-                
-                message += f"{i+1}. {' | '.join(alert_description)}\n"
-                keyboard.append([InlineKeyboardButton(f"Delete Alert #{i+1}", callback_data=f"alert_delete:{alert.id}")])
-            
-            # Add back button
-            keyboard.append([InlineKeyboardButton("Back to Alert Menu", callback_data="alert:back")])
-            
+        user_id = context.user_data.get("db_user_id")
+        if not user_id:
+            await query.edit_message_text("There was an error retrieving your user information. Please try again.")
+            return ConversationHandler.END
+        
+        alerts = await get_user_alerts(user_id)
+        
+        if not alerts:
+            keyboard = [
+                [InlineKeyboardButton("Create Alert", callback_data="alert:create")],
+                [InlineKeyboardButton("Cancel", callback_data="alert:cancel")]
+            ]
             reply_markup = InlineKeyboardMarkup(keyboard)
             
             await query.edit_message_text(
-                message,
+                BOT_MESSAGES["alert_list_empty"],
                 reply_markup=reply_markup
             )
+            return ALERT_MAIN
+        
+        # Create list of alerts with delete buttons
+        message = BOT_MESSAGES["alert_list_intro"] + "\n\n"
+        
+        keyboard = []
+        for i, alert in enumerate(alerts):
+            alert_description = []
+            if alert.location:
+                alert_description.append(f"Location: {alert.location}")
+            else:
+                alert_description.append("Location: All")
+            
+            if alert.min_price:
+                alert_description.append(f"Min Price: {alert.min_price}")
+            if alert.max_price:
+                alert_description.append(f"Max Price: {alert.max_price}")
+            if alert.min_bedrooms:
+                alert_description.append(f"Min Bedrooms: {alert.min_bedrooms}")
+            if alert.notify_price_drops:
+                alert_description.append("Price drops")
+            if alert.delivery_mode and alert.delivery_mode != "instant":
+                alert_description.append(f"{alert.delivery_mode.capitalize()} digest")
             
-            return ALERT_LIST
+            message += f"{i+1}. {' | '.join(alert_description)}\n"
+            keyboard.append([InlineKeyboardButton(f"Delete Alert #{i+1}", callback_data=f"alert_delete:{alert.id}")])
+        
+        # Add back button
+        keyboard.append([InlineKeyboardButton("Back to Alert Menu", callback_data="alert:back")])
+        
+        reply_markup = InlineKeyboardMarkup(keyboard)
+        
+        await query.edit_message_text(
+            message,
+            reply_markup=reply_markup
+        )
+        
+        return ALERT_LIST
     
     elif action == "cancel" or action == "back":
         # Cancel alert process
@@ -990,36 +1261,126 @@ async def alert_min_bedrooms_entered(update: Update, context: ContextTypes.DEFAU
             await update.message.reply_text(BOT_MESSAGES["invalid_input"])
             return ALERT_MIN_BEDROOMS
     
+    # Preview how many current listings the filters match, from the indexed listing columns
+    matches = await count_matching_properties(
+        location=context.user_data.get("alert_location"),
+        min_price=context.user_data.get("alert_min_price"),
+        max_price=context.user_data.get("alert_max_price"),
+        min_bedrooms=context.user_data.get("alert_min_bedrooms")
+    )
+    context.user_data["alert_preview_matches"] = matches
+    if matches is None:
+        preview = ""
+    elif matches:
+        preview = BOT_MESSAGES["alert_preview_matches"].format(matches) + "\n\n"
+    else:
+        preview = BOT_MESSAGES["alert_preview_none"] + "\n\n"
+    
+    # Ask whether price drops of matching properties should be alerted too
+    keyboard = [
+        [InlineKeyboardButton("Yes, alert price drops", callback_data="alert_price_drops:yes")],
+        [InlineKeyboardButton("No, new properties only", callback_data="alert_price_drops:no")]
+    ]
+    await update.message.reply_text(
+        preview + BOT_MESSAGES["alert_create_price_drops"],
+        reply_markup=InlineKeyboardMarkup(keyboard)
+    )
+    
+    return ALERT_PRICE_DROPS
+
+async def alert_price_drops_selected(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    """Handle the price drop opt-in for alert creation"""
+    query = update.callback_query
+    await query.answer()
+    
+    context.user_data["alert_price_drops"] = query.data.split(":")[1] == "yes"
+    
+    # Ask how matches should be delivered
+    keyboard = [
+        [InlineKeyboardButton("Instantly", callback_data="alert_delivery:instant")],
+        [InlineKeyboardButton("Hourly digest", callback_data="alert_delivery:hourly")],
+        [InlineKeyboardButton("Daily digest", callback_data="alert_delivery:daily")]
+    ]
+    await query.edit_message_text(
+        BOT_MESSAGES["alert_create_delivery_mode"],
+        reply_markup=InlineKeyboardMarkup(keyboard)
+    )
+    
+    return ALERT_DELIVERY_MODE
+
+async def alert_delivery_mode_selected(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    """Handle the delivery mode selection and create the alert"""
+    query = update.callback_query
+    await query.answer()
+    
+    delivery_mode = query.data.split(":")[1]
+    notify_price_drops = context.user_data.get("alert_price_drops", False)
+    
     # Create the alert in the database
-    with app.app_context():
-        user_id = context.user_data.get("db_user_id")
-        if not user_id:
-            await update.message.reply_text("There was an error retrieving your user information. Please try again.")
-            return ConversationHandler.END
-        
-        alert = create_property_alert(
-            user_id=user_id,
-            location=context.user_data.get("alert_location"),
-            min_price=context.user_data.get("alert_min_price"),
-            max_price=context.user_data.get("alert_max_price"),
-            min_bedrooms=context.user_data.get("alert_min_bedrooms")
-        )
-        
-        if not alert:
-            await update.message.reply_text("There was an error creating your alert. Please try again.")
-            return ConversationHandler.END
-        
-        # Determine location description for message
-        location_desc = context.user_data.get("alert_location", "All Locations")
-        
-        # Confirm alert creation
-        await update.message.reply_text(
-            BOT_MESSAGES["alert_created"].format(location_desc),
-            parse_mode="Markdown"
+    user_id = context.user_data.get("db_user_id")
+    if not user_id:
+        await query.edit_message_text("There was an error retrieving your user information. Please try again.")
+        return ConversationHandler.END
+    
+    alert = await create_property_alert(
+        user_id=user_id,
+        location=context.user_data.get("alert_location"),
+        min_price=context.user_data.get("alert_min_price"),
+        max_price=context.user_data.get("alert_max_price"),
+        min_bedrooms=context.user_data.get("alert_min_bedrooms"),
+        notify_price_drops=notify_price_drops,
+        delivery_mode=delivery_mode
+    )
+    
+    if not alert:
+        await query.edit_message_text("There was an error creating your alert. Please try again.")
+        return ConversationHandler.END
+    
+    # Determine location description for message
+    location_desc = context.user_data.get("alert_location", "All Locations")
+    
+    # Confirm alert creation
+    message = BOT_MESSAGES["alert_created"].format(location_desc)
+    if notify_price_drops:
+        message += " " + BOT_MESSAGES["alert_created_price_drops"]
+    if delivery_mode != "instant":
+        message += " " + BOT_MESSAGES["alert_created_digest"].format(delivery_mode)
+    
+    # Offer the listings that already match, sent as one batched message
+    reply_markup = None
+    matches = context.user_data.get("alert_preview_matches")
+    if matches:
+        count = min(matches, DIGEST_MAX_ITEMS)
+        message += "\n\n" + BOT_MESSAGES["alert_backfill_offer"].format(
+            matches if matches <= DIGEST_MAX_ITEMS else f"newest {count}"
         )
+        reply_markup = InlineKeyboardMarkup([
+            [InlineKeyboardButton("Send me the current matches", callback_data=f"alert_backfill:{alert.id}")]
+        ])
+    await query.edit_message_text(message, parse_mode="Markdown", reply_markup=reply_markup)
     
     return ConversationHandler.END
 
+async def alert_backfill_selected(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Queue the current matches of a newly created alert"""
+    query = update.callback_query
+    await query.answer()
+    
+    alert_id = int(query.data.split(":")[1])
+    user_id = await user_registry.get_user_id(update.effective_user.id)
+    alert = await get_user_alert(alert_id, user_id) if user_id else None
+    if not alert:
+        await query.edit_message_reply_markup(reply_markup=None)
+        return
+    queued = await queue_alert_backfill(alert, update.effective_user.id)
+    
+    # Keep the confirmation, drop the button so the matches can't be requested twice
+    await query.edit_message_reply_markup(reply_markup=None)
+    if queued:
+        await query.message.reply_text(BOT_MESSAGES["alert_backfill_queued"].format(queued))
+    else:
+        await query.message.reply_text(BOT_MESSAGES["alert_backfill_empty"])
+
 async def alert_delete_selected(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Handle alert deletion selection"""
     query = update.callback_query
@@ -1030,11 +1391,10 @@ async def alert_delete_selected(update: Update, context: ContextTypes.DEFAULT_TY
     context.user_data["alert_delete_id"] = alert_id
     
     # Confirm deletion
-    with app.app_context():
-        user_id = context.user_data.get("db_user_id")
-        if not user_id:
-            await query.edit_message_text("There was an error retrieving your user information. Please try again.")
-            return ConversationHandler.END
+    user_id = context.user_data.get("db_user_id")
+    if not user_id:
+        await query.edit_message_text("There was an error retrieving your user information. Please try again.")
+        return ConversationHandler.END
     
     # Create confirmation buttons
     keyboard = [
@@ -1061,20 +1421,19 @@ async def alert_delete_confirmed(update: Update, context: ContextTypes.DEFAULT_T
     
     if confirm == "yes":
         # Delete the alert
-        with app.app_context():
-            user_id = context.user_data.get("db_user_id")
-            alert_id = context.user_data.get("alert_delete_id")
-            
-            if not user_id or not alert_id:
-                await query.edit_message_text("There was an error retrieving your alert information. Please try again.")
-                return ConversationHandler.END
-            
-            success = delete_property_alert(alert_id, user_id)
-            
-            if success:
-                await query.edit_message_text(BOT_MESSAGES["alert_deleted"])
-            else:
-                await query.edit_message_text("There was an error deleting the alert. Please try again.")
+        user_id = context.user_data.get("db_user_id")
+        alert_id = context.user_data.get("alert_delete_id")
+        
+        if not user_id or not alert_id:
+            await query.edit_message_text("There was an error retrieving your alert information. Please try again.")
+            return ConversationHandler.END
+        
+        success = await delete_property_alert(alert_id, user_id)
+        
+        if success:
+            await query.edit_message_text(BOT_MESSAGES["alert_deleted"])
+        else:
+            await query.edit_message_text("There was an error deleting the alert. Please try again.")
     else:
         # Cancelled
         await query.edit_message_text(BOT_MESSAGES["alert_delete_cancelled"])
@@ -1108,7 +1467,7 @@ async def show_properties_button(update: Update, context: ContextTypes.DEFAULT_T
     location = locations[0]
     
     # Get properties for selected location
-    location_properties = get_properties_by_location(location)
+    location_properties = get_location_properties(location, update.effective_user.id, source="properties button")
     
     # If no properties found in this location, use all properties
     if not location_properties:
@@ -1117,6 +1476,7 @@ async def show_properties_button(update: Update, context: ContextTypes.DEFAULT_T
     # Store properties in context
     context.user_data["properties"] = location_properties
     context.user_data["current_index"] = 0
+    schedule_prefetch(context, location_properties, 0)
     context.user_data["location"] = location
     
     # Get the actual location from the first property
@@ -1136,18 +1496,9 @@ async def show_properties_button(update: Update, context: ContextTypes.DEFAULT_T
     # Update context with the actual location
     context.user_data["location"] = actual_location
     
-    # Display property count
-    property_count_message = BOT_MESSAGES["property_count"].format(len(location_properties), actual_location)
-    await query.edit_message_text(property_count_message)
-    
-    # Prepare and show the first property
+    # Prepare and show the first property with the property count above it
     property_data = location_properties[0]
-    
-    # Format property message
-    message_text = format_property_message(property_data)
-    
-    # Get property image URL
-    image_url = get_property_image_url(property_data)
+    property_count_message = BOT_MESSAGES["property_count"].format(len(location_properties), actual_location)
     
     # Create navigation buttons
     keyboard = []
@@ -1156,32 +1507,29 @@ async def show_properties_button(update: Update, context: ContextTypes.DEFAULT_T
     keyboard.append([InlineKeyboardButton("Back to Search 🔙", callback_data="property:back")])
     reply_markup = InlineKeyboardMarkup(keyboard)
     
-    # Send property with image
-    if image_url:
-        await query.message.reply_photo(
-            photo=image_url,
-            caption=message_text,
-            reply_markup=reply_markup,
-            parse_mode="Markdown"
-        )
-        # Delete the previous message
-        await query.delete_message()
-    else:
-        await query.edit_message_text(
-            text=message_text,
-            reply_markup=reply_markup,
-            parse_mode="Markdown"
-        )
+    # Replace the loading message with the property card
+    await display_property_card(query, property_data, reply_markup, header=property_count_message)
     
     return VIEWING_PROPERTIES
 
 def create_bot():
     """Create and configure the bot with all handlers."""
-    # Create application
-    application = Application.builder().token(TELEGRAM_TOKEN).build()
+    # Create application; handlers await async_db, so updates can be handled concurrently
+    # The metered transport records every Bot API call; 256 connections is the builder's default pool.
+    # TracedApplication traces sampled updates through all their handlers.
+    application = (
+        Application.builder()
+        .application_class(TracedApplication)
+        .token(TELEGRAM_TOKEN)
+        .base_url(TELEGRAM_API_URL)
+        .request(MeteredHTTPXRequest(connection_pool_size=256))
+        .concurrent_updates(BOT_CONCURRENT_UPDATES)
+        .build()
+    )
     
     # Schedule the preloading to happen after the bot starts
     application.post_init = preload_popular_locations
+    application.post_shutdown = stop_cache_warmer
     
     # Add conversation handler for property search with specific patterns
     conv_handler = ConversationHandler(
@@ -1237,6 +1585,12 @@ def create_bot():
             ALERT_MIN_BEDROOMS: [
                 MessageHandler(filters.TEXT & ~filters.COMMAND, alert_min_bedrooms_entered)
             ],
+            ALERT_PRICE_DROPS: [
+                CallbackQueryHandler(alert_price_drops_selected, pattern=r"^alert_price_drops:(yes|no)$")
+            ],
+            ALERT_DELIVERY_MODE: [
+                CallbackQueryHandler(alert_delivery_mode_selected, pattern=r"^alert_delivery:(instant|hourly|daily)$")
+            ],
             ALERT_LIST: [
                 CallbackQueryHandler(alert_delete_selected, pattern=r"^alert_delete:\d+$"),
                 CallbackQueryHandler(alert_option_selected, pattern=r"^alert:back$")
@@ -1250,11 +1604,19 @@ def create_bot():
         allow_reentry=True
     )
     
+    # Track user activity on every update, ahead of the handlers that answer it
+    application.add_handler(TypeHandler(Update, track_user_activity), group=-1)
+    
     # Add handlers
     application.add_handler(CommandHandler("start", start))
     application.add_handler(CommandHandler("help", help_command))
     application.add_handler(CallbackQueryHandler(show_properties_button, pattern=r"^show_properties$"))  # Handle Properties button
+    application.add_handler(CallbackQueryHandler(alert_backfill_selected, pattern=r"^alert_backfill:\d+$"))  # Send current matches of a new alert
+    application.add_handler(InlineQueryHandler(inline_query))  # Handle @AvierHomesBot inline searches
     application.add_handler(alerts_conv_handler)  # Add the alerts handler
     application.add_handler(conv_handler)
     
+    # Record the latency and errors of every handler
+    instrument_handlers(application)
+    
     return application
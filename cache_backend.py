@@ -0,0 +1,228 @@
+import os
+import json
+import time
+import zlib
+import sqlite3
+import logging
+import threading
+from collections import Counter
+from config import CACHE_BACKEND_URL
+from metrics import CACHE_EVICTIONS
+
+# Set up logging
+logging.basicConfig(
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    level=logging.INFO
+)
+logger = logging.getLogger(__name__)
+
+def _count_evictions(keys, reason):
+    """Count dropped entries per namespace, the key prefix added by CacheNamespace"""
+    for namespace, count in Counter(key.split(':', 1)[0] for key in keys).items():
+        CACHE_EVICTIONS.labels(namespace, reason).inc(count)
+
+class CacheBackend:
+    """
+    Interface for the key/value store behind our caches
+
+    Values are stored with a time to live. Namespaces carry a version number
+    so a whole namespace can be invalidated at once by bumping it.
+    """
+
+    # Whether the cache is shared with other processes (values are serialized)
+    shared = False
+
+    def get(self, key):
+        """Get a value, or None if it is missing or expired"""
+        raise NotImplementedError
+
+    def set(self, key, value, ttl):
+        """Store a value for ttl seconds"""
+        raise NotImplementedError
+
+    def delete(self, key):
+        """Remove a value"""
+        raise NotImplementedError
+
+    def get_version(self, namespace):
+        """Get the current version of a namespace"""
+        raise NotImplementedError
+
+    def bump_version(self, namespace):
+        """Invalidate every value in a namespace by moving it to a new version"""
+        raise NotImplementedError
+
+class InProcessCache(CacheBackend):
+    """Cache kept in a dictionary of the current process"""
+
+    def __init__(self):
+        self._values = {}
+        self._versions = {}
+        # The cache warmers use the cache from threads while invalidation iterates it
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at >= time.time():
+                return value
+            del self._values[key]
+        _count_evictions([key], "expired")
+        return None
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._values[key] = (value, time.time() + ttl)
+
+    def delete(self, key):
+        with self._lock:
+            self._values.pop(key, None)
+
+    def get_version(self, namespace):
+        return self._versions.get(namespace, 0)
+
+    def bump_version(self, namespace):
+        with self._lock:
+            version = self._versions[namespace] = self._versions.get(namespace, 0) + 1
+            # Old versions can never be read again, so drop them right away
+            prefix = f"{namespace}:"
+            dropped = [key for key in self._values if key.startswith(prefix)]
+            for key in dropped:
+                del self._values[key]
+        _count_evictions(dropped, "invalidated")
+        return version
+
+class SQLiteCache(CacheBackend):
+    """
+    Cache in a local SQLite file shared by every worker process on the host
+
+    Values are stored as zlib-compressed JSON, so they must be JSON serializable.
+    """
+
+    shared = True
+
+    # Expired rows are purged after this many writes
+    PURGE_EVERY = 200
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._writes = 0
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        conn = self._connection()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS cache_entries ("
+            "key TEXT PRIMARY KEY, value BLOB NOT NULL, expires_at REAL NOT NULL)"
+        )
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS cache_versions ("
+            "namespace TEXT PRIMARY KEY, version INTEGER NOT NULL)"
+        )
+
+    def _connection(self):
+        """Get the SQLite connection of the current thread"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, key):
+        row = self._connection().execute(
+            "SELECT value FROM cache_entries WHERE key = ? AND expires_at >= ?",
+            (key, time.time())
+        ).fetchone()
+        if row is None:
+            return None
+        return json.loads(zlib.decompress(row[0]))
+
+    def set(self, key, value, ttl):
+        data = zlib.compress(json.dumps(value, separators=(',', ':')).encode('utf-8'))
+        conn = self._connection()
+        conn.execute(
+            "INSERT OR REPLACE INTO cache_entries (key, value, expires_at) VALUES (?, ?, ?)",
+            (key, data, time.time() + ttl)
+        )
+        self._writes += 1
+        if self._writes % self.PURGE_EVERY == 0:
+            purged = conn.execute(
+                "DELETE FROM cache_entries WHERE expires_at < ? RETURNING key", (time.time(),)
+            ).fetchall()
+            _count_evictions([row[0] for row in purged], "expired")
+
+    def delete(self, key):
+        self._connection().execute("DELETE FROM cache_entries WHERE key = ?", (key,))
+
+    def get_version(self, namespace):
+        row = self._connection().execute(
+            "SELECT version FROM cache_versions WHERE namespace = ?", (namespace,)
+        ).fetchone()
+        return row[0] if row else 0
+
+    def bump_version(self, namespace):
+        conn = self._connection()
+        conn.execute(
+            "INSERT INTO cache_versions (namespace, version) VALUES (?, 1) "
+            "ON CONFLICT(namespace) DO UPDATE SET version = version + 1",
+            (namespace,)
+        )
+        # Entries of older versions are left to expire and be purged
+        return self.get_version(namespace)
+
+class CacheNamespace:
+    """A versioned group of keys in a cache backend"""
+
+    def __init__(self, backend, name, ttl):
+        self.backend = backend
+        self.name = name
+        self.ttl = ttl
+
+    def _key(self, key):
+        return f"{self.name}:{self.backend.get_version(self.name)}:{key}"
+
+    def get(self, key):
+        return self.backend.get(self._key(key))
+
+    def set(self, key, value, ttl=None):
+        self.backend.set(self._key(key), value, ttl if ttl is not None else self.ttl)
+
+    def delete(self, key):
+        self.backend.delete(self._key(key))
+
+    def invalidate(self):
+        """Invalidate every key in the namespace, in every process sharing the backend"""
+        version = self.backend.bump_version(self.name)
+        logger.info(f"Invalidated cache namespace {self.name} (now version {version})")
+
+def create_cache_backend(url):
+    """
+    Create a cache backend from a URL
+
+    Args:
+        url (str): "memory://" for an in-process cache or "sqlite:///path/to/cache.db"
+            for a cache shared by all worker processes on the host
+
+    Returns:
+        CacheBackend: The configured backend
+    """
+    if not url or url.startswith("memory://"):
+        return InProcessCache()
+    if url.startswith("sqlite:///"):
+        return SQLiteCache(url[len("sqlite:///"):])
+    raise ValueError(f"Unsupported cache backend URL: {url}")
+
+_backend = None
+
+def get_cache_backend():
+    """Get the process-wide cache backend configured by CACHE_BACKEND_URL"""
+    global _backend
+    if _backend is None:
+        _backend = create_cache_backend(CACHE_BACKEND_URL)
+        logger.info(f"Using {type(_backend).__name__} cache backend")
+    return _backend
@@ -2,12 +2,14 @@ import os
 
 # Telegram Bot Token - get from environment variable
 TELEGRAM_TOKEN = os.getenv("TELEGRAM_TOKEN", "")
+# Bot API endpoint, followed by the token (override it for a self-hosted Bot API server or tools/fake_bot_api.py)
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL", "https://api.telegram.org/bot")
 
 # Performance optimization settings
 CACHE_TTL = 300  # Cache time-to-live in seconds (5 minutes)
 
-# WordPress API URLs
-WP_API_URL = "https://avierhomes.co.ke/wp-json/wp/v2/property"
+# WordPress API URLs (override WP_API_URL to point the bot at a staging site or tools/wp_standin.py)
+WP_API_URL = os.getenv("WP_API_URL", "https://avierhomes.co.ke/wp-json/wp/v2/property")
 
 # URL format for filtered properties by location: 
 # https://avierhomes.co.ke/wp-json/wp/v2/property?acf[location]=Lavington&_embed
@@ -15,7 +17,7 @@ WP_API_URL = "https://avierhomes.co.ke/wp-json/wp/v2/property"
 # Request parameters
 PARAMS = {
     "_embed": True,  # Include embedded resources like featured media
-    "per_page": 100  # Maximum number of properties to fetch per request
+    "per_page": 100  # Properties per page (the WordPress maximum); fetch_properties follows X-WP-TotalPages
 }
 
 # Error messages
@@ -70,6 +72,15 @@ BOT_MESSAGES = {
     "alert_create_min_price": "What's the minimum price you're looking for? (Type 'skip' if you don't want to set this filter)",
     "alert_create_max_price": "What's the maximum price you're looking for? (Type 'skip' if you don't want to set this filter)",
     "alert_create_min_bedrooms": "How many bedrooms do you need at minimum? (Type 'skip' if you don't want to set this filter)",
+    "alert_create_price_drops": "Should I also alert you when a matching property drops its price?",
+    "alert_created_price_drops": "I'll also let you know when a matching property gets cheaper.",
+    "alert_create_delivery_mode": "How would you like to receive matches? A digest groups them into one message.",
+    "alert_created_digest": "Matches will arrive in your {} digest.",
+    "alert_preview_matches": "📊 {} current listings match these filters.",
+    "alert_preview_none": "📊 No current listings match these filters yet.",
+    "alert_backfill_offer": "Want the {} current matches right away?",
+    "alert_backfill_queued": "📬 Sending you {} current matches in one message shortly.",
+    "alert_backfill_empty": "You've already been sent every current match for this alert.",
     "alert_list_empty": "You don't have any active property alerts. Use the 'Create Alert' button to set one up.",
     "alert_list_intro": "Here are your active property alerts:",
     "alert_deleted": "✅ Alert deleted successfully!",
@@ -77,3 +88,109 @@ BOT_MESSAGES = {
     "alert_delete_cancelled": "Alert deletion cancelled.",
     "invalid_input": "Sorry, I couldn't understand that input. Please try again."
 }
+
+# Property card look-ahead settings
+PREFETCH_AHEAD = int(os.getenv("PREFETCH_AHEAD", "2"))  # Properties warmed ahead of the one on screen
+PREFETCH_MAX_CONCURRENCY = int(os.getenv("PREFETCH_MAX_CONCURRENCY", "4"))  # Look-ahead jobs running at once per process
+IMAGE_CACHE_CHAT_ID = os.getenv("IMAGE_CACHE_CHAT_ID")  # Private chat used to upload images ahead of time for their file_ids
+CAPTION_CACHE_SIZE = 5000  # Rendered property captions kept per process
+PHOTO_FILE_ID_CACHE_SIZE = 5000  # Telegram file_ids of property images kept per process
+
+# Inline query settings
+INLINE_PAGE_SIZE = 10  # Results per inline answer page (Telegram allows up to 50)
+INLINE_CACHE_TIME = 300  # Seconds Telegram may cache an inline answer on its servers
+INLINE_RESULT_CACHE_SIZE = 256  # Distinct queries whose matches are kept in memory
+INLINE_RESULT_CACHE_TTL = CACHE_TTL  # Seconds a cached query result stays valid
+INLINE_FETCH_TIMEOUT = 5  # Seconds to wait for the catalog when nothing is cached yet
+
+# Popularity-driven cache warming settings
+POPULARITY_FILE = os.getenv("POPULARITY_FILE", "popularity.json")  # Where location lookup counts are persisted
+POPULARITY_HALF_LIFE = 3 * 24 * 60 * 60  # Seconds for a lookup's weight to halve (3 days)
+POPULARITY_DEDUPE_WINDOW = 60  # Seconds during which repeated lookups by one user count once
+POPULAR_LOCATIONS_TOP_K = 5  # Number of most popular locations kept warm
+CACHE_WARM_INTERVAL = 60  # Seconds between cache warmer runs
+CACHE_REFRESH_MARGIN = 90  # Refresh a warm location this many seconds before it expires
+CATALOG_VERSION_CHECK_INTERVAL = 5  # Seconds between checks for catalog changes announced by the webhook
+
+# Cache backend: "memory://" keeps caches in each process, "sqlite:///path/to/cache.db"
+# shares one warm catalog between all bot worker processes on the host
+CACHE_BACKEND_URL = os.getenv("CACHE_BACKEND_URL", "memory://")
+
+# Alert matching settings
+ALERT_INDEX_RELOAD_INTERVAL = 10 * 60  # Seconds between full reloads of the in-memory alert index
+
+# Sent notification filter settings (a Bloom filter takes about 1.2 MB per million notifications at 1%)
+SENT_FILTER_CAPACITY = 1_000_000  # Notifications the filter is sized for at first; it grows as needed
+SENT_FILTER_ERROR_RATE = 0.01  # Share of unsent notifications that still need a database check
+SENT_FILTER_RELOAD_INTERVAL = 60  # Seconds between loads of notifications sent by other processes
+SENT_FILTER_RELOAD_OVERLAP = 10_000  # IDs below the highest loaded one that each refresh reads again
+
+# Dashboard statistics settings: counters are kept in memory and reconciled with the database
+STATS_RECONCILE_INTERVAL = 60  # Seconds between reloads of the dashboard counters from the database
+STATS_ACTIVE_USER_WINDOW = 7 * 24 * 60 * 60  # Users who interacted within this many seconds count as active
+STATS_CACHE_MAX_AGE = 30  # Seconds browsers and proxies may reuse the dashboard and /stats
+
+# Metrics settings: the Flask app serves /metrics itself, the bot and delivery-only workers need a port
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))  # Port serving /metrics of the bot process, 0 to not serve it
+
+# Tracing settings: sampled updates and webhook calls are traced with nested spans, kept in memory
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "0.05"))  # Share of updates and webhook calls traced, 0 to turn tracing off
+TRACE_KEEP_SLOWEST = 50  # Slowest traces kept since the process started
+TRACE_BUFFER_SIZE = 200  # Most recent traces kept, in a ring buffer
+TRACE_MAX_SPANS = 200  # Spans recorded per trace; further ones are only counted, so a long sync can't grow a trace without bound
+TRACE_EXPORT_PATH = os.getenv("TRACE_EXPORT_PATH")  # JSON file the bot process writes its traces to, none to only serve them
+TRACE_EXPORT_INTERVAL = 60  # Seconds between writes of TRACE_EXPORT_PATH
+
+# Listing storage settings
+LISTING_DETAILS = os.getenv("LISTING_DETAILS", "compact")  # "compact" stores the payload fields the bot reads with a listing, "full" the whole API payload
+LISTING_RAW_PAYLOADS = os.getenv("LISTING_RAW_PAYLOADS", "").lower() in ("1", "true", "yes")  # Also keep every raw payload, compressed, in listing_payloads
+LISTING_PAYLOAD_COMPRESSION = 6  # zlib level of the stored raw payloads
+
+# SQLite mode, selected with DATABASE_URL="sqlite:////path/to/avierhomes.db" for single-node deployments
+SQLITE_PRAGMAS = {
+    "journal_mode": "WAL",  # Readers don't block the writer, and commits append to the log
+    "synchronous": "NORMAL",  # Sync at checkpoints only; safe with WAL, loses no more than the last commits on power loss
+    "mmap_size": 256 * 1024 * 1024,  # Read the database through a memory map of up to 256 MB
+    "cache_size": -64 * 1024,  # Page cache per connection, in KiB when negative
+    "temp_store": "MEMORY",  # Sorts and temporary indexes stay in memory
+    "busy_timeout": 5000,  # Milliseconds a writer waits for the lock held by another connection
+    "foreign_keys": "ON"
+}
+
+# Bot concurrency and the async database pool serving it
+BOT_CONCURRENT_UPDATES = int(os.getenv("BOT_CONCURRENT_UPDATES", "1"))  # Updates the bot handles at the same time; 1 handles them in order
+ASYNC_DB_POOL_SIZE = int(os.getenv("ASYNC_DB_POOL_SIZE", "0"))  # Connections kept open, 0 to size it for the handlers and workers
+ASYNC_DB_MAX_OVERFLOW = 5  # Extra connections allowed during bursts
+ASYNC_DB_POOL_TIMEOUT = 10  # Seconds a handler waits for a free connection
+
+# User registry settings: activity is kept in memory and written in bulk
+USER_ACTIVITY_FLUSH_INTERVAL = 30  # Seconds between bulk writes of last_interaction and profile changes
+USER_REGISTRY_MAX_SIZE = 100_000  # Telegram users whose database ID is kept in memory
+
+# Notification delivery settings
+NOTIFICATION_WORKERS = int(os.getenv("NOTIFICATION_WORKERS", "1"))  # Delivery workers per bot process
+NOTIFICATION_BATCH_SIZE = 50  # Notifications claimed by a worker at a time
+NOTIFICATION_CLAIM_TIMEOUT = 5 * 60  # Seconds before a claim by a crashed worker can be taken over
+NOTIFICATION_MAX_ATTEMPTS = 8  # Attempts before a notification is marked as failed
+NOTIFICATION_RETRY_BASE = 30  # Seconds before the first retry, doubled on every further attempt
+NOTIFICATION_RETRY_MAX = 60 * 60  # Longest wait between two attempts
+NOTIFICATION_POLL_INTERVAL = 5  # Seconds an idle worker waits before looking for due notifications
+NOTIFICATION_SEND_INTERVAL = 0.1  # Seconds between two messages sent by one worker, to stay under Telegram's limits
+
+# WordPress webhook settings
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")  # Shared secret signing webhook calls; the endpoint is disabled without it
+WEBHOOK_MAX_SKEW = 5 * 60  # Seconds a signed webhook timestamp may differ from our clock, against replays
+# Seconds between full catalog reconciliations; webhooks deliver changes right away, so polling is a safety net
+RECONCILE_INTERVAL = int(os.getenv("RECONCILE_INTERVAL", str(6 * 60 * 60 if WEBHOOK_SECRET else 30 * 60)))
+RECONCILE_MIN_INTERVAL = 10 * 60  # Shortest reconciliation interval while the catalog keeps changing
+RECONCILE_MAX_INTERVAL = 4 * RECONCILE_INTERVAL  # Longest reconciliation interval while nothing changes
+
+# Scheduler settings
+JOB_JITTER = 0.1  # Intervals vary by up to this fraction, so processes and jobs don't fire in lockstep
+JOB_LOCK_TIMEOUT = 30 * 60  # Seconds before a job locked by a crashed process can run elsewhere
+
+# Alert digest settings
+ALERT_DELIVERY_MODES = ('instant', 'hourly', 'daily')  # In order of precedence when several alerts of a user match
+DIGEST_DAILY_HOUR = 5  # UTC hour at which daily digests are sent (8:00 in Nairobi)
+DIGEST_BATCH_CHATS = 50  # Chats whose due digests a worker claims at a time
+DIGEST_MAX_ITEMS = 20  # Most properties listed in one digest message; fewer when their lines would exceed 4096 characters
@@ -0,0 +1,160 @@
+import json
+import time
+import hashlib
+import logging
+import threading
+from collections import Counter
+from datetime import datetime
+from config import STATS_RECONCILE_INTERVAL
+
+# Set up logging
+logging.basicConfig(
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    level=logging.INFO
+)
+logger = logging.getLogger(__name__)
+
+class DashboardStats:
+    """
+    In-memory figures served by the dashboard and /stats
+
+    Writes made by this process (new users, synced or removed listings, created
+    or removed alerts) adjust the counters as they commit. reconcile() replaces
+    them with the database's figures at most every STATS_RECONCILE_INTERVAL,
+    which picks up the writes of other processes and corrects any drift, so
+    serving the figures never waits on a query once they are loaded.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._reconcile_lock = threading.Lock()
+        self.users = 0
+        self.active_users = 0
+        # Structure: {location: count}; None holds listings without a location and alerts for all locations
+        self.listings = Counter()
+        self.alerts = Counter()
+        self.reconciled_at = None
+        self.checked_at = None
+        # (figures, etag) of the current counters, built when first asked for after a change
+        self._snapshot = None
+
+    def _add(self, counter, location, count):
+        counter[location] += count
+        if counter[location] <= 0:
+            del counter[location]
+        self._snapshot = None
+
+    def user_added(self):
+        """Count a user created by this process"""
+        with self._lock:
+            self.users += 1
+            self.active_users += 1
+            self._snapshot = None
+
+    def alert_added(self, location):
+        """Count an alert created by this process"""
+        with self._lock:
+            self._add(self.alerts, location or None, 1)
+
+    def alert_removed(self, location):
+        """Uncount an active alert this process deleted or deactivated"""
+        with self._lock:
+            self._add(self.alerts, location or None, -1)
+
+    def listings_removed(self, locations):
+        """Uncount listings this process marked as removed"""
+        with self._lock:
+            for location in locations:
+                self._add(self.listings, location, -1)
+
+    def record_sync(self, synced):
+        """Apply the added, changed and removed listings of a sync_property_listings result"""
+        with self._lock:
+            for listing in synced["added"]:
+                self._add(self.listings, listing.location, 1)
+            for listing, diff in synced["changed"]:
+                if "removed" in diff:
+                    # A removed listing came back
+                    self._add(self.listings, listing.location, 1)
+                elif "location" in diff:
+                    old_location, new_location = diff["location"]
+                    self._add(self.listings, old_location, -1)
+                    self._add(self.listings, new_location, 1)
+            for listing in synced["removed"]:
+                self._add(self.listings, listing.location, -1)
+
+    def replace_all(self, counts):
+        """Replace the counters with figures from get_dashboard_counts()"""
+        with self._lock:
+            self.users = counts["users"]
+            self.active_users = counts["active_users"]
+            self.listings = Counter(counts["listings_per_location"])
+            self.alerts = Counter(counts["alerts_per_location"])
+            self.reconciled_at = time.time()
+            self._snapshot = None
+
+    def is_due(self):
+        return self.checked_at is None or time.time() - self.checked_at >= STATS_RECONCILE_INTERVAL
+
+    def reconcile(self, load_counts):
+        """
+        Reload the counters if they were never loaded or are due
+
+        Only one thread reloads; the others keep serving the current figures,
+        except before the first load, when they wait for it.
+
+        Args:
+            load_counts (function): Returns the figures from the database, or None on an error
+        """
+        if not self.is_due():
+            return
+        if not self._reconcile_lock.acquire(blocking=self.reconciled_at is None):
+            return
+        try:
+            if not self.is_due():
+                return
+            started = time.perf_counter()
+            counts = load_counts()
+            # A failed load is retried after the next interval, not on every request
+            self.checked_at = time.time()
+            if counts is not None:
+                self.replace_all(counts)
+                logger.info(f"Reconciled the dashboard statistics in {(time.perf_counter() - started) * 1000:.0f} ms")
+        finally:
+            self._reconcile_lock.release()
+
+    def snapshot(self):
+        """
+        Get the figures and an ETag that changes whenever they do
+
+        Returns:
+            tuple: (figures, etag), where figures is a JSON-serializable dictionary
+        """
+        with self._lock:
+            if self._snapshot is not None:
+                return self._snapshot
+            figures = {
+                "users": self.users,
+                "active_users": self.active_users,
+                "listings": sum(self.listings.values()),
+                "active_alerts": sum(self.alerts.values()),
+                "listings_per_location": _per_location(self.listings),
+                "alerts_per_location": _per_location(self.alerts)
+            }
+            # The timestamps aren't part of the ETag: the same counts are the same response
+            etag = hashlib.sha1(json.dumps(figures, sort_keys=True).encode('utf-8')).hexdigest()
+            figures["reconciled_at"] = (
+                datetime.utcfromtimestamp(self.reconciled_at).isoformat() if self.reconciled_at else None
+            )
+            self._snapshot = (figures, etag)
+            return self._snapshot
+
+def _per_location(counter):
+    """Counts as [{"location", "count"}], largest first"""
+    return [
+        {"location": location, "count": count}
+        for location, count in sorted(counter.items(), key=lambda item: (-item[1], item[0] or ''))
+    ]
+
+# Process-wide dashboard statistics
+dashboard_stats = DashboardStats()
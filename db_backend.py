@@ -0,0 +1,68 @@
+"""
+Database backend differences between PostgreSQL and the embedded SQLite mode
+
+The backend follows DATABASE_URL: a sqlite:/// URL runs the bot, the dashboard
+and the alert pipeline on one SQLite file, anything else on PostgreSQL. The
+queries are written once; this module holds the few constructs whose SQL
+differs between the two.
+"""
+import os
+from sqlalchemy import JSON, event
+from sqlalchemy.dialects.postgresql import JSONB, insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.functions import FunctionElement
+from sqlalchemy.types import Float
+from config import SQLITE_PRAGMAS
+
+# JSON column type: JSONB on PostgreSQL, JSON text on SQLite
+JSONType = JSON().with_variant(JSONB(), "postgresql")
+
+def is_sqlite(url=None):
+    """Check whether a database URL, by default DATABASE_URL, selects the SQLite mode"""
+    url = os.environ.get("DATABASE_URL", "") if url is None else str(url)
+    return url.startswith("sqlite")
+
+def insert(table):
+    """
+    INSERT construct of the configured backend, for ON CONFLICT upserts
+
+    Both dialects offer on_conflict_do_nothing() and on_conflict_do_update()
+    with index_elements, set_ and where; named constraints only work on PostgreSQL.
+    """
+    return (sqlite_insert if is_sqlite() else postgresql_insert)(table)
+
+def engine_options(url):
+    """Engine options for a database URL"""
+    if is_sqlite(url):
+        # Writers wait on each other through busy_timeout instead of the pool
+        return {"pool_pre_ping": True, "connect_args": {"timeout": SQLITE_PRAGMAS["busy_timeout"] / 1000}}
+    return {"pool_recycle": 300, "pool_pre_ping": True}
+
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    for name, value in SQLITE_PRAGMAS.items():
+        cursor.execute(f"PRAGMA {name} = {value}")
+    cursor.close()
+
+def configure_engine(engine):
+    """Tune every new connection of a SQLite engine with SQLITE_PRAGMAS; no-op on PostgreSQL"""
+    if engine.dialect.name == "sqlite" and not event.contains(engine, "connect", _set_sqlite_pragmas):
+        event.listen(engine, "connect", _set_sqlite_pragmas)
+    return engine
+
+class seconds_between(FunctionElement):
+    """Seconds from one timestamp column to another, as a float"""
+    type = Float()
+    inherit_cache = True
+    name = "seconds_between"
+
+@compiles(seconds_between)
+def _seconds_between(element, compiler, **kw):
+    start, end = list(element.clauses)
+    return f"EXTRACT(EPOCH FROM {compiler.process(end, **kw)} - {compiler.process(start, **kw)})"
+
+@compiles(seconds_between, "sqlite")
+def _seconds_between_sqlite(element, compiler, **kw):
+    start, end = list(element.clauses)
+    return f"((julianday({compiler.process(end, **kw)}) - julianday({compiler.process(start, **kw)})) * 86400.0)"
@@ -1,7 +1,26 @@
+import re
+import json
+import zlib
+import hashlib
 import logging
-from datetime import datetime
-from models import db, User, PropertyAlert, PropertyListing, AlertNotification
+from types import SimpleNamespace
+from datetime import datetime, timedelta
+from models import db, User, PropertyAlert, PropertyListing, ListingPayload, AlertNotification, NotificationOutbox, JobState, DataVersion
+from sqlalchemy import String, and_, or_, case, cast, delete, func, literal, select, tuple_, update
 from sqlalchemy.exc import SQLAlchemyError
+from alert_index import alert_index, ensure_alert_index_loaded
+from sent_filter import sent_filter, ensure_sent_filter_loaded
+from dashboard_stats import dashboard_stats
+from db_backend import insert, seconds_between
+from utils import compact_property
+from config import (
+    ALERT_DELIVERY_MODES,
+    DIGEST_MAX_ITEMS,
+    LISTING_DETAILS,
+    LISTING_RAW_PAYLOADS,
+    LISTING_PAYLOAD_COMPRESSION,
+    STATS_ACTIVE_USER_WINDOW
+)
 
 # Set up logging
 logging.basicConfig(
@@ -10,6 +29,49 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Matches the first whole number in free text
+NUMBER_PATTERN = re.compile(r'\d+')
+
+# Data version bumped by every write to property_alerts, see ensure_alert_index_loaded()
+ALERTS_VERSION = 'property_alerts'
+# Bumped by webhook syncs, so bot processes with their own cache backend drop their cached catalog
+CATALOG_VERSION = 'catalog'
+
+# PropertyListing columns compared to build the field-level diff of a changed listing
+LISTING_TRACKED_COLUMNS = (
+    'title', 'location', 'price', 'price_value', 'bedrooms', 'bathrooms', 'thumbnail_url', 'property_url', 'status'
+)
+
+def bump_version_statement(name):
+    """Statement incrementing a data version and returning the new one, run in the transaction of the write it announces"""
+    return (
+        insert(DataVersion)
+        .values(name=name, version=1)
+        .on_conflict_do_update(index_elements=[DataVersion.name], set_={"version": DataVersion.version + 1})
+        .returning(DataVersion.version)
+    )
+
+def get_data_version(name):
+    """Current version of a data version counter (0 before the first write), or None on a database error"""
+    try:
+        version = db.session.query(DataVersion.version).filter_by(name=name).scalar()
+        return version or 0
+    except SQLAlchemyError as e:
+        db.session.rollback()
+        logger.error(f"Database error while reading data version {name}: {e}")
+        return None
+
+def bump_data_version(name):
+    """Increment a data version on its own, announcing a change made outside the database; returns it, or None on a database error"""
+    try:
+        version = db.session.execute(bump_version_statement(name)).scalar()
+        db.session.commit()
+        return version
+    except SQLAlchemyError as e:
+        db.session.rollback()
+        logger.error(f"Database error while bumping data version {name}: {e}")
+        return None
+
 def get_or_create_user(telegram_id, first_name=None, last_name=None, username=None):
     """Get an existing user or create a new one if they don't exist"""
     try:
@@ -36,6 +98,7 @@ def get_or_create_user(telegram_id, first_name=None, last_name=None, username=No
             )
             db.session.add(user)
             db.session.commit()
+            dashboard_stats.user_added()
             logger.info(f"Created new user: {user}")
         
         return user
@@ -44,7 +107,8 @@ def get_or_create_user(telegram_id, first_name=None, last_name=None, username=No
         logger.error(f"Database error while getting/creating user: {e}")
         return None
 
-def create_property_alert(user_id, location=None, min_price=None, max_price=None, min_bedrooms=None):
+def create_property_alert(user_id, location=None, min_price=None, max_price=None, min_bedrooms=None,
+                          notify_price_drops=False, delivery_mode='instant'):
     """Create a property alert subscription for a user"""
     try:
         alert = PropertyAlert(
@@ -52,10 +116,16 @@ def create_property_alert(user_id, location=None, min_price=None, max_price=None
             location=location,
             min_price=min_price,
             max_price=max_price,
-            min_bedrooms=min_bedrooms
+            min_bedrooms=min_bedrooms,
+            notify_price_drops=notify_price_drops,
+            delivery_mode=delivery_mode
         )
         db.session.add(alert)
+        version = db.session.execute(bump_version_statement(ALERTS_VERSION)).scalar()
         db.session.commit()
+        alert_index.add(alert)
+        alert_index.advance_version(version)
+        dashboard_stats.alert_added(location)
         logger.info(f"Created property alert: {alert}")
         return alert
     except SQLAlchemyError as e:
@@ -76,8 +146,14 @@ def delete_property_alert(alert_id, user_id):
     try:
         alert = PropertyAlert.query.filter_by(id=alert_id, user_id=user_id).first()
         if alert:
+            was_active = alert.is_active
             db.session.delete(alert)
+            version = db.session.execute(bump_version_statement(ALERTS_VERSION)).scalar()
             db.session.commit()
+            alert_index.remove(alert_id)
+            alert_index.advance_version(version)
+            if was_active:
+                dashboard_stats.alert_removed(alert.location)
             logger.info(f"Deleted property alert: {alert}")
             return True
         return False
@@ -91,8 +167,14 @@ def deactivate_property_alert(alert_id, user_id):
     try:
         alert = PropertyAlert.query.filter_by(id=alert_id, user_id=user_id).first()
         if alert:
+            was_active = alert.is_active
             alert.is_active = False
+            version = db.session.execute(bump_version_statement(ALERTS_VERSION)).scalar()
             db.session.commit()
+            alert_index.remove(alert_id)
+            alert_index.advance_version(version)
+            if was_active:
+                dashboard_stats.alert_removed(alert.location)
             logger.info(f"Deactivated property alert: {alert}")
             return True
         return False
@@ -101,85 +183,331 @@ def deactivate_property_alert(alert_id, user_id):
         logger.error(f"Database error while deactivating property alert: {e}")
         return False
 
+def _first_number(value):
+    """Extract the first whole number from text like "4 Bedrooms ALL ensuite + DSQ" """
+    if value is None or value == '':
+        return None
+    match = NUMBER_PATTERN.search(str(value))
+    return int(match.group()) if match else None
+
+def property_content_hash(property_data):
+    """Get a stable hash of a property from the API, independent of key order"""
+    payload = json.dumps(property_data, sort_keys=True, separators=(',', ':'), default=str)
+    return hashlib.sha1(payload.encode('utf-8')).hexdigest()
+
+def normalize_property_listing(property_data):
+    """
+    Turn a property from the API into PropertyListing column values
+    
+    Returns None if the property has no ID.
+    """
+    wp_id = property_data.get('id')
+    if not wp_id:
+        return None
+    
+    # Extract property details from the API data
+    title = (property_data.get('title') or {}).get('rendered') or 'Unnamed Property'
+    
+    # Extract ACF fields
+    acf = property_data.get('acf') or {}
+    location = acf.get('location')
+    status = acf.get('status')
+    price = acf.get('price')
+    if price is not None:
+        price = str(price)
+    
+    # Keep a numeric copy of the price for filtering
+    price_value = None
+    if price is not None and price.isdigit() and len(price) <= 18:
+        price_value = int(price)
+    
+    # Get thumbnail URL
+    thumbnail_url = None
+    featured_media = (property_data.get('_embedded') or {}).get('wp:featuredmedia')
+    if featured_media and 'source_url' in featured_media[0]:
+        thumbnail_url = featured_media[0]['source_url']
+    
+    # Values are clipped to their column sizes so one odd listing can't fail a whole batch
+    return {
+        "wp_id": wp_id,
+        "title": title[:255],
+        "location": str(location)[:100] if location is not None else None,
+        "price": price[:100] if price is not None else None,
+        "price_value": price_value,
+        "bedrooms": _first_number(acf.get('bedrooms')),
+        "bathrooms": _first_number(acf.get('bathrooms')),
+        "thumbnail_url": thumbnail_url[:255] if thumbnail_url else None,
+        "property_url": (property_data.get('link') or '')[:255] or None,
+        "status": str(status)[:50] if status not in (None, '') else None,
+        "details": listing_details(property_data),
+        "content_hash": property_content_hash(property_data)
+    }
+
+def listing_details(property_data):
+    """
+    The part of a property from the API stored in PropertyListing.details
+    
+    The "compact" policy keeps what the bot reads: the ID, modified, title, link, main ACF
+    fields and featured image, in the shape of the API. The rest of the _embed
+    payload (author, every image size, links) is only kept in listing_payloads
+    when LISTING_RAW_PAYLOADS is set.
+    """
+    return property_data if LISTING_DETAILS == "full" else compact_property(property_data)
+
+def listing_payloads_statement():
+    """Statement storing raw API payloads, executed with the rows of listing_payload_rows(); ones already stored are skipped"""
+    return insert(ListingPayload).on_conflict_do_nothing(index_elements=[ListingPayload.content_hash])
+
+def listing_payload_rows(payloads):
+    """listing_payloads rows of {content_hash: property} payloads, as compressed JSON"""
+    now = datetime.utcnow()
+    rows = []
+    for content_hash, property_data in payloads.items():
+        payload = json.dumps(property_data, separators=(',', ':'), default=str).encode('utf-8')
+        rows.append({
+            "content_hash": content_hash,
+            "payload": zlib.compress(payload, LISTING_PAYLOAD_COMPRESSION),
+            "size": len(payload),
+            "created_at": now
+        })
+    return rows
+
+def get_listing_payload(wp_id):
+    """
+    Get the raw API payload a listing was last synced from
+    
+    Returns:
+        dict: The property as the API returned it, or None if its payload wasn't
+            stored (LISTING_RAW_PAYLOADS was off when it was synced)
+    """
+    try:
+        payload = db.session.scalar(
+            select(ListingPayload.payload)
+            .join(PropertyListing, PropertyListing.content_hash == ListingPayload.content_hash)
+            .where(PropertyListing.wp_id == wp_id)
+        )
+        return json.loads(zlib.decompress(payload)) if payload is not None else None
+    except SQLAlchemyError as e:
+        logger.error(f"Database error while getting the payload of property {wp_id}: {e}")
+        return None
+
+def _store_listing_payloads(payloads, complete, batch_size):
+    """Store the raw payloads not stored yet; after a complete sync, drop the ones no listing refers to anymore"""
+    stored_query = select(ListingPayload.content_hash)
+    if not complete:
+        stored_query = stored_query.where(ListingPayload.content_hash.in_(list(payloads)))
+    stored = set(db.session.scalars(stored_query))
+    missing = [content_hash for content_hash in payloads if content_hash not in stored]
+    for start in range(0, len(missing), batch_size):
+        db.session.execute(listing_payloads_statement(), listing_payload_rows(
+            {content_hash: payloads[content_hash] for content_hash in missing[start:start + batch_size]}
+        ))
+    if complete:
+        # Versions replaced by a change; removed listings keep theirs
+        db.session.execute(
+            delete(ListingPayload)
+            .where(ListingPayload.content_hash.notin_(
+                select(PropertyListing.content_hash).where(PropertyListing.content_hash.isnot(None))
+            ))
+            .execution_options(synchronize_session=False)
+        )
+
 def save_property_listing(property_data):
     """Save a property from the API to track it in the database"""
     try:
-        wp_id = property_data.get('id')
-        if not wp_id:
+        values = normalize_property_listing(property_data)
+        if not values:
             logger.error("Property data missing ID")
             return None
         
         # Check if the property already exists
-        existing = PropertyListing.query.filter_by(wp_id=wp_id).first()
+        existing = PropertyListing.query.filter_by(wp_id=values["wp_id"]).first()
         if existing:
-            logger.info(f"Property already exists: {wp_id}")
-            # Update any changed fields
-            existing.last_updated = datetime.utcnow()
-            db.session.commit()
+            logger.info(f"Property already exists: {values['wp_id']}")
+            # Only write the listing if its content changed
+            if existing.content_hash != values["content_hash"] or existing.removed_at is not None:
+                for column, value in values.items():
+                    setattr(existing, column, value)
+                existing.removed_at = None
+                if LISTING_RAW_PAYLOADS:
+                    db.session.execute(listing_payloads_statement(), listing_payload_rows({values["content_hash"]: property_data}))
+                db.session.commit()
             return existing
         
-        # Extract property details from the API data
-        title = property_data.get('title', {}).get('rendered', 'Unnamed Property') 
+        # Create new property listing
+        property_listing = PropertyListing(**values)
         
-        # Extract ACF fields
-        acf = property_data.get('acf', {})
-        location = acf.get('location')
-        price = acf.get('price')
+        db.session.add(property_listing)
+        if LISTING_RAW_PAYLOADS:
+            db.session.execute(listing_payloads_statement(), listing_payload_rows({values["content_hash"]: property_data}))
+        db.session.commit()
+        logger.info(f"Saved new property: {property_listing}")
+        return property_listing
+    
+    except SQLAlchemyError as e:
+        db.session.rollback()
+        logger.error(f"Database error while saving property: {e}")
+        return None
+
+def _listing_summary(listing_id, values):
+    """The fields of a synced listing that alert matching needs"""
+    return SimpleNamespace(
+        id=listing_id,
+        wp_id=values["wp_id"],
+        title=values["title"],
+        location=values["location"],
+        price_value=values["price_value"],
+        bedrooms=values["bedrooms"]
+    )
+
+def sync_property_listings(properties, batch_size=500, complete=True):
+    """
+    Sync the stored listings with the property catalog from the API
+    
+    One narrow query loads the content hash of every stored listing, then a single
+    pass over the catalog classifies each property. Unchanged listings are skipped
+    without being written, added ones are inserted in batches, changed ones are
+    updated with their field-level diff and listings missing from the catalog are
+    marked as removed. With LISTING_RAW_PAYLOADS, the payloads not stored yet are
+    added to listing_payloads, and a complete sync drops the superseded ones.
+    
+    Args:
+        properties (list): The complete property catalog from the API, or some
+            properties pushed by a webhook
+        batch_size (int): Number of rows written per statement
+        complete (bool): Whether properties is the whole catalog; only then are
+            stored listings missing from it marked as removed
+    
+    Returns:
+        dict: {"added": [listings], "changed": [(listing, diff)], "removed": [listings]},
+            where a listing has the id, wp_id, title, location, price_value and bedrooms
+            of a PropertyListing and a diff maps each changed column to (old, new).
+            A removed listing that comes back is "changed" with a "removed" entry in its diff.
+            None if the sync failed.
+    """
+    result = {"added": [], "changed": [], "removed": []}
+    
+    # Normalize the whole catalog first; the last copy of a repeated ID wins
+    rows_by_wp_id = {}
+    payloads = {}
+    for property_data in properties:
+        values = normalize_property_listing(property_data)
+        if values:
+            rows_by_wp_id[values["wp_id"]] = values
+            if LISTING_RAW_PAYLOADS:
+                payloads[values["content_hash"]] = property_data
+        else:
+            logger.error("Property data missing ID")
+    
+    try:
+        # The stored state without the details payload
+        stored_query = db.session.query(
+            PropertyListing.id,
+            PropertyListing.wp_id,
+            PropertyListing.content_hash,
+            PropertyListing.removed_at,
+            *(getattr(PropertyListing, column) for column in LISTING_TRACKED_COLUMNS)
+        )
+        if not complete:
+            stored_query = stored_query.filter(PropertyListing.wp_id.in_(list(rows_by_wp_id)))
+        stored = {row.wp_id: row for row in stored_query}
         
-        # Parse bedrooms - extract the first number from the string
-        bedrooms_text = acf.get('bedrooms', '')
-        bedrooms = None
-        if bedrooms_text:
-            import re
-            # Extract just the number from text like "4 Bedrooms ALL ensuite + DSQ"
-            bedroom_match = re.search(r'\d+', str(bedrooms_text))
-            if bedroom_match:
-                bedrooms = int(bedroom_match.group())
+        added_rows = []
+        changed_rows = []
+        for wp_id, values in rows_by_wp_id.items():
+            current = stored.pop(wp_id, None)
+            if current is None:
+                added_rows.append(values)
+                continue
+            if current.content_hash == values["content_hash"] and current.removed_at is None:
+                continue
+            diff = {
+                column: (getattr(current, column), values[column])
+                for column in LISTING_TRACKED_COLUMNS
+                if getattr(current, column) != values[column]
+            }
+            if current.removed_at is not None:
+                diff["removed"] = (True, False)
+            changed_rows.append((current.id, values, diff))
         
-        # Parse bathrooms - ensure it's an integer
-        bathrooms_text = acf.get('bathrooms', '')
-        bathrooms = None
-        if bathrooms_text:
-            try:
-                bathrooms = int(bathrooms_text)
-            except (ValueError, TypeError):
-                # If bathrooms can't be converted to int, try to extract the first number
-                import re
-                bathroom_match = re.search(r'\d+', str(bathrooms_text))
-                if bathroom_match:
-                    bathrooms = int(bathroom_match.group())
+        # Whatever is left was not in the catalog
+        removed_rows = [row for row in stored.values() if row.removed_at is None] if complete else []
         
-        # Get property URL
-        property_url = property_data.get('link')
+        now = datetime.utcnow()
+        for start in range(0, len(added_rows), batch_size):
+            # Another worker may insert the same listing first; it then isn't new to us
+            statement = insert(PropertyListing).values(
+                [dict(values, first_seen=now, last_updated=now) for values in added_rows[start:start + batch_size]]
+            ).on_conflict_do_nothing(index_elements=[PropertyListing.wp_id]).returning(
+                PropertyListing.id, PropertyListing.wp_id
+            )
+            ids_by_wp_id = {row.wp_id: row.id for row in db.session.execute(statement)}
+            for values in added_rows[start:start + batch_size]:
+                if values["wp_id"] in ids_by_wp_id:
+                    result["added"].append(_listing_summary(ids_by_wp_id[values["wp_id"]], values))
         
-        # Get thumbnail URL
-        thumbnail_url = None
-        if '_embedded' in property_data and 'wp:featuredmedia' in property_data['_embedded']:
-            featured_media = property_data['_embedded']['wp:featuredmedia']
-            if featured_media and len(featured_media) > 0 and 'source_url' in featured_media[0]:
-                thumbnail_url = featured_media[0]['source_url']
+        for start in range(0, len(changed_rows), batch_size):
+            batch = changed_rows[start:start + batch_size]
+            # Bulk UPDATE by primary key, executed as one executemany per batch
+            db.session.execute(
+                update(PropertyListing),
+                [dict(values, id=listing_id, last_updated=now, removed_at=None) for listing_id, values, _ in batch]
+            )
+            result["changed"].extend((_listing_summary(listing_id, values), diff) for listing_id, values, diff in batch)
         
-        # Create new property listing
-        property_listing = PropertyListing(
-            wp_id=wp_id,
-            title=title,
-            location=location,
-            price=price,
-            bedrooms=bedrooms,
-            bathrooms=bathrooms,
-            thumbnail_url=thumbnail_url,
-            property_url=property_url,
-            details=property_data  # Store the complete property data as JSON
-        )
+        removed_ids = [row.id for row in removed_rows]
+        for start in range(0, len(removed_ids), batch_size):
+            db.session.execute(
+                update(PropertyListing)
+                .where(PropertyListing.id.in_(removed_ids[start:start + batch_size]))
+                .values(removed_at=now)
+                .execution_options(synchronize_session=False)
+            )
+        result["removed"] = [
+            SimpleNamespace(id=row.id, wp_id=row.wp_id, title=row.title, location=row.location,
+                            price_value=row.price_value, bedrooms=row.bedrooms)
+            for row in removed_rows
+        ]
+        
+        if LISTING_RAW_PAYLOADS:
+            _store_listing_payloads(payloads, complete, batch_size)
         
-        db.session.add(property_listing)
         db.session.commit()
-        logger.info(f"Saved new property: {property_listing}")
-        return property_listing
+        dashboard_stats.record_sync(result)
+        logger.info(
+            f"Synced {len(rows_by_wp_id)} properties: {len(result['added'])} added, "
+            f"{len(result['changed'])} changed, {len(result['removed'])} removed, "
+            f"{len(rows_by_wp_id) - len(added_rows) - len(changed_rows)} unchanged"
+        )
+        return result
     
     except SQLAlchemyError as e:
         db.session.rollback()
-        logger.error(f"Database error while saving property: {e}")
+        logger.error(f"Database error while syncing properties: {e}")
+        return None
+
+def remove_property_listings(wp_ids):
+    """
+    Mark listings as removed, e.g. when WordPress reports them deleted
+    
+    Returns:
+        int: Number of listings newly marked as removed, or None on a database error
+    """
+    try:
+        locations = db.session.scalars(
+            update(PropertyListing)
+            .where(PropertyListing.wp_id.in_(list(wp_ids)), PropertyListing.removed_at.is_(None))
+            .values(removed_at=datetime.utcnow())
+            .returning(PropertyListing.location)
+            .execution_options(synchronize_session=False)
+        ).all()
+        db.session.commit()
+        dashboard_stats.listings_removed(locations)
+        logger.info(f"Marked {len(locations)} listings as removed")
+        return len(locations)
+    except SQLAlchemyError as e:
+        db.session.rollback()
+        logger.error(f"Database error while removing listings: {e}")
         return None
 
 def get_new_properties_since(timestamp):
@@ -190,35 +518,95 @@ def get_new_properties_since(timestamp):
         logger.error(f"Database error while getting new properties: {e}")
         return []
 
-def get_matching_properties_for_alert(alert):
-    """Get properties that match the criteria in a PropertyAlert"""
+def _alert_criteria(location=None, min_price=None, max_price=None, min_bedrooms=None):
+    """
+    Filters selecting the current listings that match alert criteria
+    
+    They follow the alert matching rules (a listing without a numeric price
+    passes the price filters) and only use indexed columns, so the range
+    and IS NULL parts can each be answered by an index scan.
+    """
+    criteria = [PropertyListing.removed_at.is_(None)]
+    if location:
+        criteria.append(PropertyListing.location == location)
+    if min_price is not None or max_price is not None:
+        price_range = []
+        if min_price is not None:
+            price_range.append(PropertyListing.price_value >= min_price)
+        if max_price is not None:
+            price_range.append(PropertyListing.price_value <= max_price)
+        criteria.append(or_(and_(*price_range), PropertyListing.price_value.is_(None)))
+    if min_bedrooms is not None:
+        criteria.append(PropertyListing.bedrooms >= min_bedrooms)
+    return criteria
+
+def count_matching_statement(location=None, min_price=None, max_price=None, min_bedrooms=None):
+    """Statement counting the current listings that match alert criteria"""
+    # count(*) rather than count(id), so the count can come from an index-only scan
+    return select(func.count()).select_from(PropertyListing).where(
+        *_alert_criteria(location, min_price, max_price, min_bedrooms)
+    )
+
+def count_matching_properties(location=None, min_price=None, max_price=None, min_bedrooms=None):
+    """
+    Count the current listings that match alert criteria, for a preview while the alert is created
+    
+    Returns:
+        int: Number of matching listings, or None on a database error
+    """
     try:
-        query = PropertyListing.query
-        
-        # Apply filters based on alert criteria
-        if alert.location:
-            query = query.filter(PropertyListing.location == alert.location)
-        if alert.min_price is not None:
-            # Convert string price to integer for comparison
-            # This is a simplification; in practice would need more robust price parsing
-            query = query.filter(PropertyListing.price.cast(db.Integer) >= alert.min_price)
-        if alert.max_price is not None:
-            query = query.filter(PropertyListing.price.cast(db.Integer) <= alert.max_price)
-        if alert.min_bedrooms is not None:
-            query = query.filter(PropertyListing.bedrooms >= alert.min_bedrooms)
-        
-        return query.all()
+        return db.session.execute(count_matching_statement(location, min_price, max_price, min_bedrooms)).scalar()
+    except SQLAlchemyError as e:
+        logger.error(f"Database error while counting matching properties: {e}")
+        return None
+
+def matching_properties_statement(alert, limit=None, unnotified=False):
+    """Statement selecting the current listings that match a PropertyAlert, newest first"""
+    statement = select(PropertyListing).where(
+        *_alert_criteria(alert.location, alert.min_price, alert.max_price, alert.min_bedrooms)
+    )
+    if unnotified:
+        statement = statement.where(~select(AlertNotification.id).where(
+            AlertNotification.user_id == alert.user_id,
+            AlertNotification.property_id == PropertyListing.id,
+            AlertNotification.event == 'new'
+        ).exists())
+    statement = statement.order_by(PropertyListing.first_seen.desc(), PropertyListing.id.desc())
+    if limit is not None:
+        statement = statement.limit(limit)
+    return statement
+
+def get_matching_properties_for_alert(alert, limit=None, unnotified=False):
+    """
+    Get the current properties that match the criteria in a PropertyAlert, newest first
+    
+    Args:
+        alert (PropertyAlert): Alert whose criteria to match
+        limit (int): Maximum number of properties to return
+        unnotified (bool): Skip properties the alert's user was already notified about
+    """
+    try:
+        return db.session.scalars(matching_properties_statement(alert, limit, unnotified)).all()
     except SQLAlchemyError as e:
         logger.error(f"Database error while getting matching properties: {e}")
         return []
 
-def record_notification(user_id, property_id):
+def get_user_alert(alert_id, user_id):
+    """Get an active property alert by ID, ensuring it belongs to the specified user"""
+    try:
+        return PropertyAlert.query.filter_by(id=alert_id, user_id=user_id, is_active=True).first()
+    except SQLAlchemyError as e:
+        logger.error(f"Database error while getting property alert: {e}")
+        return None
+
+def record_notification(user_id, property_id, event='new'):
     """Record that a notification was sent to avoid duplicate alerts"""
     try:
         # Check if notification was already sent
         existing = AlertNotification.query.filter_by(
             user_id=user_id, 
-            property_id=property_id
+            property_id=property_id,
+            event=event
         ).first()
         
         if existing:
@@ -226,9 +614,10 @@ def record_notification(user_id, property_id):
             return existing
         
         # Create new notification record
-        notification = AlertNotification(user_id=user_id, property_id=property_id)
+        notification = AlertNotification(user_id=user_id, property_id=property_id, event=event)
         db.session.add(notification)
         db.session.commit()
+        sent_filter.add(user_id, property_id, event)
         logger.info(f"Recorded new notification: {notification}")
         return notification
     
@@ -237,58 +626,626 @@ def record_notification(user_id, property_id):
         logger.error(f"Database error while recording notification: {e}")
         return None
 
-def get_users_for_notifications(property_listing):
-    """Get all users who should be notified about this property based on their alerts"""
+def sent_notifications_statement(notifications, sent_at=None):
+    """Statement recording (user_id, property_id, event) notifications as sent, skipping ones already recorded"""
+    sent_at = sent_at or datetime.utcnow()
+    return insert(AlertNotification).values([
+        {"user_id": user_id, "property_id": property_id, "event": event, "sent_at": sent_at}
+        for user_id, property_id, event in notifications
+    ]).on_conflict_do_nothing(
+        index_elements=[AlertNotification.user_id, AlertNotification.property_id, AlertNotification.event]
+    )
+
+def record_notifications(notifications):
+    """Record a batch of (user_id, property_id, event) notifications in one statement, skipping ones already sent"""
+    if not notifications:
+        return 0
     try:
-        # Get all active alerts that match this property
-        matching_alerts = []
+        result = db.session.execute(sent_notifications_statement(notifications))
+        db.session.commit()
+        for user_id, property_id, event in notifications:
+            sent_filter.add(user_id, property_id, event)
+        logger.info(f"Recorded {result.rowcount} new notifications")
+        return result.rowcount
+    except SQLAlchemyError as e:
+        db.session.rollback()
+        logger.error(f"Database error while recording notifications: {e}")
+        return 0
+
+def get_notification_targets(property_listings, price_drops=False):
+    """
+    Get every (property, user) pair to notify for a batch of listings in one query
+    
+    Candidate alerts come from the in-memory alert index. The query then joins the
+    listings to those alerts (re-checking that they are active and still match)
+    and keeps active users only. Notifications that were already sent are
+    dropped with the in-memory sent filter; only the pairs it reports as
+    possibly sent are looked up in alert_notifications.
+    
+    Args:
+        property_listings (list): New listings, or listings whose price dropped
+        price_drops (bool): Target the alerts that opted in to price drops, with the
+            event "price_drop:<new price>" so each drop is announced once
+    
+    Returns:
+        list: Rows of (property_id, user_id, telegram_id, event, delivery_mode). When
+            several alerts of a user match, the most immediate delivery mode wins.
+    """
+    if not property_listings:
+        return []
+    try:
+        ensure_alert_index_loaded(get_active_alerts, get_data_version(ALERTS_VERSION))
+        
+        candidate_alert_ids = set()
+        for listing in property_listings:
+            for entry in alert_index.match(listing.location, listing.price_value, listing.bedrooms):
+                candidate_alert_ids.add(entry.id)
+        if not candidate_alert_ids:
+            return []
         
-        # Get all active alerts
-        all_alerts = PropertyAlert.query.filter_by(is_active=True).all()
+        if price_drops:
+            event = literal('price_drop:') + cast(PropertyListing.price_value, String)
+        else:
+            event = literal('new')
         
-        for alert in all_alerts:
-            matches = True
-            
-            # Check location filter
-            if alert.location and property_listing.location != alert.location:
-                matches = False
-            
-            # Check price filters if the property has a numeric price
-            if property_listing.price and property_listing.price.isdigit():
-                price_value = int(property_listing.price)
-                if alert.min_price is not None and price_value < alert.min_price:
-                    matches = False
-                if alert.max_price is not None and price_value > alert.max_price:
-                    matches = False
-            
-            # Check bedroom filter
-            if alert.min_bedrooms is not None and (
-                property_listing.bedrooms is None or 
-                property_listing.bedrooms < alert.min_bedrooms
-            ):
-                matches = False
-            
-            if matches:
-                matching_alerts.append(alert)
+        # The same matching rules as the alert index, evaluated by the database
+        alert_matches = and_(
+            PropertyAlert.id.in_(candidate_alert_ids),
+            PropertyAlert.is_active.is_(True),
+            or_(PropertyAlert.location.is_(None), PropertyAlert.location == '',
+                PropertyAlert.location == PropertyListing.location),
+            or_(PropertyAlert.min_price.is_(None), PropertyListing.price_value.is_(None),
+                PropertyListing.price_value >= PropertyAlert.min_price),
+            or_(PropertyAlert.max_price.is_(None), PropertyListing.price_value.is_(None),
+                PropertyListing.price_value <= PropertyAlert.max_price),
+            or_(PropertyAlert.min_bedrooms.is_(None),
+                PropertyListing.bedrooms >= PropertyAlert.min_bedrooms)
+        )
+        if price_drops:
+            alert_matches = and_(alert_matches, PropertyAlert.notify_price_drops.is_(True))
         
-        # Get unique users who haven't been notified yet
-        users_to_notify = []
-        for alert in matching_alerts:
-            # Check if user was already notified about this property
-            notification = AlertNotification.query.filter_by(
-                user_id=alert.user_id,
-                property_id=property_listing.id
-            ).first()
-            
-            if not notification:
-                # Add user to notification list if not already included
-                if alert.user_id not in [u.id for u in users_to_notify]:
-                    user = User.query.get(alert.user_id)
-                    if user and user.is_active:
-                        users_to_notify.append(user)
+        # Rank of the delivery mode, so the grouping can keep the most immediate one
+        mode_rank = case(
+            *((PropertyAlert.delivery_mode == mode, rank) for rank, mode in enumerate(ALERT_DELIVERY_MODES)),
+            else_=0
+        )
         
-        return users_to_notify
+        rows = (
+            db.session.query(
+                PropertyListing.id.label('property_id'),
+                User.id.label('user_id'),
+                User.telegram_id.label('telegram_id'),
+                event.label('event'),
+                func.min(mode_rank).label('mode_rank')
+            )
+            .join(PropertyAlert, alert_matches)
+            .join(User, and_(User.id == PropertyAlert.user_id, User.is_active.is_(True)))
+            .filter(PropertyListing.id.in_([listing.id for listing in property_listings]))
+            # The other columns depend on these primary keys
+            .group_by(PropertyListing.id, User.id)
+            .all()
+        )
+        rows = _drop_sent_notifications(rows)
+        return [
+            SimpleNamespace(
+                property_id=row.property_id,
+                user_id=row.user_id,
+                telegram_id=row.telegram_id,
+                event=row.event,
+                delivery_mode=ALERT_DELIVERY_MODES[row.mode_rank]
+            )
+            for row in rows
+        ]
+    except SQLAlchemyError as e:
+        logger.error(f"Database error while getting notification targets: {e}")
+        return []
+
+def _sent_notification_rows(min_id):
+    """Yield (id, user_id, property_id, event) of the sent notifications with an ID above min_id"""
+    return (
+        db.session.query(AlertNotification.id, AlertNotification.user_id,
+                         AlertNotification.property_id, AlertNotification.event)
+        .filter(AlertNotification.id > min_id)
+        .order_by(AlertNotification.id)
+        .yield_per(10000)
+    )
+
+def load_sent_filter():
+    """Load the in-memory filter of sent notifications, or refresh it when it is due"""
+    try:
+        ensure_sent_filter_loaded(
+            _sent_notification_rows,
+            lambda: db.session.query(func.count(AlertNotification.id)).scalar()
+        )
+    except SQLAlchemyError as e:
+        db.session.rollback()
+        logger.error(f"Database error while loading sent notifications: {e}")
+
+def _drop_sent_notifications(rows):
+    """
+    Drop the notification targets that were already sent
+    
+    The sent filter answers most checks from memory; the targets it reports as
+    possibly sent are confirmed with one query, since some are false positives.
+    """
+    load_sent_filter()
+    if sent_filter.loaded_at is None:
+        # The filter couldn't be loaded, so confirm every target with the database
+        maybe_sent = rows
+    else:
+        maybe_sent = [row for row in rows if sent_filter.might_contain(row.user_id, row.property_id, row.event)]
+    if not maybe_sent:
+        return rows
+    
+    sent = set(
+        tuple(row) for row in db.session.query(AlertNotification.user_id, AlertNotification.property_id, AlertNotification.event)
+        .filter(tuple_(AlertNotification.user_id, AlertNotification.property_id, AlertNotification.event).in_(
+            [(row.user_id, row.property_id, row.event) for row in maybe_sent]
+        ))
+    )
+    if sent_filter.loaded_at is not None:
+        sent_filter.stats["confirmed"] += len(sent)
+    return [row for row in rows if (row.user_id, row.property_id, row.event) not in sent]
+
+def get_active_alerts():
+    """Get all active property alerts"""
+    try:
+        return PropertyAlert.query.filter_by(is_active=True).all()
+    except SQLAlchemyError as e:
+        logger.error(f"Database error while getting active alerts: {e}")
+        return []
+
+def get_users_for_notifications(property_listing):
+    """Get all users who should be notified about this property based on their alerts"""
+    try:
+        targets = get_notification_targets([property_listing])
+        user_ids = {target.user_id for target in targets}
+        if not user_ids:
+            return []
+        return User.query.filter(User.id.in_(user_ids)).all()
     
     except SQLAlchemyError as e:
         logger.error(f"Database error while getting users for notifications: {e}")
-        return []
\ No newline at end of file
+        return []
+
+def enqueue_statement(notifications):
+    """Statement queueing notifications in the outbox, skipping ones already queued"""
+    now = datetime.utcnow()
+    return insert(NotificationOutbox).values(
+        [
+            {"digest": None, "next_attempt_at": now, **notification, "status": 'pending', "attempts": 0, "created_at": now}
+            for notification in notifications
+        ]
+    ).on_conflict_do_nothing(
+        index_elements=[NotificationOutbox.user_id, NotificationOutbox.property_id, NotificationOutbox.event]
+    )
+
+def enqueue_notifications(notifications):
+    """
+    Queue notifications in the outbox for the delivery workers, in one statement
+    
+    Args:
+        notifications (list): Dictionaries with the user_id, property_id, event,
+            telegram_id, message and image_url of each notification, and for
+            digest notifications the digest mode and the next_attempt_at when
+            the digest window closes
+    
+    Returns:
+        int: Number of notifications queued; ones already queued are skipped
+    """
+    if not notifications:
+        return 0
+    try:
+        result = db.session.execute(enqueue_statement(notifications))
+        db.session.commit()
+        logger.info(f"Queued {result.rowcount} notifications")
+        return result.rowcount
+    except SQLAlchemyError as e:
+        db.session.rollback()
+        logger.error(f"Database error while queueing notifications: {e}")
+        return 0
+
+def claim_statement(worker_id, limit, claim_timeout, digest=False):
+    """
+    Statement claiming due notifications, with the sort key that puts the claimed rows in delivery order
+    
+    Instant notifications are claimed oldest first, at most limit of them. Digests
+    are claimed by chat: the due rows of at most limit chats, and of each chat and
+    kind of digest the oldest DIGEST_MAX_ITEMS, so a digest message never spans two
+    claims. The rest stay pending for the chat's next message.
+    
+    The UPDATE ... RETURNING doesn't keep the order of the subquery, so the rows are sorted after.
+    """
+    now = datetime.utcnow()
+    due_conditions = (
+        NotificationOutbox.status == 'pending',
+        NotificationOutbox.next_attempt_at <= now,
+        NotificationOutbox.digest.isnot(None) if digest else NotificationOutbox.digest.is_(None),
+        or_(NotificationOutbox.claimed_until.is_(None), NotificationOutbox.claimed_until < now)
+    )
+    if digest:
+        # Window functions aren't allowed next to FOR UPDATE, so the locked rows are ranked one level up
+        locked = (
+            select(NotificationOutbox.id, NotificationOutbox.telegram_id, NotificationOutbox.digest)
+            .where(*due_conditions)
+            .with_for_update(skip_locked=True)
+            .subquery()
+        )
+        ranked = select(
+            locked.c.id,
+            func.row_number().over(partition_by=(locked.c.telegram_id, locked.c.digest), order_by=locked.c.id).label('position'),
+            func.dense_rank().over(order_by=locked.c.telegram_id).label('chat')
+        ).subquery()
+        due = select(ranked.c.id).where(ranked.c.position <= DIGEST_MAX_ITEMS, ranked.c.chat <= limit)
+    else:
+        due = (
+            select(NotificationOutbox.id)
+            .where(*due_conditions)
+            .order_by(NotificationOutbox.next_attempt_at, NotificationOutbox.id)
+            .limit(limit)
+            .with_for_update(skip_locked=True)
+        )
+    statement = (
+        update(NotificationOutbox)
+        .where(NotificationOutbox.id.in_(due.scalar_subquery()))
+        .values(
+            claimed_by=worker_id,
+            claimed_until=now + timedelta(seconds=claim_timeout),
+            attempts=NotificationOutbox.attempts + 1
+        )
+        .returning(
+            NotificationOutbox.id,
+            NotificationOutbox.telegram_id,
+            NotificationOutbox.message,
+            NotificationOutbox.image_url,
+            NotificationOutbox.attempts,
+            NotificationOutbox.digest,
+            NotificationOutbox.created_at
+        )
+        .execution_options(synchronize_session=False)
+    )
+    order = (lambda row: (row.telegram_id, row.id)) if digest else (lambda row: row.id)
+    return statement, order
+
+def pending_digests_statement(claimed):
+    """Statement counting the due rows of each claimed digest, claimed now or left for the next message"""
+    return (
+        select(NotificationOutbox.telegram_id, NotificationOutbox.digest, func.count(NotificationOutbox.id))
+        .where(
+            NotificationOutbox.status == 'pending',
+            NotificationOutbox.next_attempt_at <= datetime.utcnow(),
+            tuple_(NotificationOutbox.telegram_id, NotificationOutbox.digest).in_(
+                {(row.telegram_id, row.digest) for row in claimed}
+            )
+        )
+        .group_by(NotificationOutbox.telegram_id, NotificationOutbox.digest)
+    )
+
+def with_pending_counts(claimed, counts):
+    """Claimed digest rows with the number of due rows of their digest as pending"""
+    pending = {(telegram_id, digest): count for telegram_id, digest, count in counts}
+    return [
+        SimpleNamespace(**row._mapping, pending=pending.get((row.telegram_id, row.digest), 0))
+        for row in claimed
+    ]
+
+def claim_notifications(worker_id, limit, claim_timeout, digest=False):
+    """
+    Claim a batch of due notifications for a delivery worker
+    
+    FOR UPDATE SKIP LOCKED lets any number of workers claim at the same time
+    without waiting on each other or claiming the same row. A claim expires
+    after claim_timeout seconds, so the notifications of a crashed worker are
+    retried by another one.
+    
+    Args:
+        worker_id (str): Identifies the claiming worker
+        limit (int): Largest number of notifications to claim, or of chats for digests
+        claim_timeout (int): Seconds the claim lasts
+        digest (bool): Claim the digest notifications whose window closed instead
+            of instant ones, whole chats at a time and at most DIGEST_MAX_ITEMS per digest
+    
+    Returns:
+        list: Claimed rows with the id, telegram_id, message, image_url, attempts
+            and created_at of each notification, oldest first (per chat for digests,
+            with the number of due rows of the digest as pending)
+    """
+    try:
+        statement, order = claim_statement(worker_id, limit, claim_timeout, digest)
+        claimed = sorted(db.session.execute(statement).all(), key=order)
+        db.session.commit()
+        if digest and claimed:
+            claimed = with_pending_counts(claimed, db.session.execute(pending_digests_statement(claimed)).all())
+        return claimed
+    except SQLAlchemyError as e:
+        db.session.rollback()
+        logger.error(f"Database error while claiming notifications: {e}")
+        return []
+
+def delivered_statement(notification_ids, worker_id, delivered_at):
+    """Statement marking claimed notifications delivered, returning the (user_id, property_id, event) of each"""
+    return (
+        update(NotificationOutbox)
+        .where(NotificationOutbox.id.in_(notification_ids), NotificationOutbox.claimed_by == worker_id)
+        .values(status='delivered', delivered_at=delivered_at, claimed_until=None, last_error=None)
+        .returning(NotificationOutbox.user_id, NotificationOutbox.property_id, NotificationOutbox.event)
+        .execution_options(synchronize_session=False)
+    )
+
+def mark_notifications_delivered(notification_ids, worker_id):
+    """
+    Mark notifications as delivered once Telegram accepted them, and record them as sent
+    
+    Returns:
+        int: Number marked; notifications whose claim was lost to another worker are skipped
+    """
+    if not notification_ids:
+        return 0
+    try:
+        now = datetime.utcnow()
+        delivered = db.session.execute(delivered_statement(notification_ids, worker_id, now)).all()
+        if delivered:
+            db.session.execute(sent_notifications_statement(
+                [(row.user_id, row.property_id, row.event) for row in delivered], now
+            ))
+        db.session.commit()
+        for row in delivered:
+            sent_filter.add(row.user_id, row.property_id, row.event)
+        return len(delivered)
+    except SQLAlchemyError as e:
+        db.session.rollback()
+        logger.error(f"Database error while marking notifications delivered: {e}")
+        return 0
+
+def failed_statement(notification_ids, worker_id, error, retry_at=None):
+    """Statement releasing claimed notifications for a retry at retry_at, or marking them failed"""
+    values = {"claimed_until": None, "last_error": error[:1000]}
+    if retry_at is None:
+        values["status"] = 'failed'
+    else:
+        values["next_attempt_at"] = retry_at
+    return (
+        update(NotificationOutbox)
+        .where(NotificationOutbox.id.in_(notification_ids), NotificationOutbox.claimed_by == worker_id)
+        .values(**values)
+        .execution_options(synchronize_session=False)
+    )
+
+def mark_notifications_failed(notification_ids, worker_id, error, retry_at=None):
+    """
+    Release notifications after a failed attempt
+    
+    Args:
+        notification_ids (list): Outbox row IDs
+        worker_id (str): Worker that claimed the notifications
+        error (str): Description of the failure
+        retry_at (datetime): When to try again, or None to give up on the notifications
+    """
+    try:
+        db.session.execute(failed_statement(notification_ids, worker_id, error, retry_at))
+        db.session.commit()
+    except SQLAlchemyError as e:
+        db.session.rollback()
+        logger.error(f"Database error while releasing notifications {notification_ids}: {e}")
+
+def get_outbox_stats(window=60 * 60):
+    """
+    Get delivery metrics of the notification outbox across all workers
+    
+    Args:
+        window (int): Seconds of recent deliveries to compute throughput and lag over
+    
+    Returns:
+        dict: Pending, retrying and failed counts, the age of the oldest due
+            notification in seconds, and the deliveries per minute and average
+            delivery lag in seconds over the window. None on a database error.
+    """
+    try:
+        now = datetime.utcnow()
+        since = now - timedelta(seconds=window)
+        pending = db.session.query(
+            func.count(NotificationOutbox.id),
+            func.count(NotificationOutbox.id).filter(NotificationOutbox.attempts > 0),
+            func.min(NotificationOutbox.created_at).filter(NotificationOutbox.next_attempt_at <= now)
+        ).filter(NotificationOutbox.status == 'pending').one()
+        delivered = db.session.query(
+            func.count(NotificationOutbox.id),
+            func.avg(seconds_between(NotificationOutbox.created_at, NotificationOutbox.delivered_at))
+        ).filter(NotificationOutbox.status == 'delivered', NotificationOutbox.delivered_at >= since).one()
+        failed = NotificationOutbox.query.filter_by(status='failed').count()
+        return {
+            "pending": pending[0],
+            "retrying": pending[1],
+            "failed": failed,
+            "oldest_due_age": (now - pending[2]).total_seconds() if pending[2] else 0,
+            "delivered_per_minute": delivered[0] / (window / 60),
+            "average_lag": float(delivered[1]) if delivered[1] is not None else None
+        }
+    except SQLAlchemyError as e:
+        logger.error(f"Database error while getting outbox stats: {e}")
+        return None
+
+def get_dashboard_counts():
+    """
+    Count the dashboard figures with three grouped queries
+    
+    The listing counts come from the partial index on current listings, without
+    reading the table.
+    
+    Returns:
+        dict: The number of users and of users active within
+            STATS_ACTIVE_USER_WINDOW, and {location: count} of current listings
+            and of active alerts (None for alerts on all locations).
+            None on a database error.
+    """
+    try:
+        since = datetime.utcnow() - timedelta(seconds=STATS_ACTIVE_USER_WINDOW)
+        users = db.session.query(
+            func.count(User.id),
+            func.count(User.id).filter(User.last_interaction >= since)
+        ).one()
+        listings = (
+            db.session.query(PropertyListing.location, func.count())
+            .filter(PropertyListing.removed_at.is_(None))
+            .group_by(PropertyListing.location)
+            .all()
+        )
+        alerts = (
+            db.session.query(PropertyAlert.location, func.count())
+            .filter(PropertyAlert.is_active.is_(True))
+            .group_by(PropertyAlert.location)
+            .all()
+        )
+        alerts_per_location = {}
+        for location, count in alerts:
+            # An empty location also means all locations
+            location = location or None
+            alerts_per_location[location] = alerts_per_location.get(location, 0) + count
+        return {
+            "users": users[0],
+            "active_users": users[1],
+            "listings_per_location": dict(listings),
+            "alerts_per_location": alerts_per_location
+        }
+    except SQLAlchemyError as e:
+        logger.error(f"Database error while counting dashboard figures: {e}")
+        return None
+
+def get_job_state(name, interval):
+    """
+    Get the persisted state of a scheduled job, creating it on first use
+    
+    Args:
+        name (str): Job name
+        interval (float): Initial interval in seconds for a new job
+    
+    Returns:
+        JobState: The job's state, or None on a database error
+    """
+    try:
+        db.session.execute(
+            insert(JobState).values(name=name, interval=interval, runs=0, failures=0, skipped_ticks=0)
+            .on_conflict_do_nothing(index_elements=[JobState.name])
+        )
+        db.session.commit()
+        return db.session.get(JobState, name, populate_existing=True)
+    except SQLAlchemyError as e:
+        db.session.rollback()
+        logger.error(f"Database error while getting job state {name}: {e}")
+        return None
+
+def lock_job(name, owner, lock_timeout):
+    """
+    Lock a scheduled job so only one process runs it at a time
+    
+    Returns:
+        bool: True if the lock was taken, False if another process holds it
+    """
+    try:
+        now = datetime.utcnow()
+        locked = db.session.execute(
+            update(JobState)
+            .where(JobState.name == name, or_(JobState.locked_until.is_(None), JobState.locked_until < now))
+            .values(locked_by=owner, locked_until=now + timedelta(seconds=lock_timeout), last_started_at=now)
+            .returning(JobState.name)
+            .execution_options(synchronize_session=False)
+        ).first()
+        db.session.commit()
+        return locked is not None
+    except SQLAlchemyError as e:
+        db.session.rollback()
+        logger.error(f"Database error while locking job {name}: {e}")
+        return False
+
+def record_job_skipped(name, ticks=1):
+    """Count ticks of a job that were dropped because a run was still going"""
+    try:
+        db.session.execute(
+            update(JobState)
+            .where(JobState.name == name)
+            .values(skipped_ticks=JobState.skipped_ticks + ticks)
+            .execution_options(synchronize_session=False)
+        )
+        db.session.commit()
+    except SQLAlchemyError as e:
+        db.session.rollback()
+        logger.error(f"Database error while recording skipped ticks of job {name}: {e}")
+
+def finish_job(name, owner, duration, interval, changes=None, error=None):
+    """
+    Record the outcome of a job run, move its watermark and release its lock
+    
+    Args:
+        name (str): Job name
+        owner (str): Process that locked the job
+        duration (float): Seconds the run took
+        interval (float): Interval until the next run
+        changes (int): Changes the run found, if it reports them
+        error (str): Error message if the run failed
+    """
+    try:
+        now = datetime.utcnow()
+        values = {
+            "last_finished_at": now,
+            "last_duration": duration,
+            "interval": interval,
+            "last_error": error,
+            "runs": JobState.runs + 1,
+            "locked_by": None,
+            "locked_until": None
+        }
+        if error is None:
+            values.update(last_success_at=now, last_changes=changes)
+        else:
+            values["failures"] = JobState.failures + 1
+        db.session.execute(
+            update(JobState)
+            .where(JobState.name == name, JobState.locked_by == owner)
+            .values(**values)
+            .execution_options(synchronize_session=False)
+        )
+        db.session.commit()
+    except SQLAlchemyError as e:
+        db.session.rollback()
+        logger.error(f"Database error while finishing job {name}: {e}")
+
+def release_job(name, owner):
+    """Release the lock of a job whose run was cancelled, without recording a run"""
+    try:
+        db.session.execute(
+            update(JobState)
+            .where(JobState.name == name, JobState.locked_by == owner)
+            .values(locked_by=None, locked_until=None)
+            .execution_options(synchronize_session=False)
+        )
+        db.session.commit()
+    except SQLAlchemyError as e:
+        db.session.rollback()
+        logger.error(f"Database error while releasing job {name}: {e}")
+
+def get_job_states():
+    """
+    Get the run metrics of every scheduled job
+    
+    Returns:
+        list: Dictionaries with each job's interval, last run, duration, changes and counters
+    """
+    try:
+        return [
+            {
+                "name": state.name,
+                "interval": state.interval,
+                "last_success_at": state.last_success_at.isoformat() if state.last_success_at else None,
+                "last_duration": state.last_duration,
+                "last_changes": state.last_changes,
+                "last_error": state.last_error,
+                "runs": state.runs,
+                "failures": state.failures,
+                "skipped_ticks": state.skipped_ticks,
+                "running": state.locked_until is not None and state.locked_until > datetime.utcnow()
+            }
+            for state in JobState.query.order_by(JobState.name).all()
+        ]
+    except SQLAlchemyError as e:
+        logger.error(f"Database error while getting job states: {e}")
+        return []
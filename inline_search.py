@@ -0,0 +1,164 @@
+import re
+import time
+import logging
+from collections import OrderedDict
+from config import INLINE_RESULT_CACHE_SIZE, INLINE_RESULT_CACHE_TTL
+
+# Set up logging
+logging.basicConfig(
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    level=logging.INFO
+)
+logger = logging.getLogger(__name__)
+
+# Matches bedroom filters such as "3br", "3 bed" or "4 bedrooms"
+BEDROOMS_PATTERN = re.compile(r'\b(\d+)\s*(?:br|bd|bed|beds|bedroom|bedrooms)\b')
+
+# Matched property lists keyed by normalized query text, most recently used last
+# Structure: {query: (catalog_key, timestamp, [properties])}
+_result_cache = OrderedDict()
+
+# Search index for the current catalog, rebuilt only when the catalog changes
+_catalog_index = {"catalog": None, "key": 0, "entries": [], "locations": []}
+
+def _parse_bedrooms(value):
+    """Extract the first number from bedroom text like "4 Bedrooms ALL ensuite + DSQ" """
+    if value is None:
+        return None
+    match = re.search(r'\d+', str(value))
+    return int(match.group()) if match else None
+
+def _build_catalog_index(properties):
+    """Precompute the searchable fields of every property in the catalog"""
+    entries = []
+    locations = set()
+    for property_data in properties:
+        acf = property_data.get('acf') or {}
+        location = acf.get('location')
+        location = str(location) if location is not None else ''
+        if location.strip():
+            locations.add(location)
+        title = (property_data.get('title') or {}).get('rendered', '')
+        entries.append({
+            "property": property_data,
+            "location": location.lower(),
+            "bedrooms": _parse_bedrooms(acf.get('bedrooms')),
+            "text": f"{title} {location} {acf.get('bedrooms', '')}".lower()
+        })
+    # Longest names first so "Lavington Green" wins over "Lavington"
+    return entries, sorted(locations, key=len, reverse=True)
+
+def _get_catalog_index(properties):
+    """Get the search index for a catalog, building it if the catalog changed"""
+    # Keep a reference to the catalog so its identity can't be reused by a newer list
+    if _catalog_index["catalog"] is not properties:
+        entries, locations = _build_catalog_index(properties)
+        _catalog_index.update(
+            catalog=properties,
+            key=_catalog_index["key"] + 1,
+            entries=entries,
+            locations=locations
+        )
+        _result_cache.clear()
+        logger.info(f"Built inline search index for {len(entries)} properties")
+    return _catalog_index
+
+def normalize_query(query_text):
+    """Normalize inline query text so equivalent queries share a cache entry"""
+    return " ".join(query_text.lower().split())
+
+def parse_query(query_text, locations):
+    """
+    Split inline query text into a location, a bedroom filter and free-text terms
+
+    Args:
+        query_text (str): Normalized query text, e.g. "lavington 3br"
+        locations (list): Known locations, longest first
+
+    Returns:
+        tuple: (location or None, minimum bedrooms or None, list of remaining terms)
+    """
+    text = query_text
+
+    min_bedrooms = None
+    bedroom_match = BEDROOMS_PATTERN.search(text)
+    if bedroom_match:
+        min_bedrooms = int(bedroom_match.group(1))
+        text = text[:bedroom_match.start()] + text[bedroom_match.end():]
+
+    location = None
+    for candidate in locations:
+        if candidate.lower() in text:
+            location = candidate
+            text = text.replace(candidate.lower(), " ")
+            break
+
+    terms = text.split()
+    if location is None:
+        # Allow a partly typed location, e.g. "lavi" while the user is still typing
+        for term in terms:
+            if len(term) < 3:
+                continue
+            prefix_matches = [candidate for candidate in locations if candidate.lower().startswith(term)]
+            if prefix_matches:
+                location = prefix_matches[0]
+                terms.remove(term)
+                break
+
+    return location, min_bedrooms, terms
+
+def search_catalog(query_text, properties):
+    """
+    Find the properties in the catalog that match an inline query
+
+    Results are cached per normalized query, so many users typing the same
+    prefix don't repeat the search.
+
+    Args:
+        query_text (str): Text typed after the bot's username
+        properties (list): Property catalog to search
+
+    Returns:
+        list: Matching property dictionaries
+    """
+    index = _get_catalog_index(properties)
+    query = normalize_query(query_text)
+
+    cached = _result_cache.get(query)
+    if cached and cached[0] == index["key"] and time.time() - cached[1] < INLINE_RESULT_CACHE_TTL:
+        _result_cache.move_to_end(query)
+        return cached[2]
+
+    location, min_bedrooms, terms = parse_query(query, index["locations"])
+    location = location.lower() if location else None
+
+    matches = []
+    for entry in index["entries"]:
+        if location and entry["location"] != location:
+            continue
+        if min_bedrooms is not None and (entry["bedrooms"] is None or entry["bedrooms"] < min_bedrooms):
+            continue
+        if terms and not all(term in entry["text"] for term in terms):
+            continue
+        matches.append(entry["property"])
+
+    _result_cache[query] = (index["key"], time.time(), matches)
+    _result_cache.move_to_end(query)
+    while len(_result_cache) > INLINE_RESULT_CACHE_SIZE:
+        _result_cache.popitem(last=False)
+
+    return matches
+
+def query_location(query_text, properties):
+    """
+    Get the location an inline query refers to, if any
+
+    Args:
+        query_text (str): Text typed after the bot's username
+        properties (list): Property catalog being searched
+
+    Returns:
+        str: Location name or None
+    """
+    index = _get_catalog_index(properties)
+    return parse_query(normalize_query(query_text), index["locations"])[0]
@@ -1,10 +1,21 @@
 import logging
 import asyncio
 import signal
-from bot import create_bot
-from config import TELEGRAM_TOKEN
-from alert_service import start_property_alert_service
+from bot import create_bot, preload_popular_locations, stop_cache_warmer
+from config import TELEGRAM_TOKEN, NOTIFICATION_WORKERS, METRICS_PORT
+from alert_service import schedule_alert_jobs, start_notification_worker
+from scheduler import scheduler
 from app import app
+from db_helpers import load_sent_filter
+from async_db import dispose_engine
+from user_registry import start_activity_flusher, stop_activity_flusher
+from migrations import migrate
+from webhooks import webhooks
+from metrics import start_metrics_server, add_route
+from tracing import tracer, start_trace_exporter, stop_trace_exporter
+
+# Serve the WordPress webhook from the Flask app (gunicorn main:app)
+app.register_blueprint(webhooks)
 
 # Set up logging
 logging.basicConfig(
@@ -26,8 +37,27 @@ async def main():
     # Create a bot instance for the alert service to use for sending notifications
     bot = application.bot
     
-    # Schedule the alert service as a background task
-    asyncio.create_task(start_property_alert_service(bot))
+    # Load the sent notifications before the first sync needs them for dedupe
+    with app.app_context():
+        load_sent_filter()
+    
+    # Schedule the catalog reconciliation; the scheduler keeps runs from overlapping across processes
+    schedule_alert_jobs(scheduler)
+    scheduler.start()
+    
+    # Deliver queued alerts; other bot processes run their own workers against the same outbox
+    for worker_number in range(NOTIFICATION_WORKERS):
+        asyncio.create_task(start_notification_worker(bot, worker_number))
+    
+    # Write user activity collected by the handlers in periodic bulk updates
+    start_activity_flusher()
+    
+    # Expose the handler, Telegram and delivery metrics and the update traces of this process,
+    # which gunicorn's /metrics and /traces can't see
+    if METRICS_PORT:
+        add_route("/traces", "application/json", tracer.to_json)
+        start_metrics_server(METRICS_PORT)
+    start_trace_exporter()
     
     # Run the bot until the user presses Ctrl-C
     logger.info("Starting bot with alert service...")
@@ -35,6 +65,9 @@ async def main():
     await application.start()
     await application.updater.start_polling()
     
+    # post_init only runs with run_polling(), so warm the popular locations here
+    await preload_popular_locations(application)
+    
     try:
         # Use a signal-based approach to keep the application running
         stop_signal = asyncio.Event()
@@ -43,8 +76,13 @@ async def main():
         async def stop_bot():
             # Stop the polling and shutdown the bot
             await application.updater.stop_polling()
+            await stop_cache_warmer()
+            await scheduler.stop()
             await application.stop()
             await application.shutdown()
+            await stop_activity_flusher()
+            await stop_trace_exporter()
+            await dispose_engine()
             # Set the signal to indicate we're done
             stop_signal.set()
         
@@ -66,8 +104,17 @@ async def main():
         logger.error(f"Error in main loop: {e}")
         # Make sure to stop the application properly
         await application.updater.stop_polling()
+        await stop_cache_warmer()
+        await scheduler.stop()
         await application.stop()
         await application.shutdown()
+        await stop_activity_flusher()
+        await stop_trace_exporter()
+        await dispose_engine()
 
 if __name__ == '__main__':
+    # Bring the schema up to date before anything queries it; a no-op once it is.
+    # gunicorn main:app imports this module in every worker, so it never migrates: run python migrations.py first
+    with app.app_context():
+        migrate()
     asyncio.run(main())
\ No newline at end of file
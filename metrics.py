@@ -0,0 +1,383 @@
+"""
+Prometheus metrics of this process, served in the text exposition format
+
+Every process keeps its own registry: the Flask app serves it at /metrics,
+and the bot and the delivery-only workers on METRICS_PORT. Recording is a
+dictionary lookup, a lock and an addition, so the metrics stay on in
+production; label values must come from small fixed sets (handler names, API
+methods), never from user input.
+"""
+import time
+import logging
+import threading
+from bisect import bisect_left
+from functools import wraps
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from telegram.request import HTTPXRequest
+from tracing import span, record_span
+
+# Set up logging
+logging.basicConfig(
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    level=logging.INFO
+)
+logger = logging.getLogger(__name__)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Upper bounds in seconds of the latency histogram buckets, from 1 ms to 30 s
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+# Finer buckets for database queries, from 0.1 ms
+QUERY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1, 5)
+# Catalog syncs take seconds to minutes
+SYNC_BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+def _labels(names, values, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in (*zip(names, values), *extra)]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def _number(value):
+    if value == float('inf'):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class _CounterChild:
+    __slots__ = ('_lock', 'value')
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.value = 0
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+class _HistogramChild:
+    __slots__ = ('_lock', 'buckets', 'counts', 'sum')
+
+    def __init__(self, buckets):
+        self._lock = threading.Lock()
+        self.buckets = buckets
+        # One count per bucket plus +Inf, not cumulative until rendered
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+
+    def observe(self, value):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+
+    def time(self):
+        """Context manager observing the seconds its block takes"""
+        return _Timer(self)
+
+class _Timer:
+    __slots__ = ('child', 'started')
+
+    def __init__(self, child):
+        self.child = child
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.child.observe(time.perf_counter() - self.started)
+
+class Metric:
+    """A metric family: one child per combination of label values"""
+
+    type = None
+
+    def __init__(self, name, documentation, labelnames=(), registry=None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        self._lock = threading.Lock()
+        (registry or REGISTRY).register(self)
+
+    def labels(self, *values):
+        """Get the child for a combination of label values; hot paths can keep it"""
+        child = self._children.get(values)
+        if child is None:
+            if len(values) != len(self.labelnames):
+                raise ValueError(f"{self.name} takes the labels {self.labelnames}")
+            with self._lock:
+                child = self._children.setdefault(tuple(str(value) for value in values), self._new_child())
+                self._children[values] = child
+        return child
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def _samples(self):
+        """Yield the exposition lines of every child"""
+        raise NotImplementedError
+
+    def _unique_children(self):
+        # labels() keys a child by the values as given and as strings; render each once
+        seen = set()
+        for values, child in list(self._children.items()):
+            if id(child) not in seen and all(isinstance(value, str) for value in values):
+                seen.add(id(child))
+                yield values, child
+
+    def render(self):
+        lines = [f"# HELP {self.name} {_escape(self.documentation)}", f"# TYPE {self.name} {self.type}"]
+        lines.extend(self._samples())
+        return "\n".join(lines)
+
+class Counter(Metric):
+    """A count that only goes up; Prometheus derives rates from it"""
+
+    type = "counter"
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def inc(self, amount=1):
+        self.labels().inc(amount)
+
+    def _samples(self):
+        for values, child in self._unique_children():
+            yield f"{self.name}{_labels(self.labelnames, values)} {_number(child.value)}"
+
+class Histogram(Metric):
+    """Observations counted into buckets, with their sum, for latency quantiles"""
+
+    type = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS, registry=None):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames, registry)
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value):
+        self.labels().observe(value)
+
+    def _samples(self):
+        for values, child in self._unique_children():
+            with child._lock:
+                counts, total = list(child.counts), child.sum
+            cumulative = 0
+            for bound, count in zip((*self.buckets, float('inf')), counts):
+                cumulative += count
+                yield f"{self.name}_bucket{_labels(self.labelnames, values, [('le', _number(bound))])} {cumulative}"
+            yield f"{self.name}_sum{_labels(self.labelnames, values)} {_number(total)}"
+            yield f"{self.name}_count{_labels(self.labelnames, values)} {cumulative}"
+
+class Registry:
+    """The metrics of a process"""
+
+    def __init__(self):
+        self._metrics = {}
+
+    def register(self, metric):
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric {metric.name} is already registered")
+        self._metrics[metric.name] = metric
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format"""
+        return "\n".join(metric.render() for metric in self._metrics.values()) + "\n"
+
+REGISTRY = Registry()
+
+# Bot handlers
+BOT_HANDLER_SECONDS = Histogram(
+    "bot_handler_duration_seconds", "Time a bot.py handler took to answer an update", ["handler"]
+)
+BOT_HANDLER_ERRORS = Counter(
+    "bot_handler_errors_total", "Updates whose handler raised an exception", ["handler"]
+)
+
+# WordPress API client
+WP_REQUEST_SECONDS = Histogram(
+    "wordpress_request_duration_seconds", "Latency of WordPress API requests", ["endpoint"]
+)
+WP_REQUESTS = Counter(
+    "wordpress_requests_total", "WordPress API requests by HTTP status, or error when none was received",
+    ["endpoint", "status"]
+)
+WP_RESPONSE_BYTES = Counter(
+    "wordpress_response_bytes_total", "Bytes of WordPress API response bodies", ["endpoint"]
+)
+
+# Caches: "catalog" is api._cache, "display" is bot.property_display_cache
+CACHE_LOOKUPS = Counter(
+    "cache_lookups_total", "Cache lookups by whether a fresh value was found", ["cache", "result"]
+)
+CACHE_EVICTIONS = Counter(
+    "cache_evictions_total", "Cache entries dropped because they expired or their namespace was invalidated",
+    ["cache", "reason"]
+)
+
+# Database
+DB_QUERY_SECONDS = Histogram(
+    "db_query_duration_seconds", "Time from sending a statement to the database until its result arrived",
+    ["engine", "statement"], buckets=QUERY_BUCKETS
+)
+
+# Alert pipeline
+ALERT_SYNC_SECONDS = Histogram(
+    "alert_sync_duration_seconds", "Time a listing sync took, including queueing its alerts",
+    ["trigger"], buckets=SYNC_BUCKETS
+)
+ALERT_SYNC_LISTINGS = Counter(
+    "alert_sync_listings_total", "Listings a sync found added, changed or removed", ["change"]
+)
+NOTIFICATIONS = Counter(
+    "notifications_total", "Alert notifications by the outcome of their delivery attempt", ["result"]
+)
+
+# Telegram Bot API
+TELEGRAM_REQUEST_SECONDS = Histogram(
+    "telegram_request_duration_seconds", "Latency of outbound Telegram Bot API calls", ["method"]
+)
+TELEGRAM_REQUESTS = Counter(
+    "telegram_requests_total", "Outbound Telegram Bot API calls by HTTP status, or error when none was received",
+    ["method", "status"]
+)
+
+def timed_handler(callback):
+    """Wrap a bot handler callback to record its latency and errors under its function name, and trace it"""
+    if getattr(callback, "__wrapped_handler__", False):
+        return callback
+    name = callback.__name__
+    span_name = f"handler.{name}"
+    latency = BOT_HANDLER_SECONDS.labels(name)
+    errors = BOT_HANDLER_ERRORS.labels(name)
+
+    @wraps(callback)
+    async def wrapper(update, context):
+        started = time.perf_counter()
+        try:
+            with span(span_name):
+                return await callback(update, context)
+        except Exception:
+            errors.inc()
+            raise
+        finally:
+            latency.observe(time.perf_counter() - started)
+
+    wrapper.__wrapped_handler__ = True
+    return wrapper
+
+def instrument_handlers(application, wrap=timed_handler):
+    """
+    Wrap every handler callback of a python-telegram-bot application, including those in conversations
+
+    Args:
+        application (Application): The application, after its handlers were added
+        wrap (function): Takes a callback and returns its replacement; timed_handler() by default
+    """
+    def instrument(handler):
+        nested = getattr(handler, "entry_points", None)
+        if nested is not None:
+            # A ConversationHandler
+            for child in (*handler.entry_points, *handler.fallbacks,
+                          *(child for children in handler.states.values() for child in children)):
+                instrument(child)
+        elif hasattr(handler, "callback"):
+            handler.callback = wrap(handler.callback)
+
+    for handlers in application.handlers.values():
+        for handler in handlers:
+            instrument(handler)
+
+class MeteredHTTPXRequest(HTTPXRequest):
+    """Telegram Bot API transport that records the latency and status of every call, and traces it"""
+
+    async def do_request(self, url, method, request_data=None, **kwargs):
+        # The Bot API method is the last path segment, e.g. .../bot<token>/sendMessage
+        api_method = url.rsplit('/', 1)[-1]
+        started = time.perf_counter()
+        status = "error"
+        try:
+            with span(f"telegram.{api_method}") as current:
+                status, body = await super().do_request(url, method, request_data, **kwargs)
+                current.set_attribute("status", status)
+            return status, body
+        finally:
+            TELEGRAM_REQUEST_SECONDS.labels(api_method).observe(time.perf_counter() - started)
+            TELEGRAM_REQUESTS.labels(api_method, status).inc()
+
+def _statement_kind(statement):
+    verb = statement.lstrip()[:6].upper()
+    return verb if verb in ("SELECT", "INSERT", "UPDATE", "DELETE") else "OTHER"
+
+def instrument_engine(engine, name):
+    """
+    Record the latency of every statement run by a (sync) SQLAlchemy engine, and trace it
+
+    Args:
+        engine (Engine): The engine, or an AsyncEngine's sync_engine
+        name (str): The engine label, e.g. "sync" or "async"
+    """
+    from sqlalchemy import event
+
+    if getattr(engine, "_metrics_instrumented", False):
+        return engine
+
+    # Structure: {statement: (histogram child, span name)}; compiled statements are cached strings, so this is a hashed lookup
+    children = {}
+    perf_counter = time.perf_counter
+
+    def before_cursor_execute(connection, cursor, statement, parameters, context, executemany):
+        context._query_started = perf_counter()
+
+    def after_cursor_execute(connection, cursor, statement, parameters, context, executemany):
+        started = context._query_started
+        elapsed = perf_counter() - started
+        entry = children.get(statement)
+        if entry is None:
+            if len(children) >= 10_000:
+                children.clear()
+            kind = _statement_kind(statement)
+            entry = children[statement] = (DB_QUERY_SECONDS.labels(name, kind), f"db.{kind}")
+        entry[0].observe(elapsed)
+        record_span(entry[1], started, elapsed, statement=statement)
+
+    event.listen(engine, "before_cursor_execute", before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", after_cursor_execute)
+    engine._metrics_instrumented = True
+    return engine
+
+# Pages of the metrics server. Structure: {path: (content type, function returning the body)}
+SERVER_ROUTES = {"/metrics": (CONTENT_TYPE, REGISTRY.render)}
+
+def add_route(path, content_type, render):
+    """Serve another page from the metrics server, e.g. /traces"""
+    SERVER_ROUTES[path] = (content_type, render)
+
+class _MetricsRequestHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        route = SERVER_ROUTES.get(self.path.split('?', 1)[0])
+        if route is None:
+            self.send_error(404)
+            return
+        content_type, render = route
+        body = render().encode('utf-8')
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # Scrapes every few seconds would flood the log
+        pass
+
+def start_metrics_server(port, host="0.0.0.0"):
+    """Serve /metrics (and added routes) of this process on a port, from a daemon thread; for processes without the Flask app"""
+    server = ThreadingHTTPServer((host, port), _MetricsRequestHandler)
+    threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+    logger.info(f"Serving metrics on http://{host}:{port}/metrics")
+    return server
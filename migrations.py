@@ -0,0 +1,215 @@
+"""
+Versioned schema migrations
+
+Each migration runs once per database, in its own transaction, and is recorded
+in schema_migrations. A lock serializes processes that start at the same time,
+so only one of them applies a pending migration: an advisory lock on
+PostgreSQL, the database write lock on SQLite.
+
+The baseline migration creates any missing table from the current models, so
+on a fresh database later migrations find their changes already made: every
+migration after the baseline must be idempotent (IF NOT EXISTS, IF EXISTS).
+New indexes also belong in the model's __table_args__ for the same reason.
+Statements must run on PostgreSQL and SQLite alike, or be wrapped in
+on_postgresql() when they only upgrade schemas that predate the SQLite mode.
+
+Usage: python migrations.py [--list | --rewrite-listing-details]
+
+--rewrite-listing-details is maintenance rather than a migration: it depends
+on LISTING_DETAILS and LISTING_RAW_PAYLOADS, so run it again after changing them.
+"""
+import sys
+import logging
+from datetime import datetime
+from sqlalchemy import bindparam, inspect, select, update
+from models import db, PropertyListing, ListingPayload, DataVersion
+
+# Set up logging
+logging.basicConfig(
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    level=logging.INFO
+)
+logger = logging.getLogger(__name__)
+
+# Key of the advisory lock held while migrating
+MIGRATION_LOCK_KEY = 7_413_502
+
+def create_tables(connection):
+    """Create the tables of the models that don't exist yet"""
+    db.metadata.create_all(bind=connection)
+
+def on_postgresql(*statements):
+    """Statements that only run on PostgreSQL; a SQLite database gets their result from create_tables"""
+    def run(connection):
+        if connection.dialect.name == "postgresql":
+            for statement in statements:
+                connection.execute(db.text(statement))
+    return run
+
+def rewrite_listing_details(batch_size=1000):
+    """
+    Rewrite stored listing details to the current LISTING_DETAILS policy; call within an app context
+    
+    Compacts details stored as whole API payloads, keeping the payloads in
+    listing_payloads if LISTING_RAW_PAYLOADS is set. Each batch commits on its
+    own, so an interrupted run can simply be started again.
+    
+    Returns:
+        int: Number of listings rewritten
+    """
+    # Only this command depends on the listing settings and the sync code
+    from db_helpers import listing_details, listing_payloads_statement, listing_payload_rows
+    from config import LISTING_RAW_PAYLOADS
+    
+    listings = PropertyListing.__table__
+    rewrite = (
+        update(listings)
+        .where(listings.c.id == bindparam("listing_id"))
+        .values(details=bindparam("compact_details", type_=listings.c.details.type))
+    )
+    last_id = 0
+    rewritten = 0
+    while True:
+        with db.engine.begin() as connection:
+            rows = connection.execute(
+                select(listings.c.id, listings.c.content_hash, listings.c.details)
+                .where(listings.c.id > last_id)
+                .order_by(listings.c.id)
+                .limit(batch_size)
+            ).all()
+            if not rows:
+                break
+            last_id = rows[-1].id
+            changed = []
+            payloads = {}
+            for row in rows:
+                if not row.details:
+                    continue
+                details = listing_details(row.details)
+                if details != row.details:
+                    changed.append({"listing_id": row.id, "compact_details": details})
+                    if LISTING_RAW_PAYLOADS and row.content_hash:
+                        payloads[row.content_hash] = row.details
+            if changed:
+                connection.execute(rewrite, changed)
+                rewritten += len(changed)
+            if payloads:
+                connection.execute(listing_payloads_statement(), listing_payload_rows(payloads))
+    logger.info(f"Rewrote the details of {rewritten} listings")
+    return rewritten
+
+# Structure: [(version, description, [SQL statement or function taking a connection])]
+MIGRATIONS = [
+    (1, "Baseline schema", [
+        create_tables,
+        on_postgresql(
+            # Numeric price used by set-based alert matching
+            "ALTER TABLE property_listings ADD COLUMN IF NOT EXISTS price_value BIGINT",
+            "UPDATE property_listings SET price_value = CAST(price AS BIGINT) "
+            "WHERE price_value IS NULL AND price ~ '^[0-9]{1,18}$'",
+            # Content hashes and removal tracking for change detection
+            "ALTER TABLE property_listings ADD COLUMN IF NOT EXISTS status VARCHAR(50)",
+            "ALTER TABLE property_listings ADD COLUMN IF NOT EXISTS content_hash VARCHAR(40)",
+            "ALTER TABLE property_listings ADD COLUMN IF NOT EXISTS removed_at TIMESTAMP",
+            "ALTER TABLE property_alerts ADD COLUMN IF NOT EXISTS notify_price_drops BOOLEAN NOT NULL DEFAULT FALSE",
+            # Notifications are unique per event, so a price drop can follow a new listing alert
+            "ALTER TABLE alert_notifications ADD COLUMN IF NOT EXISTS event VARCHAR(50) NOT NULL DEFAULT 'new'",
+            "ALTER TABLE alert_notifications DROP CONSTRAINT IF EXISTS uq_user_property",
+            "DO $$ BEGIN "
+            "IF NOT EXISTS (SELECT 1 FROM pg_constraint WHERE conname = 'uq_user_property_event') THEN "
+            "ALTER TABLE alert_notifications ADD CONSTRAINT uq_user_property_event UNIQUE (user_id, property_id, event); "
+            "END IF; END $$",
+            # Digest delivery
+            "ALTER TABLE property_alerts ADD COLUMN IF NOT EXISTS delivery_mode VARCHAR(10) NOT NULL DEFAULT 'instant'",
+            "ALTER TABLE notification_outbox ADD COLUMN IF NOT EXISTS digest VARCHAR(10)",
+        ),
+        # Alert previews and backfills
+        "CREATE INDEX IF NOT EXISTS ix_listings_current_location_price "
+        "ON property_listings (location, price_value, bedrooms) WHERE removed_at IS NULL",
+        "CREATE INDEX IF NOT EXISTS ix_listings_current_price "
+        "ON property_listings (price_value, bedrooms) WHERE removed_at IS NULL",
+    ]),
+    (2, "Indexes for the hot queries in db_helpers", [
+        # get_user_alerts and get_user_alert: a user's active alerts
+        "CREATE INDEX IF NOT EXISTS ix_alerts_active_user "
+        "ON property_alerts (user_id, location) WHERE is_active",
+        # get_new_properties_since
+        "CREATE INDEX IF NOT EXISTS ix_listings_first_seen ON property_listings (first_seen)",
+        # get_matching_properties_for_alert: newest current listings in a location
+        "CREATE INDEX IF NOT EXISTS ix_listings_current_location_first_seen "
+        "ON property_listings (location, first_seen, bedrooms) WHERE removed_at IS NULL",
+        # Lookups by property; uq_user_property_event only serves lookups by user
+        "CREATE INDEX IF NOT EXISTS ix_notifications_property_user "
+        "ON alert_notifications (property_id, user_id)",
+        # get_outbox_stats: delivered in the last window, and failed notifications
+        "CREATE INDEX IF NOT EXISTS ix_outbox_status_delivered_at "
+        "ON notification_outbox (status, delivered_at)",
+    ]),
+    # Compacting the existing details is python migrations.py --rewrite-listing-details
+    (3, "Table of raw listing payloads", [
+        lambda connection: ListingPayload.__table__.create(connection, checkfirst=True),
+    ]),
+    (4, "Data versions that announce alert writes to other processes", [
+        lambda connection: DataVersion.__table__.create(connection, checkfirst=True),
+    ]),
+]
+
+def lock_migrations(connection):
+    """Create schema_migrations if needed and hold the migration lock for the rest of the transaction"""
+    if connection.dialect.name == "postgresql":
+        connection.execute(db.text("SELECT pg_advisory_xact_lock(:key)"), {"key": MIGRATION_LOCK_KEY})
+    connection.execute(db.text(
+        "CREATE TABLE IF NOT EXISTS schema_migrations ("
+        "version INTEGER PRIMARY KEY, description VARCHAR(255) NOT NULL, applied_at TIMESTAMP NOT NULL)"
+    ))
+    if connection.dialect.name == "sqlite":
+        # Any write takes SQLite's database lock, which other writers wait on until the commit
+        connection.execute(db.text("DELETE FROM schema_migrations WHERE version IS NULL"))
+
+def get_applied_versions(connection):
+    """Get the versions already applied to the database"""
+    return {row[0] for row in connection.execute(db.text("SELECT version FROM schema_migrations"))}
+
+def migrate():
+    """
+    Apply every pending migration; call within an app context
+
+    Returns:
+        list: Versions that were applied by this call
+    """
+    applied = []
+    for version, description, statements in MIGRATIONS:
+        with db.engine.begin() as connection:
+            lock_migrations(connection)
+            if version in get_applied_versions(connection):
+                continue
+            logger.info(f"Applying migration {version}: {description}")
+            for statement in statements:
+                if callable(statement):
+                    statement(connection)
+                else:
+                    connection.execute(db.text(statement))
+            connection.execute(
+                db.text(
+                    "INSERT INTO schema_migrations (version, description, applied_at) "
+                    "VALUES (:version, :description, :applied_at)"
+                ),
+                {"version": version, "description": description, "applied_at": datetime.utcnow()}
+            )
+            applied.append(version)
+    if applied:
+        logger.info(f"Applied migrations {', '.join(map(str, applied))}")
+    return applied
+
+if __name__ == "__main__":
+    from app import app
+    with app.app_context():
+        if "--list" in sys.argv:
+            with db.engine.begin() as connection:
+                done = get_applied_versions(connection) if inspect(connection).has_table("schema_migrations") else set()
+            for version, description, _ in MIGRATIONS:
+                print(f"{version:>4}  {'applied' if version in done else 'pending':<8} {description}")
+        elif "--rewrite-listing-details" in sys.argv:
+            rewrite_listing_details()
+        else:
+            migrate()
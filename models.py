@@ -1,10 +1,15 @@
 from datetime import datetime
-from sqlalchemy.dialects.postgresql import JSONB
+from db_backend import JSONType
 from flask_sqlalchemy import SQLAlchemy
 
 # Initialize SQLAlchemy
 db = SQLAlchemy()
 
+# Predicates of the partial indexes, which PostgreSQL and SQLite both support
+ACTIVE_ALERTS = db.text("is_active")
+CURRENT_LISTINGS = db.text("removed_at IS NULL")
+PENDING_NOTIFICATIONS = db.text("status = 'pending'")
+
 class User(db.Model):
     """User model to store Telegram user information"""
     __tablename__ = 'users'
@@ -34,12 +39,22 @@ class PropertyAlert(db.Model):
     min_price = db.Column(db.Integer, nullable=True)  # Optional min price filter
     max_price = db.Column(db.Integer, nullable=True)  # Optional max price filter
     min_bedrooms = db.Column(db.Integer, nullable=True)  # Optional min bedrooms filter
+    notify_price_drops = db.Column(db.Boolean, default=False, nullable=False)  # Also alert when a matching property gets cheaper
+    delivery_mode = db.Column(db.String(10), default='instant', nullable=False)  # instant, hourly or daily digest
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     is_active = db.Column(db.Boolean, default=True)
     
     # Relationships
     user = db.relationship('User', back_populates='subscriptions')
     
+    __table_args__ = (
+        # A user's active alerts, for the alert list and ownership checks
+        db.Index(
+            'ix_alerts_active_user', 'user_id', 'location',
+            postgresql_where=ACTIVE_ALERTS, sqlite_where=ACTIVE_ALERTS
+        ),
+    )
+    
     def __repr__(self):
         filters = []
         if self.location:
@@ -50,6 +65,10 @@ class PropertyAlert(db.Model):
             filters.append(f"max_price={self.max_price}")
         if self.min_bedrooms:
             filters.append(f"min_bedrooms={self.min_bedrooms}")
+        if self.notify_price_drops:
+            filters.append("price_drops")
+        if self.delivery_mode and self.delivery_mode != 'instant':
+            filters.append(f"{self.delivery_mode}_digest")
         
         filter_str = ", ".join(filters) if filters else "no filters"
         return f"<PropertyAlert {self.id}: user_id={self.user_id}, {filter_str}>"
@@ -63,17 +82,51 @@ class PropertyListing(db.Model):
     title = db.Column(db.String(255), nullable=False)
     location = db.Column(db.String(100), nullable=True)
     price = db.Column(db.String(100), nullable=True)  # Store as string to preserve exact format
+    price_value = db.Column(db.BigInteger, nullable=True)  # Numeric price for filtering, None if the price isn't a plain number
     bedrooms = db.Column(db.Integer, nullable=True)
     bathrooms = db.Column(db.Integer, nullable=True)
     thumbnail_url = db.Column(db.String(255), nullable=True)
     property_url = db.Column(db.String(255), nullable=True)
-    details = db.Column(JSONB, nullable=True)  # Store additional property details as JSON
+    status = db.Column(db.String(50), nullable=True)  # Listing status from the API, e.g. "Available" or "Sold"
+    details = db.Column(JSONType, nullable=True)  # Fields of the API payload the bot reads, see LISTING_DETAILS
+    content_hash = db.Column(db.String(40), nullable=True)  # Hash of the API payload, to skip unchanged listings
     first_seen = db.Column(db.DateTime, default=datetime.utcnow)
-    last_updated = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    last_updated = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)  # Last time the content changed
+    removed_at = db.Column(db.DateTime, nullable=True)  # When the listing disappeared from the API, None while listed
+    
+    __table_args__ = (
+        # Alert previews and backfills filter current listings by location, price and bedrooms
+        db.Index(
+            'ix_listings_current_location_price', 'location', 'price_value', 'bedrooms',
+            postgresql_where=CURRENT_LISTINGS, sqlite_where=CURRENT_LISTINGS
+        ),
+        db.Index(
+            'ix_listings_current_price', 'price_value', 'bedrooms',
+            postgresql_where=CURRENT_LISTINGS, sqlite_where=CURRENT_LISTINGS
+        ),
+        # Newest current listings in a location, for backfills
+        db.Index(
+            'ix_listings_current_location_first_seen', 'location', 'first_seen', 'bedrooms',
+            postgresql_where=CURRENT_LISTINGS, sqlite_where=CURRENT_LISTINGS
+        ),
+        db.Index('ix_listings_first_seen', 'first_seen'),
+    )
     
     def __repr__(self):
         return f"<PropertyListing {self.id}: wp_id={self.wp_id}, title={self.title[:20]}...>"
 
+class ListingPayload(db.Model):
+    """Raw WordPress API payloads of listings, compressed and stored once per content hash"""
+    __tablename__ = 'listing_payloads'
+    
+    content_hash = db.Column(db.String(40), primary_key=True)  # PropertyListing.content_hash of the payload
+    payload = db.Column(db.LargeBinary, nullable=False)  # zlib-compressed JSON, only read on demand
+    size = db.Column(db.Integer, nullable=False)  # Uncompressed size in bytes
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    def __repr__(self):
+        return f"<ListingPayload {self.content_hash}: {self.size} bytes>"
+
 class AlertNotification(db.Model):
     """Track which alerts have been sent to avoid duplicate notifications"""
     __tablename__ = 'alert_notifications'
@@ -81,12 +134,82 @@ class AlertNotification(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
     property_id = db.Column(db.Integer, db.ForeignKey('property_listings.id'), nullable=False)
+    event = db.Column(db.String(50), nullable=False, default='new', server_default='new')  # "new" or "price_drop:<price>"
     sent_at = db.Column(db.DateTime, default=datetime.utcnow)
     
-    # Ensure we don't send duplicate notifications to the same user for the same property
+    # Ensure we don't send duplicate notifications to the same user for the same property event
     __table_args__ = (
-        db.UniqueConstraint('user_id', 'property_id', name='uq_user_property'),
+        db.UniqueConstraint('user_id', 'property_id', 'event', name='uq_user_property_event'),
+        # The unique constraint only serves lookups by user
+        db.Index('ix_notifications_property_user', 'property_id', 'user_id'),
     )
     
     def __repr__(self):
-        return f"<AlertNotification {self.id}: user_id={self.user_id}, property_id={self.property_id}>"
\ No newline at end of file
+        return f"<AlertNotification {self.id}: user_id={self.user_id}, property_id={self.property_id}, event={self.event}>"
+
+class NotificationOutbox(db.Model):
+    """Pending alert notifications, delivered by workers that claim them in batches"""
+    __tablename__ = 'notification_outbox'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    property_id = db.Column(db.Integer, db.ForeignKey('property_listings.id'), nullable=False)
+    event = db.Column(db.String(50), nullable=False, default='new')  # Same as AlertNotification.event
+    telegram_id = db.Column(db.BigInteger, nullable=False)  # Chat to deliver to
+    message = db.Column(db.Text, nullable=False)  # Rendered Markdown message
+    image_url = db.Column(db.String(255), nullable=True)  # Sent as a photo with the message as caption
+    digest = db.Column(db.String(10), nullable=True)  # hourly or daily to group into a digest, None to send right away
+    status = db.Column(db.String(20), nullable=False, default='pending')  # pending, delivered or failed
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    next_attempt_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)  # End of the digest window, or backoff after a failed attempt
+    claimed_by = db.Column(db.String(100), nullable=True)  # Worker currently delivering the notification
+    claimed_until = db.Column(db.DateTime, nullable=True)  # Claim expiry, after which another worker may retry
+    last_error = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    delivered_at = db.Column(db.DateTime, nullable=True)
+    
+    __table_args__ = (
+        # A notification is queued at most once, whatever the number of syncing processes
+        db.UniqueConstraint('user_id', 'property_id', 'event', name='uq_outbox_user_property_event'),
+        # Workers only ever scan pending rows that are due
+        db.Index(
+            'ix_outbox_pending_due', 'next_attempt_at',
+            postgresql_where=PENDING_NOTIFICATIONS, sqlite_where=PENDING_NOTIFICATIONS
+        ),
+        # Delivered and failed counts for the status endpoint
+        db.Index('ix_outbox_status_delivered_at', 'status', 'delivered_at'),
+    )
+    
+    def __repr__(self):
+        return f"<NotificationOutbox {self.id}: user_id={self.user_id}, property_id={self.property_id}, status={self.status}>"
+
+class JobState(db.Model):
+    """Persisted state of a scheduled job, shared by every process that runs the scheduler"""
+    __tablename__ = 'job_states'
+    
+    name = db.Column(db.String(100), primary_key=True)
+    interval = db.Column(db.Float, nullable=False)  # Current interval in seconds, adapted to the observed change rate
+    last_started_at = db.Column(db.DateTime, nullable=True)
+    last_finished_at = db.Column(db.DateTime, nullable=True)  # Watermark the next run is scheduled from
+    last_success_at = db.Column(db.DateTime, nullable=True)
+    last_duration = db.Column(db.Float, nullable=True)  # Seconds the last run took
+    last_changes = db.Column(db.Integer, nullable=True)  # Changes found by the last run
+    last_error = db.Column(db.Text, nullable=True)
+    runs = db.Column(db.Integer, nullable=False, default=0)
+    failures = db.Column(db.Integer, nullable=False, default=0)
+    skipped_ticks = db.Column(db.Integer, nullable=False, default=0)  # Ticks dropped because a run was still going
+    locked_by = db.Column(db.String(100), nullable=True)  # Process running the job right now
+    locked_until = db.Column(db.DateTime, nullable=True)  # Lock expiry, in case that process died
+    
+    def __repr__(self):
+        return f"<JobState {self.name}: interval={self.interval}, last_success_at={self.last_success_at}>"
+
+class DataVersion(db.Model):
+    """Version counters of shared data that processes keep in-memory copies of, bumped by every write to it"""
+    __tablename__ = 'data_versions'
+    
+    name = db.Column(db.String(50), primary_key=True)  # What the counter tracks, e.g. property_alerts
+    version = db.Column(db.BigInteger, nullable=False, default=0)
+    
+    def __repr__(self):
+        return f"<DataVersion {self.name}: {self.version}>"
@@ -0,0 +1,94 @@
+import os
+import json
+import math
+import time
+import logging
+from config import POPULARITY_FILE, POPULARITY_HALF_LIFE, POPULARITY_DEDUPE_WINDOW
+
+# Set up logging
+logging.basicConfig(
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    level=logging.INFO
+)
+logger = logging.getLogger(__name__)
+
+# Decaying lookup counts per location
+# Structure: {location: {"score": float, "updated": timestamp}}
+location_scores = {}
+
+# Last time each (user, location) pair was counted, so repeated lookups by one
+# user (e.g. every keystroke of an inline query) only count once per window
+_recent_lookups = {}
+
+def _decayed(entry, now):
+    """Get the score of an entry decayed to the given time"""
+    elapsed = max(0, now - entry["updated"])
+    return entry["score"] * math.pow(0.5, elapsed / POPULARITY_HALF_LIFE)
+
+def record_location_lookup(location, user_id=None):
+    """
+    Count a lookup of a location by a user
+
+    Args:
+        location (str): Location that was looked up
+        user_id (int): Telegram user ID, used to ignore repeated lookups
+    """
+    if not isinstance(location, str) or not location.strip():
+        return
+
+    now = time.time()
+    if user_id is not None:
+        key = (user_id, location)
+        last_seen = _recent_lookups.get(key)
+        if last_seen and now - last_seen < POPULARITY_DEDUPE_WINDOW:
+            return
+        _recent_lookups[key] = now
+        if len(_recent_lookups) > 10000:
+            # Forget pairs that are outside the window
+            for stale_key in [k for k, seen in _recent_lookups.items() if now - seen >= POPULARITY_DEDUPE_WINDOW]:
+                del _recent_lookups[stale_key]
+
+    entry = location_scores.get(location)
+    if entry:
+        entry["score"] = _decayed(entry, now) + 1
+        entry["updated"] = now
+    else:
+        location_scores[location] = {"score": 1.0, "updated": now}
+
+def top_locations(count):
+    """
+    Get the most popular locations by decayed lookup count
+
+    Args:
+        count (int): Number of locations to return
+
+    Returns:
+        list: Location names, most popular first
+    """
+    now = time.time()
+    ranked = sorted(location_scores, key=lambda location: _decayed(location_scores[location], now), reverse=True)
+    return ranked[:count]
+
+def load_popularity():
+    """Load persisted location scores from disk"""
+    if not os.path.exists(POPULARITY_FILE):
+        return
+    try:
+        with open(POPULARITY_FILE) as f:
+            data = json.load(f)
+        for location, entry in data.items():
+            location_scores[location] = {"score": float(entry["score"]), "updated": float(entry["updated"])}
+        logger.info(f"Loaded popularity scores for {len(location_scores)} locations")
+    except (OSError, ValueError, KeyError, TypeError) as e:
+        logger.error(f"Could not load popularity scores: {e}")
+
+def save_popularity():
+    """Persist location scores to disk"""
+    try:
+        # Write to a temporary file first so a crash never leaves a truncated file
+        temp_file = f"{POPULARITY_FILE}.tmp"
+        with open(temp_file, 'w') as f:
+            json.dump(location_scores, f)
+        os.replace(temp_file, POPULARITY_FILE)
+    except OSError as e:
+        logger.error(f"Could not save popularity scores: {e}")
@@ -0,0 +1,145 @@
+import asyncio
+import logging
+from collections import OrderedDict
+from config import PREFETCH_AHEAD, PREFETCH_MAX_CONCURRENCY, IMAGE_CACHE_CHAT_ID, CAPTION_CACHE_SIZE, PHOTO_FILE_ID_CACHE_SIZE
+from utils import format_property_message, get_property_image_url
+
+# Set up logging
+logging.basicConfig(
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    level=logging.INFO
+)
+logger = logging.getLogger(__name__)
+
+# Rendered property captions keyed by (WordPress property ID, modified), least recently used first,
+# so an edited property gets a new caption
+caption_cache = OrderedDict()
+
+# Telegram file_ids keyed by image URL, so Telegram doesn't have to fetch the image again, least recently used first
+photo_file_ids = OrderedDict()
+
+def _remember(cache, key, value, size):
+    """Store a value in an LRU cache, dropping the least recently used entries beyond size"""
+    cache[key] = value
+    cache.move_to_end(key)
+    while len(cache) > size:
+        cache.popitem(last=False)
+
+# Caps how much look-ahead work runs at the same time across all sessions in this process
+prefetch_semaphore = asyncio.Semaphore(PREFETCH_MAX_CONCURRENCY)
+
+# Look-ahead counters for monitoring
+prefetch_stats = {"warmed": 0, "uploaded": 0, "cancelled": 0, "file_id_hits": 0}
+
+def get_property_caption(property_data):
+    """
+    Get the formatted message for a property, rendering it only once
+    
+    Args:
+        property_data (dict): Property data dictionary
+        
+    Returns:
+        str: Formatted markdown message
+    """
+    property_id = property_data.get('id')
+    if property_id is None:
+        return format_property_message(property_data)
+    
+    # WordPress updates modified on every edit, e.g. of the price or status
+    key = (property_id, property_data.get('modified'))
+    caption = caption_cache.get(key)
+    if caption is None:
+        caption = format_property_message(property_data)
+        _remember(caption_cache, key, caption, CAPTION_CACHE_SIZE)
+    else:
+        caption_cache.move_to_end(key)
+    return caption
+
+def get_property_photo(property_data):
+    """
+    Get what to send as the photo of a property: a known file_id or the image URL
+    
+    Args:
+        property_data (dict): Property data dictionary
+        
+    Returns:
+        str: Telegram file_id, image URL or None if the property has no image
+    """
+    image_url = get_property_image_url(property_data)
+    if not image_url:
+        return None
+    
+    file_id = photo_file_ids.get(image_url)
+    if file_id:
+        photo_file_ids.move_to_end(image_url)
+        prefetch_stats["file_id_hits"] += 1
+        return file_id
+    return image_url
+
+def remember_photo_file_id(image_url, message):
+    """Store the file_id Telegram assigned to an image sent by URL"""
+    photos = getattr(message, 'photo', None)
+    if image_url and photos and image_url not in photo_file_ids:
+        # The last size is the largest one, which is what Telegram shows in the chat
+        _remember(photo_file_ids, image_url, photos[-1].file_id, PHOTO_FILE_ID_CACHE_SIZE)
+
+async def warm_property(bot, property_data):
+    """Render the caption and resolve the image file_id of a property ahead of time"""
+    async with prefetch_semaphore:
+        get_property_caption(property_data)
+        
+        image_url = get_property_image_url(property_data)
+        if image_url and image_url not in photo_file_ids and IMAGE_CACHE_CHAT_ID:
+            # Let Telegram fetch the image now, while the user is still looking at the current card
+            message = await bot.send_photo(
+                chat_id=IMAGE_CACHE_CHAT_ID,
+                photo=image_url,
+                disable_notification=True
+            )
+            remember_photo_file_id(image_url, message)
+            prefetch_stats["uploaded"] += 1
+            try:
+                await message.delete()
+            except Exception as e:
+                logger.warning(f"Could not delete image cache message: {e}")
+        
+        prefetch_stats["warmed"] += 1
+
+async def prefetch_properties(bot, properties):
+    """Warm a list of upcoming properties one after another"""
+    for property_data in properties:
+        try:
+            await warm_property(bot, property_data)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.warning(f"Could not prefetch property {property_data.get('id')}: {e}")
+
+def schedule_prefetch(context, properties, current_index):
+    """
+    Start warming the properties after the one currently on screen
+    
+    Any look-ahead still running for the session is cancelled first, so each
+    session has at most one prefetch task.
+    
+    Args:
+        context (CallbackContext): Handler context of the session
+        properties (list): Properties being browsed
+        current_index (int): Index of the property on screen
+    """
+    cancel_prefetch(context)
+    
+    upcoming = properties[current_index + 1:current_index + 1 + PREFETCH_AHEAD]
+    if not upcoming:
+        return
+    
+    context.user_data["prefetch_task"] = context.application.create_task(
+        prefetch_properties(context.bot, upcoming)
+    )
+
+def cancel_prefetch(context):
+    """Cancel the look-ahead of a session if it is still running"""
+    task = context.user_data.pop("prefetch_task", None)
+    if task and not task.done():
+        task.cancel()
+        prefetch_stats["cancelled"] += 1
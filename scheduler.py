@@ -0,0 +1,178 @@
+import os
+import time
+import random
+import socket
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from app import app
+from config import JOB_JITTER, JOB_LOCK_TIMEOUT
+from db_helpers import get_job_state, lock_job, record_job_skipped, finish_job, release_job
+
+# Set up logging
+logging.basicConfig(
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    level=logging.INFO
+)
+logger = logging.getLogger(__name__)
+
+# Run metrics of the jobs scheduled by this process; get_job_states() covers all processes
+# Structure: {name: {"runs", "failures", "skipped_ticks", "last_duration", "max_duration", "interval"}}
+job_stats = {}
+
+class Job:
+    """
+    A periodic job run by the Scheduler
+
+    The function may be a coroutine function or a plain function; plain
+    functions run in a thread so they don't block the bot. If it returns a
+    number of changes, the interval adapts: it halves after a run that found
+    changes and grows by half after one that found none, within
+    [min_interval, max_interval].
+    """
+
+    def __init__(self, name, func, interval, min_interval=None, max_interval=None):
+        self.name = name
+        self.func = func
+        self.interval = interval
+        self.min_interval = min_interval or interval
+        self.max_interval = max_interval or interval
+
+    def next_interval(self, interval, changes):
+        """Adapt the interval to the changes found by the last run"""
+        if changes is None:
+            return interval
+        if changes > 0:
+            return max(self.min_interval, interval / 2)
+        return min(self.max_interval, interval * 1.5)
+
+    async def run(self):
+        """Run the job function once"""
+        if asyncio.iscoroutinefunction(self.func):
+            return await self.func()
+        return await asyncio.to_thread(self.func)
+
+def in_app_context(func, *args):
+    """Call a db_helpers function within an app context; run through asyncio.to_thread so it doesn't block the event loop"""
+    with app.app_context():
+        return func(*args)
+
+def record_job_run(name, owner, duration, interval, changes, error, missed):
+    """Persist a finished run and the ticks that came due while it was going"""
+    with app.app_context():
+        finish_job(name, owner, duration, interval, changes, error)
+        if missed:
+            record_job_skipped(name, missed)
+
+def jittered(interval):
+    """Spread an interval by JOB_JITTER in both directions"""
+    return interval * random.uniform(1 - JOB_JITTER, 1 + JOB_JITTER)
+
+class Scheduler:
+    """
+    Runs periodic jobs without overlap, across all processes sharing the database
+
+    Each job has one loop, so a run never overlaps the previous run in this
+    process, and a database lock keeps other processes from running it at the
+    same time. The next run is scheduled from the persisted finish time of the
+    last run, so restarts neither rerun a job early nor reset its interval.
+    """
+
+    def __init__(self):
+        self.jobs = {}
+        self.tasks = []
+        self.owner = f"{socket.gethostname()}:{os.getpid()}"
+
+    def add(self, job):
+        """Register a job; call before start()"""
+        self.jobs[job.name] = job
+        job_stats[job.name] = {
+            "runs": 0, "failures": 0, "skipped_ticks": 0, "last_duration": None, "max_duration": 0.0,
+            "interval": job.interval
+        }
+        return job
+
+    def start(self):
+        """Start a loop for every registered job"""
+        for job in self.jobs.values():
+            self.tasks.append(asyncio.create_task(self._run_loop(job)))
+        logger.info(f"Scheduler started with jobs: {', '.join(self.jobs)}")
+
+    async def stop(self):
+        """Cancel the job loops and wait for them to finish, including a run in a thread"""
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+
+    async def _next_run(self, job):
+        """Load a job's persisted state and work out when it should next run"""
+        state = await asyncio.to_thread(in_app_context, get_job_state, job.name, job.interval)
+        if state is None:
+            return time.time() + jittered(job.interval)
+        job.interval = state.interval
+        job_stats[job.name]["interval"] = state.interval
+        if state.last_finished_at is None:
+            # Never ran anywhere, so run right away
+            return time.time()
+        watermark = (state.last_finished_at - datetime(1970, 1, 1)).total_seconds()
+        return watermark + jittered(state.interval)
+
+    async def _run_loop(self, job):
+        stats = job_stats[job.name]
+        while True:
+            try:
+                await asyncio.sleep(max(0, await self._next_run(job) - time.time()))
+
+                locked = await asyncio.to_thread(in_app_context, lock_job, job.name, self.owner, JOB_LOCK_TIMEOUT)
+                if not locked:
+                    # Another process is running it; its finish time moves the watermark
+                    stats["skipped_ticks"] += 1
+                    logger.info(f"Skipped job {job.name}: already running in another process")
+                    await asyncio.sleep(jittered(min(job.interval, 60)))
+                    continue
+
+                started = time.time()
+                changes = error = None
+                run = asyncio.ensure_future(job.run())
+                try:
+                    changes = await asyncio.shield(run)
+                except asyncio.CancelledError:
+                    # Shutting down: a coroutine job stops here, but a thread can't be cancelled,
+                    # and releasing the lock while it runs would let another process run it alongside
+                    if asyncio.iscoroutinefunction(job.func):
+                        run.cancel()
+                    await asyncio.wait([run])
+                    await asyncio.to_thread(in_app_context, release_job, job.name, self.owner)
+                    raise
+                except Exception as e:
+                    error = str(e) or type(e).__name__
+                    logger.error(f"Job {job.name} failed: {error}")
+                duration = time.time() - started
+
+                interval = job.next_interval(job.interval, changes) if error is None else job.interval
+                # Ticks that came due while the run was going are dropped, not queued up
+                missed = int(duration // job.interval)
+                await asyncio.to_thread(record_job_run, job.name, self.owner, duration, interval, changes, error, missed)
+
+                stats["runs"] += 1
+                stats["failures"] += error is not None
+                stats["skipped_ticks"] += missed
+                stats["last_duration"] = duration
+                stats["max_duration"] = max(stats["max_duration"], duration)
+                stats["interval"] = interval
+                logger.info(
+                    f"Job {job.name} finished in {duration:.1f} s"
+                    f"{f' with {changes} changes' if changes is not None else ''}, "
+                    f"next run in about {timedelta(seconds=int(interval))} "
+                    f"({stats['runs']} runs, {stats['skipped_ticks']} skipped ticks)"
+                )
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # Keep the loop alive if the database is briefly unavailable
+                logger.error(f"Error in scheduler loop of {job.name}: {e}")
+                await asyncio.sleep(60)
+
+# Process-wide scheduler
+scheduler = Scheduler()
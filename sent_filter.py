@@ -0,0 +1,187 @@
+import math
+import time
+import hashlib
+import logging
+import threading
+from config import SENT_FILTER_CAPACITY, SENT_FILTER_ERROR_RATE, SENT_FILTER_RELOAD_INTERVAL, SENT_FILTER_RELOAD_OVERLAP
+
+# Set up logging
+logging.basicConfig(
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    level=logging.INFO
+)
+logger = logging.getLogger(__name__)
+
+def _notification_key(user_id, property_id, event):
+    return f"{user_id}:{property_id}:{event}".encode('utf-8')
+
+class BloomFilter:
+    """
+    Fixed-size Bloom filter of byte strings
+
+    Membership tests have no false negatives and a false positive rate of
+    about error_rate while it holds no more than capacity items. It uses
+    -capacity * ln(error_rate) / ln(2)^2 bits whatever the size of the items;
+    for a million items at 1% that is 9.6 million bits, about 1.2 MB.
+    """
+
+    def __init__(self, capacity, error_rate):
+        self.capacity = max(1, capacity)
+        self.error_rate = error_rate
+        self.size = max(8, int(math.ceil(-self.capacity * math.log(error_rate) / math.log(2) ** 2)))
+        self.hash_count = max(1, int(round(self.size / self.capacity * math.log(2))))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, key):
+        # Double hashing: k positions from the two halves of one 128-bit digest
+        digest = hashlib.blake2b(key, digest_size=16).digest()
+        position = int.from_bytes(digest[:8], 'little') % self.size
+        step = (int.from_bytes(digest[8:], 'little') | 1) % self.size
+        positions = []
+        for _ in range(self.hash_count):
+            positions.append(position)
+            position = (position + step) % self.size
+        return positions
+
+    def add(self, key):
+        self.add_many((key,))
+
+    def add_many(self, keys):
+        # _positions inlined, since full loads add every sent notification
+        bits, size, hash_count = self.bits, self.size, self.hash_count
+        blake2b, from_bytes = hashlib.blake2b, int.from_bytes
+        for key in keys:
+            digest = blake2b(key, digest_size=16).digest()
+            position = from_bytes(digest[:8], 'little') % size
+            step = (from_bytes(digest[8:], 'little') | 1) % size
+            for _ in range(hash_count):
+                bits[position >> 3] |= 1 << (position & 7)
+                position = (position + step) % size
+            self.count += 1
+
+    def __contains__(self, key):
+        bits = self.bits
+        return all(bits[position >> 3] & (1 << (position & 7)) for position in self._positions(key))
+
+    @property
+    def memory_bytes(self):
+        return len(self.bits)
+
+class SentNotificationFilter:
+    """
+    In-memory membership filter of the notifications already sent
+
+    Dedupe checks ask the filter first: a negative means the notification was
+    certainly not sent when the filter was last refreshed, so only positives
+    have to be confirmed against alert_notifications. Deliveries made by this
+    process are added right away; ones made by other processes arrive with
+    the next incremental refresh. The unique constraints on the outbox and on
+    alert_notifications still rule out a duplicate send in the meantime.
+
+    The filter is rebuilt with twice the room once it holds more notifications
+    than it was sized for, so the false positive rate stays near its target.
+    """
+
+    def __init__(self, capacity=SENT_FILTER_CAPACITY, error_rate=SENT_FILTER_ERROR_RATE):
+        self._filter = BloomFilter(capacity, error_rate)
+        self._lock = threading.Lock()
+        # Highest alert_notifications ID loaded, for incremental refreshes
+        self.watermark = 0
+        self.loaded_at = None
+        self.stats = {"lookups": 0, "positives": 0, "confirmed": 0}
+
+    def __len__(self):
+        return self._filter.count
+
+    @property
+    def full(self):
+        return self._filter.count > self._filter.capacity
+
+    def add(self, user_id, property_id, event):
+        """Add a sent notification"""
+        with self._lock:
+            self._filter.add(_notification_key(user_id, property_id, event))
+
+    def add_rows(self, rows):
+        """
+        Add sent notifications from (id, user_id, property_id, event) rows and advance the watermark
+
+        Rows at or below the watermark that the filter already holds are
+        skipped, so reading them again doesn't count towards its capacity.
+        """
+        watermark = self.watermark
+
+        def keys():
+            for row_id, user_id, property_id, event in rows:
+                key = _notification_key(user_id, property_id, event)
+                if row_id <= watermark and key in self._filter:
+                    continue
+                if row_id > self.watermark:
+                    self.watermark = row_id
+                yield key
+
+        with self._lock:
+            self._filter.add_many(keys())
+
+    def might_contain(self, user_id, property_id, event):
+        """Check whether a notification may have been sent; False is definite"""
+        key = _notification_key(user_id, property_id, event)
+        with self._lock:
+            found = key in self._filter
+        self.stats["lookups"] += 1
+        self.stats["positives"] += found
+        return found
+
+    def reset(self, capacity):
+        """Empty the filter, sized for capacity notifications, before a full reload"""
+        with self._lock:
+            self._filter = BloomFilter(max(capacity, SENT_FILTER_CAPACITY), self._filter.error_rate)
+            self.watermark = 0
+
+    def info(self):
+        """Size and effectiveness of the filter, for the status endpoint"""
+        lookups, positives, confirmed = self.stats["lookups"], self.stats["positives"], self.stats["confirmed"]
+        return {
+            "notifications": self._filter.count,
+            "capacity": self._filter.capacity,
+            "memory_bytes": self._filter.memory_bytes,
+            "hash_count": self._filter.hash_count,
+            "lookups": lookups,
+            "db_confirmations": positives,
+            "false_positives": positives - confirmed,
+            "false_positive_rate": round((positives - confirmed) / lookups, 4) if lookups else None
+        }
+
+# Process-wide filter of sent notifications
+sent_filter = SentNotificationFilter()
+
+def ensure_sent_filter_loaded(load_rows, count_rows):
+    """
+    Load the sent notification filter at first use and refresh it periodically
+
+    The first load and any rebuild of a filter that outgrew its capacity read
+    every sent notification; the periodic refresh reads the rows above the
+    highest ID loaded, less SENT_FILTER_RELOAD_OVERLAP. IDs are handed out
+    when a row is inserted, not when it is committed, so a delivery that
+    committed after a higher ID was loaded would otherwise be missed for good.
+
+    Args:
+        load_rows (function): Takes a minimum ID and yields (id, user_id, property_id, event)
+            rows of sent notifications with a higher ID
+        count_rows (function): Returns the number of sent notifications
+    """
+    now = time.time()
+    if sent_filter.loaded_at is None or sent_filter.full:
+        started = now
+        sent_filter.reset(2 * count_rows())
+        sent_filter.add_rows(load_rows(0))
+        sent_filter.loaded_at = time.time()
+        info = sent_filter.info()
+        logger.info(
+            f"Loaded {info['notifications']} sent notifications into a {info['memory_bytes'] / 1024:.0f} KiB "
+            f"filter in {time.time() - started:.1f} s"
+        )
+    elif now - sent_filter.loaded_at >= SENT_FILTER_RELOAD_INTERVAL:
+        sent_filter.add_rows(load_rows(max(0, sent_filter.watermark - SENT_FILTER_RELOAD_OVERLAP)))
+        sent_filter.loaded_at = now
@@ -0,0 +1,195 @@
+"""
+Local fake of the Telegram Bot API for load tests
+
+Answers the Bot API methods the bot calls with well-formed results after a
+simulated network latency, and remembers the recent messages of every chat so
+a simulated user can tap the buttons the bot actually showed. Nothing is
+delivered anywhere.
+
+Usage:
+    python -m tools.fake_bot_api --port 8081 --latency-ms 50
+
+    # Point the bot at it
+    export TELEGRAM_API_URL=http://localhost:8081/bot
+
+    # Inspect what the bot sent
+    curl localhost:8081/standin/chats/1001
+    curl localhost:8081/standin/stats
+"""
+import json
+import time
+import random
+import logging
+import argparse
+import itertools
+import threading
+from collections import Counter, OrderedDict
+from flask import Flask, jsonify, request
+from werkzeug.serving import WSGIRequestHandler
+
+# Set up logging
+logging.basicConfig(
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    level=logging.INFO
+)
+logger = logging.getLogger(__name__)
+
+fake = Flask(__name__)
+
+# Messages kept per chat, newest last
+MESSAGES_PER_CHAT = 10
+
+BOT_USER = {"id": 1, "is_bot": True, "first_name": "Avier Homes", "username": "AvierHomesBot"}
+
+# Simulated latency of a Bot API round trip, set from the command line
+settings = {"latency": 0.0}
+
+# Recent messages the bot sent or edited. Structure: {chat_id: OrderedDict({message_id: message})}
+chats = {}
+# Calls per Bot API method
+calls = Counter()
+_lock = threading.Lock()
+_message_ids = itertools.count(1)
+_file_ids = itertools.count(1)
+
+def _parameters():
+    """Method parameters, sent as a form (complex values JSON-encoded) or a JSON body"""
+    parameters = request.get_json(silent=True) or {}
+    parameters.update(request.values.to_dict())
+    for key in ("reply_markup", "media"):
+        if isinstance(parameters.get(key), str):
+            parameters[key] = json.loads(parameters[key])
+    return parameters
+
+def _photo_sizes():
+    file_id = f"fake-photo-{next(_file_ids)}"
+    return [
+        {"file_id": f"{file_id}-s", "file_unique_id": f"{file_id}-s", "width": 320, "height": 240},
+        {"file_id": file_id, "file_unique_id": file_id, "width": 1280, "height": 960}
+    ]
+
+def _store(chat_id, message):
+    with _lock:
+        messages = chats.setdefault(chat_id, OrderedDict())
+        messages[message["message_id"]] = message
+        messages.move_to_end(message["message_id"])
+        while len(messages) > MESSAGES_PER_CHAT:
+            messages.popitem(last=False)
+    return message
+
+def _new_message(parameters, **content):
+    chat_id = int(parameters["chat_id"])
+    message = {
+        "message_id": next(_message_ids),
+        "date": int(time.time()),
+        "chat": {"id": chat_id, "type": "private"},
+        "from": BOT_USER,
+        **content
+    }
+    if parameters.get("reply_markup"):
+        message["reply_markup"] = parameters["reply_markup"]
+    return _store(chat_id, message)
+
+def _edit_message(parameters, **content):
+    """Apply an edit to a stored message; a message that fell out of the history is recreated"""
+    chat_id = int(parameters["chat_id"])
+    message_id = int(parameters["message_id"])
+    with _lock:
+        message = dict(chats.get(chat_id, {}).get(message_id) or {
+            "message_id": message_id,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "from": BOT_USER
+        })
+    message.update(content)
+    message["edit_date"] = int(time.time())
+    if parameters.get("reply_markup"):
+        message["reply_markup"] = parameters["reply_markup"]
+    else:
+        message.pop("reply_markup", None)
+    return _store(chat_id, message)
+
+def send_message(parameters):
+    return _new_message(parameters, text=parameters.get("text", ""))
+
+def send_photo(parameters):
+    return _new_message(parameters, photo=_photo_sizes(), caption=parameters.get("caption", ""))
+
+def edit_message_text(parameters):
+    return _edit_message(parameters, text=parameters.get("text", ""))
+
+def edit_message_caption(parameters):
+    return _edit_message(parameters, caption=parameters.get("caption", ""))
+
+def edit_message_media(parameters):
+    media = parameters.get("media") or {}
+    return _edit_message(parameters, photo=_photo_sizes(), caption=media.get("caption", ""))
+
+def edit_message_reply_markup(parameters):
+    return _edit_message(parameters)
+
+def delete_message(parameters):
+    with _lock:
+        chats.get(int(parameters["chat_id"]), {}).pop(int(parameters["message_id"]), None)
+    return True
+
+# Methods with a result other than True
+METHODS = {
+    "getMe": lambda parameters: BOT_USER,
+    "sendMessage": send_message,
+    "sendPhoto": send_photo,
+    "editMessageText": edit_message_text,
+    "editMessageCaption": edit_message_caption,
+    "editMessageMedia": edit_message_media,
+    "editMessageReplyMarkup": edit_message_reply_markup,
+    "deleteMessage": delete_message,
+}
+
+@fake.route('/bot<token>/<method>', methods=['GET', 'POST'])
+def bot_api(token, method):
+    """Answer a Bot API call after the simulated latency"""
+    if settings["latency"]:
+        # Round trips vary; spread them around the configured latency
+        time.sleep(settings["latency"] * random.uniform(0.5, 1.5))
+    with _lock:
+        calls[method] += 1
+    handler = METHODS.get(method)
+    result = handler(_parameters()) if handler else True
+    return jsonify({"ok": True, "result": result})
+
+@fake.route('/standin/chats/<int:chat_id>')
+def chat_messages(chat_id):
+    """Recent messages of a chat, newest last"""
+    with _lock:
+        return jsonify(list(chats.get(chat_id, {}).values()))
+
+@fake.route('/standin/stats')
+def stats():
+    """Calls per Bot API method"""
+    with _lock:
+        return jsonify(dict(calls))
+
+@fake.route('/standin/reset', methods=['POST'])
+def reset():
+    """Forget every chat and call count"""
+    with _lock:
+        chats.clear()
+        calls.clear()
+    return jsonify({"status": "ok"})
+
+def main():
+    parser = argparse.ArgumentParser(description="Local fake of the Telegram Bot API for load tests")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--latency-ms", type=float, default=50, help="Average simulated round trip of a Bot API call")
+    args = parser.parse_args()
+
+    settings["latency"] = args.latency_ms / 1000
+    # Keep the bot's pooled connections open between calls, as api.telegram.org does
+    WSGIRequestHandler.protocol_version = "HTTP/1.1"
+    # A line per call would drown the output of a load test
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)
+    logger.info(f"Fake Bot API on http://127.0.0.1:{args.port}/bot with {args.latency_ms:.0f} ms latency")
+    fake.run(host="127.0.0.1", port=args.port, threaded=True)
+
+if __name__ == "__main__":
+    main()
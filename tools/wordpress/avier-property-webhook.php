@@ -0,0 +1,52 @@
+<?php
+/**
+ * Plugin Name: Avier Property Webhook
+ * Description: Notifies the Avier Homes bot when a property is published, updated or deleted.
+ *
+ * Install as a must-use plugin (wp-content/mu-plugins/) and define in wp-config.php:
+ *   define('AVIER_WEBHOOK_URL', 'https://bot.example.com/webhooks/wordpress');
+ *   define('AVIER_WEBHOOK_SECRET', '...');  // Same value as the bot's WEBHOOK_SECRET
+ */
+
+if (!defined('ABSPATH')) {
+    exit;
+}
+
+function avier_send_property_webhook($action, $post_id) {
+    if (!defined('AVIER_WEBHOOK_URL') || !defined('AVIER_WEBHOOK_SECRET')) {
+        return;
+    }
+    $body = wp_json_encode(array('action' => $action, 'post_id' => $post_id));
+    $timestamp = (string) time();
+    // Same scheme as webhooks.sign_payload(): HMAC-SHA256 of "<timestamp>.<body>"
+    $signature = 'sha256=' . hash_hmac('sha256', $timestamp . '.' . $body, AVIER_WEBHOOK_SECRET);
+    wp_remote_post(AVIER_WEBHOOK_URL, array(
+        'body' => $body,
+        'timeout' => 5,
+        'blocking' => false,  // Never slow down the editor; the bot's reconciliation catches misses
+        'headers' => array(
+            'Content-Type' => 'application/json',
+            'X-Avier-Timestamp' => $timestamp,
+            'X-Avier-Signature' => $signature,
+        ),
+    ));
+}
+
+// Runs after the post, its meta and ACF fields are saved
+add_action('wp_after_insert_post', function ($post_id, $post, $update, $post_before) {
+    if ($post->post_type !== 'property' || wp_is_post_revision($post_id) || wp_is_post_autosave($post_id)) {
+        return;
+    }
+    $was_published = $post_before && $post_before->post_status === 'publish';
+    if ($post->post_status === 'publish') {
+        avier_send_property_webhook($was_published ? 'update' : 'publish', $post_id);
+    } elseif ($was_published) {
+        avier_send_property_webhook($post->post_status === 'trash' ? 'trash' : 'unpublish', $post_id);
+    }
+}, 10, 4);
+
+add_action('before_delete_post', function ($post_id, $post) {
+    if ($post && $post->post_type === 'property') {
+        avier_send_property_webhook('delete', $post_id);
+    }
+}, 10, 2);
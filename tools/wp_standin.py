@@ -0,0 +1,133 @@
+"""
+Local stand-in for the WordPress property API and its webhook plugin
+
+Serves a synthetic catalog on the same routes as WordPress and calls the bot's
+signed webhook whenever a property is published, updated or deleted through the
+admin routes, so push-based sync can be exercised without a WordPress site.
+
+Usage:
+    WEBHOOK_SECRET=... python -m tools.wp_standin --port 8080 \\
+        --webhook-url http://localhost:5000/webhooks/wordpress
+
+    # Point the bot at it
+    export WP_API_URL=http://localhost:8080/wp-json/wp/v2/property
+
+    # Publish, update and delete properties
+    curl -X POST localhost:8080/standin/publish -d '{"acf": {"location": "Karen"}}'
+    curl -X POST localhost:8080/standin/update/3 -d '{"acf": {"price": "25000000"}}'
+    curl -X POST localhost:8080/standin/delete/3
+"""
+import os
+import json
+import time
+import random
+import argparse
+import logging
+import requests
+from flask import Flask, jsonify, request, abort
+from benchmarks.synthetic import make_properties, make_property
+from webhooks import sign_payload, SIGNATURE_HEADER, TIMESTAMP_HEADER
+
+logging.basicConfig(
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    level=logging.INFO
+)
+logger = logging.getLogger(__name__)
+
+standin = Flask(__name__)
+
+# The synthetic catalog, keyed by property ID
+catalog = {}
+
+# Where and how webhooks are sent, set from the command line
+settings = {"webhook_url": None, "secret": None}
+
+def send_webhook(action, property_id):
+    """Call the bot's webhook like the WordPress plugin does"""
+    if not settings["webhook_url"]:
+        return None
+    body = json.dumps({"action": action, "post_id": property_id}).encode('utf-8')
+    timestamp = str(int(time.time()))
+    headers = {
+        "Content-Type": "application/json",
+        TIMESTAMP_HEADER: timestamp,
+        SIGNATURE_HEADER: sign_payload(settings["secret"], timestamp, body)
+    }
+    try:
+        response = requests.post(settings["webhook_url"], data=body, headers=headers, timeout=30)
+        logger.info(f"Webhook {action} {property_id}: {response.status_code} {response.text.strip()}")
+        return response.status_code
+    except requests.exceptions.RequestException as e:
+        logger.error(f"Webhook {action} {property_id} failed: {e}")
+        return None
+
+@standin.route('/wp-json/wp/v2/property')
+def list_properties():
+    """List the catalog a page at a time, with the acf[location] filter the bot uses"""
+    properties = list(catalog.values())
+    location = request.args.get('acf[location]')
+    if location:
+        properties = [property_data for property_data in properties if property_data['acf'].get('location') == location]
+    # Paginated like WordPress: at most 100 per page, the totals in headers, 400 past the last page
+    per_page = min(request.args.get('per_page', 10, type=int), 100)
+    page = request.args.get('page', 1, type=int)
+    total_pages = max(1, -(-len(properties) // per_page))
+    if page < 1 or page > total_pages:
+        return jsonify({"code": "rest_post_invalid_page_number"}), 400
+    response = jsonify(properties[(page - 1) * per_page:page * per_page])
+    response.headers['X-WP-Total'] = str(len(properties))
+    response.headers['X-WP-TotalPages'] = str(total_pages)
+    return response
+
+@standin.route('/wp-json/wp/v2/property/<int:property_id>')
+def get_property(property_id):
+    """Get one property, 404 once it's deleted"""
+    if property_id not in catalog:
+        abort(404)
+    return jsonify(catalog[property_id])
+
+@standin.route('/standin/publish', methods=['POST'])
+def publish_property():
+    """Publish a new synthetic property; the JSON body overrides its fields"""
+    property_id = max(catalog, default=0) + 1
+    property_data = make_property(property_id, random.Random(property_id))
+    overrides = request.get_json(force=True, silent=True) or {}
+    property_data['acf'].update(overrides.pop('acf', {}))
+    property_data.update(overrides)
+    catalog[property_id] = property_data
+    return jsonify({"id": property_id, "webhook_status": send_webhook('publish', property_id)})
+
+@standin.route('/standin/update/<int:property_id>', methods=['POST'])
+def update_property(property_id):
+    """Update a property; the JSON body holds the changed fields"""
+    if property_id not in catalog:
+        abort(404)
+    changes = request.get_json(force=True, silent=True) or {}
+    catalog[property_id]['acf'].update(changes.pop('acf', {}))
+    catalog[property_id].update(changes)
+    catalog[property_id]['modified'] = time.strftime('%Y-%m-%dT%H:%M:%S')
+    return jsonify({"id": property_id, "webhook_status": send_webhook('update', property_id)})
+
+@standin.route('/standin/delete/<int:property_id>', methods=['POST'])
+def delete_property(property_id):
+    """Delete a property"""
+    if catalog.pop(property_id, None) is None:
+        abort(404)
+    return jsonify({"id": property_id, "webhook_status": send_webhook('delete', property_id)})
+
+def main():
+    parser = argparse.ArgumentParser(description="Local stand-in for the WordPress property API and webhooks")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--properties", type=int, default=100, help="Size of the synthetic catalog")
+    parser.add_argument("--webhook-url", help="Bot webhook to call, e.g. http://localhost:5000/webhooks/wordpress")
+    parser.add_argument("--secret", default=os.getenv("WEBHOOK_SECRET"), help="Defaults to WEBHOOK_SECRET")
+    args = parser.parse_args()
+    
+    if args.webhook_url and not args.secret:
+        parser.error("--webhook-url needs --secret or WEBHOOK_SECRET")
+    settings.update(webhook_url=args.webhook_url, secret=args.secret)
+    catalog.update((property_data['id'], property_data) for property_data in make_properties(args.properties))
+    standin.run(host="127.0.0.1", port=args.port)
+
+if __name__ == "__main__":
+    main()
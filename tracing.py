@@ -0,0 +1,341 @@
+"""
+Lightweight in-process tracing of bot updates and webhook calls
+
+A sampled update opens a trace whose root span covers everything the
+application does for it; handlers, WordPress requests, cache lookups,
+database statements and Telegram calls made on its behalf nest as child spans,
+found through a context variable that asyncio tasks and asyncio.to_thread()
+carry along. Finished traces are kept in memory, the most recent ones in a
+ring buffer and the slowest ones since start in a heap, and exported as JSON
+at /traces or to TRACE_EXPORT_PATH. Outside a sampled trace a span is one
+context variable lookup.
+"""
+import os
+import json
+import time
+import heapq
+import random
+import asyncio
+import logging
+import threading
+import itertools
+from collections import deque
+from contextvars import ContextVar
+from datetime import datetime
+from telegram.ext import Application
+from config import (
+    TRACE_SAMPLE_RATE,
+    TRACE_KEEP_SLOWEST,
+    TRACE_BUFFER_SIZE,
+    TRACE_MAX_SPANS,
+    TRACE_EXPORT_PATH,
+    TRACE_EXPORT_INTERVAL
+)
+
+# Set up logging
+logging.basicConfig(
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    level=logging.INFO
+)
+logger = logging.getLogger(__name__)
+
+# Longest attribute value exported, e.g. of an SQL statement
+MAX_ATTRIBUTE_LENGTH = 500
+
+# Span that new spans nest under in the current task or thread, None outside a trace
+_current_span = ContextVar("current_span", default=None)
+
+class Span:
+    """A timed operation within a trace"""
+
+    __slots__ = ('trace', 'name', 'attributes', 'started', 'duration', 'error', 'children')
+
+    def __init__(self, trace, name, attributes, started):
+        self.trace = trace
+        self.name = name
+        self.attributes = attributes
+        self.started = started
+        self.duration = None
+        self.error = None
+        self.children = []
+
+    def set_attribute(self, key, value):
+        self.attributes[key] = value
+
+    def to_dict(self, origin):
+        """The span and its children, with times in milliseconds from origin"""
+        data = {
+            "name": self.name,
+            "start_ms": round((self.started - origin) * 1000, 3),
+            "duration_ms": round(self.duration * 1000, 3) if self.duration is not None else None
+        }
+        if self.attributes:
+            data["attributes"] = {
+                key: value[:MAX_ATTRIBUTE_LENGTH] if isinstance(value, str) else value
+                for key, value in self.attributes.items()
+            }
+        if self.error:
+            data["error"] = self.error
+        if self.children:
+            data["children"] = [child.to_dict(origin) for child in self.children]
+        return data
+
+class Trace:
+    """The spans recorded for one update or webhook call"""
+
+    __slots__ = ('trace_id', 'root', 'started_at', 'spans', 'dropped')
+
+    def __init__(self, name, attributes):
+        self.trace_id = f"{random.getrandbits(64):016x}"
+        self.started_at = time.time()
+        self.root = Span(self, name, attributes, time.perf_counter())
+        self.spans = 1
+        self.dropped = 0
+
+    @property
+    def duration(self):
+        return self.root.duration or 0.0
+
+    def add(self, parent, span):
+        """Attach a span under its parent, unless the trace already holds TRACE_MAX_SPANS"""
+        if self.spans >= TRACE_MAX_SPANS:
+            self.dropped += 1
+            return
+        self.spans += 1
+        parent.children.append(span)
+
+    def to_dict(self):
+        return {
+            "trace_id": self.trace_id,
+            "name": self.root.name,
+            "started_at": datetime.utcfromtimestamp(self.started_at).isoformat(),
+            "duration_ms": round(self.duration * 1000, 3),
+            "spans": self.spans,
+            "dropped_spans": self.dropped,
+            "root": self.root.to_dict(self.root.started)
+        }
+
+class _NullSpan:
+    """Stands in for a span outside a sampled trace; records nothing"""
+
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def set_attribute(self, key, value):
+        pass
+
+NULL_SPAN = _NullSpan()
+
+class _SpanScope:
+    """Context manager timing a child span of the current one"""
+
+    __slots__ = ('parent', 'name', 'attributes', 'span', 'token')
+
+    def __init__(self, parent, name, attributes):
+        self.parent = parent
+        self.name = name
+        self.attributes = attributes
+
+    def __enter__(self):
+        trace = self.parent.trace
+        self.span = Span(trace, self.name, self.attributes, time.perf_counter())
+        trace.add(self.parent, self.span)
+        self.token = _current_span.set(self.span)
+        return self.span
+
+    def __exit__(self, exc_type, exc, traceback):
+        self.span.duration = time.perf_counter() - self.span.started
+        if exc_type is not None:
+            self.span.error = exc_type.__name__
+        _current_span.reset(self.token)
+        return False
+
+class _TraceScope:
+    """Context manager timing the root span of a new trace"""
+
+    __slots__ = ('tracer', 'trace', 'token')
+
+    def __init__(self, tracer, name, attributes):
+        self.tracer = tracer
+        self.trace = Trace(name, attributes)
+
+    def __enter__(self):
+        self.token = _current_span.set(self.trace.root)
+        return self.trace.root
+
+    def __exit__(self, exc_type, exc, traceback):
+        root = self.trace.root
+        root.duration = time.perf_counter() - root.started
+        if exc_type is not None:
+            root.error = exc_type.__name__
+        _current_span.reset(self.token)
+        self.tracer.finish(self.trace)
+        return False
+
+def span(name, **attributes):
+    """
+    Time a block as a child span of the current trace
+
+    Use as "with span(...) as current:"; outside a sampled trace it records nothing.
+
+    Args:
+        name (str): Span name, e.g. "wordpress.catalog" or "cache.display"
+        **attributes: Values describing the operation, kept with the span
+    """
+    parent = _current_span.get()
+    if parent is None:
+        return NULL_SPAN
+    return _SpanScope(parent, name, attributes)
+
+def record_span(name, started, duration, **attributes):
+    """
+    Add a finished child span to the current trace, for operations timed by callbacks
+
+    Args:
+        name (str): Span name
+        started (float): time.perf_counter() when the operation started
+        duration (float): Seconds it took
+        **attributes: Values describing the operation
+    """
+    parent = _current_span.get()
+    if parent is None:
+        return
+    child = Span(parent.trace, name, attributes, started)
+    child.duration = duration
+    parent.trace.add(parent, child)
+
+class Tracer:
+    """
+    Samples traces and keeps the finished ones of this process
+
+    Args:
+        sample_rate (float): Share of trace() calls that record a trace
+        keep_slowest (int): Slowest traces kept since start
+        buffer_size (int): Most recent traces kept
+    """
+
+    def __init__(self, sample_rate=TRACE_SAMPLE_RATE, keep_slowest=TRACE_KEEP_SLOWEST, buffer_size=TRACE_BUFFER_SIZE):
+        self.sample_rate = sample_rate
+        self.keep_slowest = keep_slowest
+        self._lock = threading.Lock()
+        self._recent = deque(maxlen=buffer_size)
+        # Min-heap of (duration, sequence, trace), so the fastest kept trace is replaced first
+        self._slowest = []
+        self._sequence = itertools.count()
+        self.stats = {"traced": 0}
+
+    def trace(self, name, **attributes):
+        """
+        Open a trace if this call is sampled; use as "with tracer.trace(...) as root:"
+
+        Inside a trace, it opens a child span instead, so nested entry points share one trace.
+        """
+        if _current_span.get() is not None:
+            return span(name, **attributes)
+        if self.sample_rate <= 0 or random.random() >= self.sample_rate:
+            return NULL_SPAN
+        return _TraceScope(self, name, attributes)
+
+    def finish(self, trace):
+        """Keep a finished trace in the ring buffer, and among the slowest if it is one of them"""
+        with self._lock:
+            self.stats["traced"] += 1
+            self._recent.append(trace)
+            entry = (trace.duration, next(self._sequence), trace)
+            if len(self._slowest) < self.keep_slowest:
+                heapq.heappush(self._slowest, entry)
+            elif entry[0] > self._slowest[0][0]:
+                heapq.heapreplace(self._slowest, entry)
+
+    def export(self):
+        """
+        The kept traces as a JSON-serializable dictionary
+
+        Returns:
+            dict: Sampling settings, the slowest traces (slowest first) and the recent ones (newest first)
+        """
+        with self._lock:
+            slowest = [trace for _, _, trace in sorted(self._slowest, reverse=True)]
+            recent = list(reversed(self._recent))
+            traced = self.stats["traced"]
+        return {
+            "sample_rate": self.sample_rate,
+            "traced": traced,
+            "exported_at": datetime.utcnow().isoformat(),
+            "slowest": [trace.to_dict() for trace in slowest],
+            "recent": [trace.to_dict() for trace in recent]
+        }
+
+    def to_json(self):
+        return json.dumps(self.export(), separators=(',', ':'))
+
+    def write(self, path):
+        """Write the kept traces to a JSON file, replacing it atomically"""
+        temporary = f"{path}.tmp"
+        with open(temporary, 'w') as f:
+            f.write(self.to_json())
+        os.replace(temporary, path)
+
+# Process-wide tracer
+tracer = Tracer()
+
+def update_attributes(update):
+    """Trace attributes naming the kind of an update, without its user-provided content"""
+    attributes = {"update_id": getattr(update, "update_id", None)}
+    message = getattr(update, "message", None)
+    if message is not None:
+        text = message.text or ""
+        attributes["type"] = "command" if text.startswith("/") else "message"
+        if text.startswith("/"):
+            attributes["command"] = text.split()[0].split("@")[0]
+    elif getattr(update, "callback_query", None) is not None:
+        attributes["type"] = "callback_query"
+        # The prefix names the button, e.g. "property" of "property:next"
+        attributes["callback"] = (update.callback_query.data or "").split(":")[0]
+    elif getattr(update, "inline_query", None) is not None:
+        attributes["type"] = "inline_query"
+    else:
+        attributes["type"] = type(update).__name__
+    return attributes
+
+class TracedApplication(Application):
+    """Application that traces the sampled updates it processes, across all their handlers"""
+
+    async def process_update(self, update):
+        with tracer.trace("update", **update_attributes(update)):
+            await super().process_update(update)
+
+# Background task that writes TRACE_EXPORT_PATH
+exporter_task = None
+
+async def run_trace_exporter(path):
+    """Write the kept traces to a file every TRACE_EXPORT_INTERVAL seconds"""
+    while True:
+        await asyncio.sleep(TRACE_EXPORT_INTERVAL)
+        try:
+            await asyncio.to_thread(tracer.write, path)
+        except Exception as e:
+            logger.error(f"Error writing traces to {path}: {e}")
+
+def start_trace_exporter(path=TRACE_EXPORT_PATH):
+    """Start writing traces to a file in the background, if a path is configured"""
+    global exporter_task
+    if path and (exporter_task is None or exporter_task.done()):
+        exporter_task = asyncio.create_task(run_trace_exporter(path))
+
+async def stop_trace_exporter(path=TRACE_EXPORT_PATH):
+    """Stop the background writes and write the traces kept until now"""
+    global exporter_task
+    if exporter_task and not exporter_task.done():
+        exporter_task.cancel()
+    exporter_task = None
+    if path:
+        try:
+            await asyncio.to_thread(tracer.write, path)
+        except Exception as e:
+            logger.error(f"Error writing traces to {path}: {e}")
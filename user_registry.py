@@ -0,0 +1,140 @@
+import time
+import asyncio
+import logging
+from collections import OrderedDict
+from datetime import datetime
+import async_db
+from config import USER_ACTIVITY_FLUSH_INTERVAL, USER_REGISTRY_MAX_SIZE
+
+# Set up logging
+logging.basicConfig(
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    level=logging.INFO
+)
+logger = logging.getLogger(__name__)
+
+class UserRegistry:
+    """
+    In-memory map of Telegram users to their database IDs, with write-coalesced activity
+
+    The first update from a user in this process resolves the ID with one
+    upsert, which also creates a new user. Later updates are served from
+    memory: their interaction time and any profile change are collected per
+    user and written by flush() with batched UPDATEs, so a busy user costs one
+    row write per flush interval instead of one per message. A crash loses at
+    most the activity collected since the last flush.
+    """
+
+    def __init__(self, max_size=USER_REGISTRY_MAX_SIZE):
+        self.max_size = max_size
+        # Structure: {telegram_id: [user_id, first_name, last_name, username]}, least recently seen first
+        self._users = OrderedDict()
+        # Activity not written yet. Structure: {user_id: [last_interaction, first_name, last_name, username]}
+        self._pending = {}
+        self.stats = {"hits": 0, "misses": 0, "flushes": 0, "flushed_users": 0, "failed_flushes": 0}
+
+    def __len__(self):
+        return len(self._users)
+
+    async def get_user_id(self, telegram_id, first_name=None, last_name=None, username=None):
+        """
+        Get the database ID of a Telegram user and record the interaction
+
+        Returns:
+            int: ID of the user, or None if it couldn't be resolved
+        """
+        entry = self._users.get(telegram_id)
+        if entry is None:
+            self.stats["misses"] += 1
+            user_id = await async_db.upsert_user(telegram_id, first_name, last_name, username)
+            if user_id is not None:
+                self._remember(telegram_id, [user_id, first_name, last_name, username])
+            return user_id
+
+        self.stats["hits"] += 1
+        self._users.move_to_end(telegram_id)
+        self._record(entry, datetime.utcnow(), first_name, last_name, username)
+        return entry[0]
+
+    def _remember(self, telegram_id, entry):
+        self._users[telegram_id] = entry
+        self._users.move_to_end(telegram_id)
+        while len(self._users) > self.max_size:
+            self._users.popitem(last=False)
+
+    def _record(self, entry, now, first_name, last_name, username):
+        """Collect an interaction, and the profile fields that changed, for the next flush"""
+        user_id = entry[0]
+        pending = self._pending.get(user_id)
+        if pending is None:
+            pending = self._pending[user_id] = [now, None, None, None]
+        else:
+            pending[0] = now
+        # As in db_helpers, a profile field only changes when Telegram sent a value
+        for field, value in enumerate((first_name, last_name, username), start=1):
+            if value and value != entry[field]:
+                entry[field] = pending[field] = value
+
+    async def flush(self):
+        """
+        Write the collected activity with batched UPDATEs
+
+        Activity that fails to be written is kept for the next flush.
+
+        Returns:
+            int: Number of users written
+        """
+        if not self._pending:
+            return 0
+        pending, self._pending = self._pending, {}
+        started = time.perf_counter()
+        updated = await async_db.update_user_activity([(user_id, *row) for user_id, row in pending.items()])
+        if updated is None:
+            self.stats["failed_flushes"] += 1
+            # Keep what came in during the flush, it is newer
+            for user_id, row in pending.items():
+                self._pending.setdefault(user_id, row)
+            return 0
+        self.stats["flushes"] += 1
+        self.stats["flushed_users"] += updated
+        logger.info(f"Wrote the activity of {updated} users in {(time.perf_counter() - started) * 1000:.0f} ms")
+        return updated
+
+    def info(self):
+        """Size and effectiveness of the registry"""
+        lookups = self.stats["hits"] + self.stats["misses"]
+        return {
+            "users": len(self._users),
+            "pending": len(self._pending),
+            "hit_ratio": round(self.stats["hits"] / lookups, 4) if lookups else None,
+            **self.stats
+        }
+
+# Process-wide registry of the users seen by the bot
+user_registry = UserRegistry()
+
+# Background task that flushes the registry
+flusher_task = None
+
+async def run_activity_flusher():
+    """Flush the collected user activity every USER_ACTIVITY_FLUSH_INTERVAL seconds"""
+    while True:
+        await asyncio.sleep(USER_ACTIVITY_FLUSH_INTERVAL)
+        try:
+            await user_registry.flush()
+        except Exception as e:
+            logger.error(f"Error flushing user activity: {e}")
+
+def start_activity_flusher():
+    """Start flushing user activity in the background"""
+    global flusher_task
+    if flusher_task is None or flusher_task.done():
+        flusher_task = asyncio.create_task(run_activity_flusher())
+
+async def stop_activity_flusher():
+    """Stop the background flushes and write the activity collected since the last one"""
+    global flusher_task
+    if flusher_task and not flusher_task.done():
+        flusher_task.cancel()
+    flusher_task = None
+    await user_registry.flush()
@@ -58,6 +58,45 @@ def format_property_message(property_data):
     
     return message
 
+# Characters of a title that can't appear in the text of a legacy Markdown link
+DIGEST_TITLE_REPLACEMENTS = str.maketrans({'[': '(', ']': ')', '_': ' ', '*': '', '`': "'"})
+
+def format_digest_line(property_data, dropped_from=None):
+    """
+    Format a property as one compact markdown line of an alert digest
+    
+    Args:
+        property_data (dict): Property data dictionary
+        dropped_from (int): Previous price if the property's price dropped
+        
+    Returns:
+        str: Formatted markdown line
+    """
+    import html
+    from telegram.helpers import escape_markdown
+    title = html.unescape((property_data.get('title') or {}).get('rendered') or "Unnamed Property")
+    # Square brackets would end the link text early, and the link text can't hold escaped entity markers
+    title = title.translate(DIGEST_TITLE_REPLACEMENTS)
+    # A closing parenthesis would end the link early
+    link = (property_data.get('link') or '#').replace(')', '%29')
+    
+    acf = property_data.get('acf') or {}
+    details = [str(value) for value in (acf.get('location'), acf.get('price')) if value not in (None, '')]
+    bedrooms = acf.get('bedrooms')
+    if bedrooms not in (None, ''):
+        # "4 Bedrooms ALL ensuite + DSQ" is shortened to "4 bd"
+        number = str(bedrooms).split()[0]
+        details.append(f"{number} bd" if number.isdigit() else str(bedrooms))
+    
+    icon = "📉" if dropped_from is not None else "🏠"
+    line = f"{icon} [{title}]({link})"
+    if details:
+        # Underscores, asterisks and backticks in the details would open Markdown entities
+        line += f" - {escape_markdown(', '.join(details), version=1)}"
+    if dropped_from is not None:
+        line += f" (was {dropped_from:,})"
+    return line
+
 def get_property_image_url(property_data):
     """
     Extract the featured image URL from property data
@@ -79,3 +118,38 @@ def get_property_image_url(property_data):
         return None
     
     return None
+
+# ACF fields the bot and the alert sync read from a property
+COMPACT_ACF_FIELDS = ('location', 'price', 'bedrooms', 'bathrooms', 'area', 'status')
+
+def compact_property(property_data):
+    """
+    Strip a property from the WordPress API down to the fields we use
+    
+    Args:
+        property_data (dict): Property data dictionary with embedded data
+        
+    Returns:
+        dict: Property with only its ID, modification time, title, link, main ACF fields and featured image
+    """
+    acf = property_data.get('acf') or {}
+    compact = {
+        'id': property_data.get('id'),
+        # Keys the rendered caption of the property, see prefetch.get_property_caption
+        'modified': property_data.get('modified'),
+        'link': property_data.get('link'),
+        'title': {'rendered': (property_data.get('title') or {}).get('rendered', '')},
+        'acf': {field: acf[field] for field in COMPACT_ACF_FIELDS if field in acf}
+    }
+    
+    image_url = get_property_image_url(property_data)
+    if image_url:
+        compact['_embedded'] = {'wp:featuredmedia': [{'source_url': image_url}]}
+    
+    return compact
+
+def compact_properties(properties):
+    """Compact a list of properties, passing None through unchanged"""
+    if properties is None:
+        return None
+    return [compact_property(property_data) for property_data in properties]
@@ -1,4 +1,7 @@
 from app import app
+from migrations import migrate
 
 if __name__ == "__main__":
+    with app.app_context():
+        migrate()
     app.run(host="0.0.0.0", port=5000)
\ No newline at end of file
@@ -0,0 +1,81 @@
+import hmac
+import json
+import time
+import hashlib
+import logging
+from flask import Blueprint, jsonify, request
+from config import WEBHOOK_SECRET, WEBHOOK_MAX_SKEW
+from tracing import tracer
+
+# Set up logging
+logging.basicConfig(
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    level=logging.INFO
+)
+logger = logging.getLogger(__name__)
+
+SIGNATURE_HEADER = 'X-Avier-Signature'
+TIMESTAMP_HEADER = 'X-Avier-Timestamp'
+
+# Property events WordPress sends
+WEBHOOK_ACTIONS = ('publish', 'update', 'delete', 'trash', 'unpublish')
+
+webhooks = Blueprint('webhooks', __name__)
+
+def sign_payload(secret, timestamp, body):
+    """
+    Sign a webhook body the way the WordPress plugin does
+    
+    Args:
+        secret (str): Shared webhook secret
+        timestamp (str): Unix time the call was made, sent in the timestamp header
+        body (bytes): Raw request body
+    
+    Returns:
+        str: Signature header value, "sha256=<hex digest>"
+    """
+    message = timestamp.encode('utf-8') + b'.' + body
+    return "sha256=" + hmac.new(secret.encode('utf-8'), message, hashlib.sha256).hexdigest()
+
+def verify_signature(secret, timestamp, body, signature):
+    """Check a webhook signature and that its timestamp is recent, so old calls can't be replayed"""
+    if not timestamp or not signature:
+        return False
+    try:
+        if abs(time.time() - int(timestamp)) > WEBHOOK_MAX_SKEW:
+            return False
+    except ValueError:
+        return False
+    return hmac.compare_digest(sign_payload(secret, timestamp, body), signature)
+
+@webhooks.route('/webhooks/wordpress', methods=['POST'])
+def wordpress_webhook():
+    """Sync a property that WordPress published, updated or deleted"""
+    if not WEBHOOK_SECRET:
+        return jsonify({'error': 'webhooks are not configured'}), 503
+    
+    body = request.get_data()
+    if not verify_signature(WEBHOOK_SECRET, request.headers.get(TIMESTAMP_HEADER),
+                            body, request.headers.get(SIGNATURE_HEADER)):
+        logger.warning(f"Rejected webhook with an invalid signature from {request.remote_addr}")
+        return jsonify({'error': 'invalid signature'}), 401
+    
+    try:
+        payload = json.loads(body)
+        action = payload['action']
+        property_id = int(payload['post_id'])
+    except (ValueError, TypeError, KeyError):
+        return jsonify({'error': 'expected {"action": ..., "post_id": ...}'}), 400
+    if action not in WEBHOOK_ACTIONS:
+        return jsonify({'error': f'unknown action {action}'}), 400
+    
+    # Imported here so tools/wp_standin.py can sign payloads without a database
+    from alert_service import sync_property
+    
+    logger.info(f"Webhook: property {property_id} {action}")
+    with tracer.trace("webhook", action=action, property_id=property_id):
+        result = sync_property(property_id, action)
+    if result is None:
+        # The reconciliation sync picks the change up later
+        return jsonify({'error': 'sync failed'}), 502
+    return jsonify({'status': 'ok', **result})